@@ -0,0 +1,169 @@
+from dotenv import load_dotenv
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from data_version.version import get_data_version
+
+
+load_dotenv()
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+# cosine similarity a hit needs, per embedding backend: each model spreads paraphrases differently
+# (SEMANTIC_CACHE_THRESHOLD is the gemini one, SEMANTIC_CACHE_THRESHOLD_<BACKEND> the others)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_THRESHOLDS = {
+    "gemini": SEMANTIC_CACHE_THRESHOLD,
+    "onnx": float(os.getenv('SEMANTIC_CACHE_THRESHOLD_ONNX', '0.9')),
+}
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', '86400'))
+
+# csv_url in table / plot answers is relative to the backend folder
+BACKEND_PATH = Path(__file__).parent.parent
+
+# years, float ids, depths...: embeddings barely tell "2019" from "2020", so these must match exactly
+NUMBER_PATTERN = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?")
+
+
+def numeric_literals(query):
+    return sorted(float(number) for number in NUMBER_PATTERN.findall(query or ""))
+
+
+class SemanticAnswerCache:
+    """Final answers keyed on the enhanced query embedding + tab + language.
+
+    A lookup is a hit when the cosine similarity to a stored query embedded by the
+    same backend is at least that backend's entry in `thresholds` and both queries
+    hold the same numbers. Entries expire after `ttl_seconds`, the least recently used one
+    is evicted past `max_entries`, and everything is dropped when the ingest
+    data version changes.
+    """
+
+    def __init__(self, thresholds, max_entries, ttl_seconds):
+        self.thresholds = thresholds
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._data_version = get_data_version()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+    def _normalize(self, embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+    def _drop(self, entry_id):
+        self._entries.pop(entry_id)
+
+
+    def _check_data_version(self):
+        version = get_data_version()
+        if(version != self._data_version):
+            for entry_id in list(self._entries):
+                self._drop(entry_id)
+            self._data_version = version
+            self.invalidations += 1
+
+
+    def lookup(self, embedding, tab, language, query_text, backend):
+        query = self._normalize(embedding)
+        numbers = numeric_literals(query_text)
+        threshold = self.thresholds.get(backend, SEMANTIC_CACHE_THRESHOLD)
+        now = time.time()
+
+        with self._lock:
+            self._check_data_version()
+
+            candidates = []
+            for entry_id, entry in list(self._entries.items()):
+                if(now - entry['created_at'] > self.ttl_seconds):
+                    self._drop(entry_id)
+                    self.evictions += 1
+                    continue
+
+                # vectors of different embedding models can't be compared
+                if(entry['backend'] != backend or entry['tab'] != tab or entry['language'] != language or entry['numbers'] != numbers):
+                    continue
+
+                score = float(np.dot(query, entry['embedding']))
+                if(score >= threshold):
+                    candidates.append((score, entry_id))
+
+            best_id, best_score = None, None
+            for score, entry_id in sorted(candidates, reverse=True):
+                # the artifact store may have evicted the csv since, the next closest answer may still have its own
+                if(self._entries[entry_id]['artifact_path'] != None and not self._entries[entry_id]['artifact_path'].exists()):
+                    self._drop(entry_id)
+                    continue
+                best_id, best_score = entry_id, score
+                break
+
+            if(best_id == None):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            print(f"Semantic cache hit ({best_score:.3f}) : ", self._entries[best_id]['query'])
+
+            return dict(self._entries[best_id]['answer'])
+
+
+    def store(self, embedding, tab, language, query, answer, backend):
+        answer = dict(answer)
+        artifact_path = BACKEND_PATH / answer['csv_url'] if answer.get('csv_url') else None
+
+        with self._lock:
+            self._check_data_version()
+
+            self._next_id += 1
+            self._entries[self._next_id] = {
+                "embedding": self._normalize(embedding),
+                "backend": backend,
+                "tab": tab,
+                "language": language,
+                "query": query,
+                "numbers": numeric_literals(query),
+                "answer": answer,
+                "artifact_path": artifact_path,
+                "created_at": time.time()
+            }
+
+            while(len(self._entries) > self.max_entries):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+        return answer
+
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "thresholds": dict(self.thresholds),
+            "data_version": self._data_version
+        }
+
+
+semantic_cache = SemanticAnswerCache(
+    SEMANTIC_CACHE_THRESHOLDS,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,243 @@
+from dotenv import load_dotenv
+import os
+import json
+import hashlib
+import threading
+import time
+import uuid
+from pathlib import Path
+from data_version.version import get_data_version
+
+
+load_dotenv()
+ARTIFACT_MAX_BYTES = int(os.getenv('ARTIFACT_MAX_BYTES', str(2 * 1024 ** 3)))
+ARTIFACT_TTL_SECONDS = int(os.getenv('ARTIFACT_TTL_SECONDS', str(7 * 24 * 3600)))
+ARTIFACT_COLUMNAR_ENABLED = os.getenv('ARTIFACT_COLUMNAR_ENABLED', 'true').lower() == 'true'
+ARTIFACT_PARQUET_ROW_GROUP = int(os.getenv('ARTIFACT_PARQUET_ROW_GROUP', '65536'))
+
+# Parquet / Arrow IPC copies need the optional pyarrow package, CSV only without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+STATIC_PATH = Path(__file__).parent.parent / "static"
+
+# rows kept in the sidecar for the table tab preview
+PREVIEW_ROWS = 10
+
+# format -> (file suffix, media type); csv_url always points at the csv, the others sit next to it
+ARTIFACT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.stream"),
+}
+
+# tab -> folder under static/
+ARTIFACT_DIRS = {
+    "table": "tables",
+    "plot": "plots",
+}
+
+_evict_lock = threading.Lock()
+
+
+def artifact_id(sql):
+    """Same SQL against the same ingest gives the same artifact"""
+    payload = f"{get_data_version()}\n{sql.strip()}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _paths(kind, sql):
+    folder = ARTIFACT_DIRS[kind]
+    name = artifact_id(sql)
+    csv_path = STATIC_PATH / folder / f"{name}.csv"
+    meta_path = STATIC_PATH / folder / f"{name}.json"
+    return csv_path, meta_path, f"static/{folder}/{name}.csv"
+
+
+def artifact_url(kind, sql):
+    return _paths(kind, sql)[2]
+
+
+def find_artifact(kind, sql):
+    """Returns {"csv_url", "rows", "columns", "preview"} if this result was already published, else None"""
+    csv_path, meta_path, url = _paths(kind, sql)
+
+    try:
+        meta = json.loads(meta_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if(not csv_path.exists()):
+        return None
+
+    # reuse counts as a use for size-based eviction
+    now = time.time()
+    os.utime(meta_path, (now, now))
+
+    return {"csv_url": url, **meta}
+
+
+def describe_result(pg_data):
+    """Row count, columns and the first PREVIEW_ROWS rows, taken from the frame in memory"""
+    return {
+        "rows": len(pg_data),
+        "columns": pg_data.columns.to_list(),
+        # to_json so dates / NaN come out the same way the csv would show them
+        "preview": json.loads(pg_data.head(PREVIEW_ROWS).to_json(orient="records", date_format="iso"))
+    }
+
+
+def _tmp_path(path, token):
+    # private temp name first so readers never see a half written file
+    return path.with_suffix(f"{path.suffix}.{token}.tmp")
+
+
+class _ColumnarWriter:
+    """Appends chunks to a Parquet file and an Arrow IPC stream. The schema comes from
+    the first chunk; if a later chunk doesn't fit it, the columnar copies are dropped"""
+
+    def __init__(self, csv_path, token, first_chunk):
+        self.schema = pa.Table.from_pandas(first_chunk, preserve_index=False).schema
+        self.paths = {
+            fmt: (csv_path.with_suffix(ARTIFACT_FORMATS[fmt][0]), _tmp_path(csv_path.with_suffix(ARTIFACT_FORMATS[fmt][0]), token))
+            for fmt in ("parquet", "arrow")
+        }
+        self.parquet = pq.ParquetWriter(str(self.paths["parquet"][1]), self.schema, compression="zstd")
+        self.sink = pa.OSFile(str(self.paths["arrow"][1]), "wb")
+        self.stream = pa.ipc.new_stream(self.sink, self.schema)
+
+    def write(self, chunk):
+        table = pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False)
+        self.parquet.write_table(table, row_group_size=ARTIFACT_PARQUET_ROW_GROUP)
+        self.stream.write_table(table)
+
+    def _close(self):
+        self.parquet.close()
+        self.stream.close()
+        self.sink.close()
+
+    def commit(self):
+        self._close()
+        for path, tmp_path in self.paths.values():
+            os.replace(tmp_path, path)
+
+    def abort(self):
+        try:
+            self._close()
+        except Exception:
+            pass
+        for _, tmp_path in self.paths.values():
+            tmp_path.unlink(missing_ok=True)
+
+
+def publish_artifact(kind, sql, chunks, on_first_chunk=None):
+    """Writes a result given as an iterable of DataFrame chunks (csv, plus parquet / arrow
+    when available) one chunk at a time, so memory stays at one chunk whatever the row count.
+    on_first_chunk(meta) gets the columns and preview as soon as the first chunk is read"""
+    csv_path, meta_path, url = _paths(kind, sql)
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+
+    token = uuid.uuid4().hex
+    csv_tmp = _tmp_path(csv_path, token)
+    columnar = None
+    meta = None
+
+    try:
+        with open(csv_tmp, "w", newline="") as csv_file:
+            for chunk in chunks:
+                if(meta == None):
+                    meta = describe_result(chunk)
+                    if(on_first_chunk != None):
+                        on_first_chunk(dict(meta))
+                    chunk.to_csv(csv_file, index=False)
+
+                    if(ARTIFACT_COLUMNAR_ENABLED and PYARROW_AVAILABLE):
+                        try:
+                            columnar = _ColumnarWriter(csv_path, token, chunk)
+                        except Exception as e:
+                            print(f"Columnar artifact skipped for {url}: {e}")
+                else:
+                    meta["rows"] += len(chunk)
+                    chunk.to_csv(csv_file, index=False, header=False)
+
+                if(columnar != None):
+                    try:
+                        columnar.write(chunk)
+                    except Exception as e:
+                        # e.g. a column that was all null in the first chunk, the csv is still good
+                        print(f"Columnar artifact dropped for {url}: {e}")
+                        columnar.abort()
+                        columnar = None
+
+        if(meta == None):
+            meta = {"rows": 0, "columns": [], "preview": []}
+
+        os.replace(csv_tmp, csv_path)
+        meta["formats"] = ["csv"]
+
+        if(columnar != None):
+            columnar.commit()
+            meta["formats"] += ["parquet", "arrow"]
+    except BaseException:
+        csv_tmp.unlink(missing_ok=True)
+        if(columnar != None):
+            columnar.abort()
+        raise
+
+    # sidecar goes last, find_artifact only trusts a csv that has one
+    meta_path.write_text(json.dumps(meta))
+
+    evict_artifacts()
+
+    return {"csv_url": url, **meta}
+
+
+def _artifact_groups():
+    """Every published artifact as (last_used, total_bytes, [files])"""
+    groups = []
+    for folder in ARTIFACT_DIRS.values():
+        for meta_path in (STATIC_PATH / folder).glob("*.json"):
+            files = [p for p in meta_path.parent.glob(f"{meta_path.stem}.*") if not p.name.endswith(".tmp")]
+            try:
+                last_used = meta_path.stat().st_mtime
+                size = sum(p.stat().st_size for p in files)
+            except FileNotFoundError:
+                continue
+            groups.append((last_used, size, files))
+
+    return groups
+
+
+def evict_artifacts(max_bytes=ARTIFACT_MAX_BYTES, ttl_seconds=ARTIFACT_TTL_SECONDS):
+    """Drop artifacts older than the TTL, then least recently used ones until under the size budget"""
+    with _evict_lock:
+        groups = sorted(_artifact_groups(), key=lambda g: g[0])
+        now = time.time()
+        total = sum(size for _, size, _ in groups)
+        removed = 0
+
+        for last_used, size, files in groups:
+            if(now - last_used <= ttl_seconds and total <= max_bytes):
+                continue
+
+            for p in files:
+                p.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        return removed
+
+
+def artifact_stats():
+    groups = _artifact_groups()
+    return {
+        "columnar": ARTIFACT_COLUMNAR_ENABLED and PYARROW_AVAILABLE,
+        "artifacts": len(groups),
+        "bytes": sum(size for _, size, _ in groups),
+        "max_bytes": ARTIFACT_MAX_BYTES,
+        "ttl_seconds": ARTIFACT_TTL_SECONDS
+    }
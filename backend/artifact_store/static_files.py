@@ -0,0 +1,115 @@
+import os
+import re
+from pathlib import PurePosixPath
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from artifact_store.artifacts import ARTIFACT_FORMATS
+
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+def requested_format(request):
+    """("parquet" | "arrow" | "csv" | None, strict) from ?format= or the Accept header.
+    An explicit ?format= must be honoured, Accept is only a preference"""
+    fmt = request.query_params.get("format")
+    if(fmt != None):
+        return fmt.lower(), True
+
+    accept = request.headers.get("accept", "")
+    for fmt, (_, media_type) in ARTIFACT_FORMATS.items():
+        if(fmt != "csv" and media_type in accept):
+            return fmt, False
+
+    return None, False
+
+
+def parse_range(range_header, size):
+    """(start, end) inclusive for a single "bytes=" range, None to ignore the header, "unsatisfiable" otherwise"""
+    match = RANGE_PATTERN.match(range_header.strip())
+    if(match == None):
+        # multiple ranges or another unit, answering with the whole file is allowed
+        return None
+
+    start, end = match.groups()
+    if(start == "" and end == ""):
+        return None
+
+    if(start == ""):
+        # suffix range: the last N bytes
+        length = int(end)
+        if(length == 0):
+            return "unsatisfiable"
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = size - 1 if end == "" else min(int(end), size - 1)
+    if(start >= size or start > end):
+        return "unsatisfiable"
+
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while(remaining > 0):
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if(not chunk):
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class ArtifactStaticFiles(StaticFiles):
+    """StaticFiles that serves the Parquet / Arrow IPC copy of a csv artifact when asked
+    (?format=parquet or an Accept header) and answers single byte Range requests with 206"""
+
+    async def get_response(self, path, scope):
+        request = Request(scope)
+
+        fmt, strict = requested_format(request)
+        if(fmt != None and fmt != "csv" and path.endswith(".csv")):
+            if(fmt not in ARTIFACT_FORMATS):
+                return Response(f"Unknown format '{fmt}', expected one of {list(ARTIFACT_FORMATS)}", status_code=400)
+
+            alternative = str(PurePosixPath(path).with_suffix(ARTIFACT_FORMATS[fmt][0]))
+            _, stat_result = self.lookup_path(alternative)
+            if(stat_result != None or strict):
+                path = alternative
+
+        response = await super().get_response(path, scope)
+
+        if(isinstance(response, FileResponse)):
+            suffix = PurePosixPath(path).suffix
+            for media_type_suffix, media_type in ARTIFACT_FORMATS.values():
+                if(suffix == media_type_suffix):
+                    response.media_type = media_type
+                    response.headers["content-type"] = media_type
+            response.headers["accept-ranges"] = "bytes"
+            response.headers["vary"] = "Accept"
+
+        range_header = request.headers.get("range")
+        if(range_header == None or not isinstance(response, FileResponse) or response.status_code != 200):
+            return response
+
+        size = os.stat(response.path).st_size
+        byte_range = parse_range(range_header, size)
+        if(byte_range == None):
+            return response
+
+        if(byte_range == "unsatisfiable"):
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+
+        start, end = byte_range
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key in ("content-type", "etag", "last-modified", "accept-ranges", "vary")
+        }
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+
+        return StreamingResponse(_read_range(response.path, start, end), status_code=206, headers=headers)
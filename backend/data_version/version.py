@@ -0,0 +1,50 @@
+from dotenv import load_dotenv
+import os
+import sys
+import time
+from pathlib import Path
+
+
+load_dotenv()
+
+# Ingest writes a new stamp here; caches keyed on the data version drop
+# anything produced against an older stamp.
+DATA_VERSION_FILE = Path(os.getenv('DATA_VERSION_FILE', Path(__file__).parent.parent / "data_version.txt"))
+
+_cached_version = None
+_cached_stamp = None
+
+
+def get_data_version():
+    global _cached_version, _cached_stamp
+
+    try:
+        stat = DATA_VERSION_FILE.stat()
+    except FileNotFoundError:
+        return "0"
+
+    # every bump replaces the file, so a new inode shows it even when the mtime didn't move
+    stamp = (stat.st_ino, stat.st_mtime_ns)
+    if(stamp != _cached_stamp):
+        _cached_version = DATA_VERSION_FILE.read_text().strip() or "0"
+        _cached_stamp = stamp
+
+    return _cached_version
+
+
+def bump_data_version(version=None):
+    if(version == None):
+        # nanoseconds: an ingest and the rollup refresh after it can bump within one second
+        version = str(time.time_ns())
+
+    tmp_file = DATA_VERSION_FILE.with_suffix(f".{os.getpid()}.tmp")
+    tmp_file.write_text(version)
+    os.replace(tmp_file, DATA_VERSION_FILE)
+    print(f"Data version set to {version}")
+
+    return version
+
+
+# run after an ingest: python -m data_version.version [version]
+if __name__ == "__main__":
+    bump_data_version(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,106 @@
+import sys
+import json
+import statistics
+from database.engine import get_engine
+from database.profiles_schema import schema_features
+
+
+# (name, SQL as generated before the migration, SQL as generated after it)
+QUERIES = [
+    (
+        "one year, one float",
+        """SELECT "Date", "Temp_adj(C)" FROM profiles WHERE "float_id" = '2902291' AND EXTRACT(YEAR FROM "Date"::DATE) = 2022""",
+        """SELECT "Date", "Temp_adj(C)" FROM profiles WHERE "float_id" = '2902291' AND obs_date >= '2022-01-01' AND obs_date < '2023-01-01'""",
+    ),
+    (
+        "monthly average over a date range",
+        """SELECT date_trunc('month', "Date"::DATE) AS month, AVG("Temp_adj(C)") FROM profiles WHERE "Date"::DATE BETWEEN '2021-01-01' AND '2021-06-30' GROUP BY 1""",
+        """SELECT date_trunc('month', obs_date) AS month, AVG("Temp_adj(C)") FROM profiles WHERE obs_date BETWEEN '2021-01-01' AND '2021-06-30' GROUP BY 1""",
+    ),
+    (
+        "last 30 days",
+        """SELECT COUNT(*) FROM profiles WHERE "Date"::DATE >= CURRENT_DATE - INTERVAL '30 days'""",
+        """SELECT COUNT(*) FROM profiles WHERE obs_date >= CURRENT_DATE - INTERVAL '30 days'""",
+    ),
+    (
+        "bounding box",
+        """SELECT "float_id", "Latitude", "Longitude" FROM profiles WHERE "Latitude" BETWEEN 10 AND 15 AND "Longitude" BETWEEN 60 AND 65""",
+        """SELECT "float_id", "Latitude", "Longitude" FROM profiles WHERE "Latitude" BETWEEN 10 AND 15 AND "Longitude" BETWEEN 60 AND 65""",
+    ),
+    (
+        "bounding box in one year",
+        """SELECT AVG("Psal_adj(psu)") FROM profiles WHERE "Latitude" BETWEEN 0 AND 20 AND "Longitude" BETWEEN 50 AND 80 AND "Date"::DATE BETWEEN '2022-01-01' AND '2022-12-31'""",
+        """SELECT AVG("Psal_adj(psu)") FROM profiles WHERE "Latitude" BETWEEN 0 AND 20 AND "Longitude" BETWEEN 50 AND 80 AND obs_date BETWEEN '2022-01-01' AND '2022-12-31'""",
+    ),
+]
+
+
+def _scans(plan):
+    """Scan node types (with the index used) anywhere in the plan"""
+    scans = []
+    if("Scan" in plan["Node Type"]):
+        scans.append(plan["Node Type"] + (f" ({plan['Index Name']})" if "Index Name" in plan else ""))
+    for child in plan.get("Plans", []):
+        scans += _scans(child)
+    return scans
+
+
+def explain_analyze(conn, sql):
+    plan = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}").scalar()
+    if(isinstance(plan, str)):
+        plan = json.loads(plan)
+
+    top = plan[0]
+    return {
+        "ms": top["Execution Time"],
+        "buffers": top["Plan"].get("Shared Hit Blocks", 0) + top["Plan"].get("Shared Read Blocks", 0),
+        "scans": _scans(top["Plan"]),
+    }
+
+
+def run_benchmark(repeats=5):
+    """Median execution time, buffers touched and scan types of every representative query,
+    in the form the prompt asks for now (the "after" SQL once obs_date exists)"""
+    migrated = schema_features()["obs_date"]
+    results = {}
+
+    with get_engine().connect() as conn:
+        for name, before_sql, after_sql in QUERIES:
+            sql = after_sql if migrated else before_sql
+            # first run warms the cache, the rest are timed
+            explain_analyze(conn, sql)
+            runs = [explain_analyze(conn, sql) for _ in range(repeats)]
+            results[name] = {
+                "sql": sql,
+                "ms": statistics.median(run["ms"] for run in runs),
+                "buffers": runs[-1]["buffers"],
+                "scans": runs[-1]["scans"],
+            }
+            print(f"{name:<36} {results[name]['ms']:>10.2f} ms {results[name]['buffers']:>10} buffers  {', '.join(results[name]['scans'])}")
+
+    return {"migrated": migrated, "results": results}
+
+
+def compare(before, after):
+    print(f"\n{'query':<36} {'before ms':>10} {'after ms':>10} {'speedup':>8} {'buffers':>20}")
+    for name, result in after["results"].items():
+        old = before["results"].get(name)
+        if(old == None):
+            continue
+        speedup = old["ms"] / result["ms"] if result["ms"] else float("inf")
+        print(f"{name:<36} {old['ms']:>10.2f} {result['ms']:>10.2f} {speedup:>7.1f}x {old['buffers']:>9} -> {result['buffers']:<9}")
+
+
+# python -m database.benchmark_profiles --save before.json   (before python -m database.profiles_schema)
+# python -m database.benchmark_profiles --save after.json --compare before.json   (after it)
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    report = run_benchmark()
+
+    if("--save" in args):
+        with open(args[args.index("--save") + 1], "w") as f:
+            json.dump(report, f, indent=1)
+
+    if("--compare" in args):
+        with open(args[args.index("--compare") + 1]) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,138 @@
+from dotenv import load_dotenv
+import os
+import threading
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+# the async engine needs the optional asyncpg driver
+try:
+    import asyncpg
+    from sqlalchemy.ext.asyncio import create_async_engine
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+
+
+load_dotenv()
+DB_URL = os.getenv('DB_URL')
+
+# every blocking worker can hold one connection, so that is the pool size worth having
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', os.getenv('BLOCKING_IO_WORKERS', '32')))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# connections opened at startup so the first requests don't pay for the handshake
+DB_POOL_WARM_CONNECTIONS = int(os.getenv('DB_POOL_WARM_CONNECTIONS', '4'))
+ASYNC_DB_ENABLED = os.getenv('ASYNC_DB_ENABLED', 'false').lower() == 'true'
+
+_lock = threading.Lock()
+_engines = {}
+_async_engines = {}
+
+
+def _pool_options(url):
+    # sqlite (used for local testing) has its own pool classes without these knobs
+    if(make_url(url).get_backend_name() == "sqlite"):
+        return {}
+
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def get_engine(url=None):
+    """One pooled engine per database URL for the whole process"""
+    url = url or DB_URL
+    if(not url):
+        raise ValueError("DB_URL is not set. Please check your .env file.")
+
+    with _lock:
+        if(url not in _engines):
+            _engines[url] = create_engine(url, **_pool_options(url))
+        return _engines[url]
+
+
+def async_url(url):
+    return make_url(url).set(drivername="postgresql+asyncpg")
+
+
+def async_engine_available(url=None):
+    url = url or DB_URL
+    return ASYNC_DB_ENABLED and ASYNCPG_AVAILABLE and url != None and make_url(url).get_backend_name() == "postgresql"
+
+
+def get_async_engine(url=None):
+    """asyncpg engine with the same pool settings, for queries awaited on the event loop"""
+    url = url or DB_URL
+    if(not async_engine_available(url)):
+        raise RuntimeError("Async engine needs ASYNC_DB_ENABLED=true, asyncpg and a postgresql DB_URL")
+
+    with _lock:
+        if(url not in _async_engines):
+            _async_engines[url] = create_async_engine(async_url(url), **_pool_options(url))
+        return _async_engines[url]
+
+
+def warm_up_engine(url=None, connections=DB_POOL_WARM_CONNECTIONS):
+    """Opens a few connections and hands them back to the pool"""
+    engine = get_engine(url)
+    opened = []
+    try:
+        for _ in range(min(connections, DB_POOL_SIZE)):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            opened.append(conn)
+    except Exception as e:
+        print(f"Database warm-up failed: {e}")
+    finally:
+        for conn in opened:
+            conn.close()
+
+    print(f"Database pool warmed with {len(opened)} connection(s)")
+    return len(opened)
+
+
+async def warm_up_async_engine(url=None, connections=DB_POOL_WARM_CONNECTIONS):
+    if(not async_engine_available(url)):
+        return 0
+
+    engine = get_async_engine(url)
+    opened = []
+    try:
+        for _ in range(min(connections, DB_POOL_SIZE)):
+            conn = await engine.connect()
+            await conn.execute(text("SELECT 1"))
+            opened.append(conn)
+    except Exception as e:
+        print(f"Async database warm-up failed: {e}")
+    finally:
+        for conn in opened:
+            await conn.close()
+
+    return len(opened)
+
+
+async def dispose_engines():
+    with _lock:
+        engines = list(_engines.values())
+        async_engines = list(_async_engines.values())
+        _engines.clear()
+        _async_engines.clear()
+
+    for engine in engines:
+        engine.dispose()
+    for engine in async_engines:
+        await engine.dispose()
+
+
+def pool_stats():
+    with _lock:
+        stats = {make_url(url).render_as_string(hide_password=True): engine.pool.status() for url, engine in _engines.items()}
+        for url, engine in _async_engines.items():
+            stats["async " + make_url(url).render_as_string(hide_password=True)] = engine.sync_engine.pool.status()
+        return stats
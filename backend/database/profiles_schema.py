@@ -0,0 +1,142 @@
+from dotenv import load_dotenv
+import os
+import sys
+import threading
+from sqlalchemy import text, inspect
+from database.engine import get_engine
+from data_version.version import get_data_version, bump_data_version
+
+
+load_dotenv()
+# profiles rows backfilled per UPDATE, small enough not to hold long row locks
+PROFILES_MIGRATION_BATCH = int(os.getenv('PROFILES_MIGRATION_BATCH', '50000'))
+# heap pages summarised per BRIN range; profiles is appended in time order so ranges stay narrow
+PROFILES_BRIN_PAGES = int(os.getenv('PROFILES_BRIN_PAGES', '32'))
+
+# "Date" only holds YYYY-MM-DD text; anything else, including impossible days like
+# 2021-02-31 that pass the pattern, is left NULL instead of failing the migration
+OBS_DATE_EXPRESSION = 'profiles_safe_date("Date")'
+
+# the expression a PostGIS query has to use for idx_profiles_point to apply
+POINT_EXPRESSION = 'ST_SetSRID(ST_MakePoint("Longitude", "Latitude"), 4326)'
+
+# also created by the rollup refresh, which may run before this migration
+SAFE_DATE_FUNCTION_STATEMENT = """CREATE OR REPLACE FUNCTION profiles_safe_date(value text) RETURNS date AS $$
+BEGIN
+    IF value !~ '^\\d{4}-\\d{2}-\\d{2}$' THEN
+        RETURN NULL;
+    END IF;
+    RETURN value::date;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql STABLE"""
+
+COLUMN_STATEMENTS = [
+    "ALTER TABLE profiles ADD COLUMN IF NOT EXISTS obs_date date",
+    SAFE_DATE_FUNCTION_STATEMENT,
+    f"""CREATE OR REPLACE FUNCTION profiles_set_obs_date() RETURNS trigger AS $$
+BEGIN
+    NEW.obs_date := {OBS_DATE_EXPRESSION.replace('"Date"', 'NEW."Date"')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS profiles_obs_date ON profiles",
+    'CREATE TRIGGER profiles_obs_date BEFORE INSERT OR UPDATE OF "Date" ON profiles FOR EACH ROW EXECUTE FUNCTION profiles_set_obs_date()',
+]
+
+# CONCURRENTLY keeps profiles readable (and writable) while the indexes build
+INDEX_STATEMENTS = [
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_profiles_obs_date_brin ON profiles USING brin (obs_date) WITH (pages_per_range = {PROFILES_BRIN_PAGES})",
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_profiles_id_brin ON profiles USING brin (id) WITH (pages_per_range = {PROFILES_BRIN_PAGES})",
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_profiles_lat_lon ON profiles ("Latitude", "Longitude")',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_profiles_float_id_obs_date ON profiles ("float_id", obs_date)',
+]
+
+POSTGIS_INDEX_STATEMENT = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_profiles_point ON profiles USING gist (({POINT_EXPRESSION}))"
+
+
+def _postgis_installed(conn):
+    return conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'postgis'")).scalar() != None
+
+
+def backfill_obs_date(engine, batch=PROFILES_MIGRATION_BATCH):
+    """Fills obs_date for existing rows in id batches, each committed on its own"""
+    with engine.connect() as conn:
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM profiles")).scalar()
+
+    filled = 0
+    for start in range(0, max_id, batch):
+        with engine.begin() as conn:
+            result = conn.execute(
+                text(f"UPDATE profiles SET obs_date = {OBS_DATE_EXPRESSION} WHERE id > :start AND id <= :end AND obs_date IS NULL"),
+                {"start": start, "end": start + batch}
+            )
+            filled += result.rowcount
+        print(f"obs_date backfilled up to id {min(start + batch, max_id)} / {max_id}")
+
+    return filled
+
+
+def migrate_profiles(url=None, dry_run=False):
+    """Adds the typed obs_date column (kept in sync by a trigger) and the date, location
+    and float indexes to profiles. Safe to run again: every step is IF NOT EXISTS"""
+    engine = get_engine(url)
+    if(engine.dialect.name != "postgresql"):
+        raise RuntimeError("The profiles migration needs PostgreSQL")
+
+    with engine.connect() as conn:
+        postgis = _postgis_installed(conn)
+
+    statements = COLUMN_STATEMENTS + ["-- backfill obs_date"] + INDEX_STATEMENTS + ([POSTGIS_INDEX_STATEMENT] if postgis else [])
+    if(dry_run):
+        for statement in statements:
+            print(statement + ";\n")
+        return
+
+    with engine.begin() as conn:
+        for statement in COLUMN_STATEMENTS:
+            conn.execute(text(statement))
+
+    print(f"obs_date rows filled : {backfill_obs_date(engine)}")
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in INDEX_STATEMENTS + ([POSTGIS_INDEX_STATEMENT] if postgis else []):
+            print(statement)
+            conn.execute(text(statement))
+        conn.execute(text("ANALYZE profiles"))
+
+    # new schema features change the prompt and so the SQL, drop everything cached against the old one
+    bump_data_version()
+
+
+_lock = threading.Lock()
+_features = {"version": None, "obs_date": False, "postgis": False}
+
+
+def schema_features():
+    """{"obs_date", "postgis"}: what the migration has added, checked again when the data version changes"""
+    version = get_data_version()
+    with _lock:
+        if(_features["version"] == version):
+            return dict(_features)
+
+    features = {"obs_date": False, "postgis": False}
+    try:
+        engine = get_engine()
+        columns = {column["name"] for column in inspect(engine).get_columns("profiles")}
+        features["obs_date"] = "obs_date" in columns
+        if(engine.dialect.name == "postgresql"):
+            with engine.connect() as conn:
+                features["postgis"] = _postgis_installed(conn) and "idx_profiles_point" in {index["name"] for index in inspect(engine).get_indexes("profiles")}
+    except Exception as e:
+        print(f"Profiles schema check failed: {e}")
+
+    with _lock:
+        _features.update(features, version=version)
+        return dict(_features)
+
+
+# once per database: python -m database.profiles_schema [--dry-run]
+if __name__ == "__main__":
+    migrate_profiles(dry_run="--dry-run" in sys.argv[1:])
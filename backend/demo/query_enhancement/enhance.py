@@ -1,6 +1,6 @@
 from openai import OpenAI
 from dotenv import load_dotenv
-from final_ans.final_llm_call import get_ans_with_relevant_data
+from demo.final_ans.final_llm_call import get_ans_with_relevant_data
 import os
 
 load_dotenv()
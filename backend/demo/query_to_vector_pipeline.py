@@ -1,8 +1,8 @@
-from retrieve_data_from_db.postgres_db import retrieve_data_from_postgres
-from generate_sql.sql import sql_generator
-from query_enhancement.enhance import query_enhancer
-from final_ans.final_llm_call import get_ans_with_relevant_data
-from store_in_vector_db.vector_db import query_documents
+from demo.retrieve_data_from_db.postgres_db import retrieve_data_from_postgres
+from demo.generate_sql.sql import sql_generator
+from demo.query_enhancement.enhance import query_enhancer
+from demo.final_ans.final_llm_call import get_ans_with_relevant_data
+from demo.store_in_vector_db.vector_db import query_documents
 from typing import List, Dict, Tuple, Any
 import io, csv, base64, json
 
@@ -1,7 +1,9 @@
 from dotenv import load_dotenv
 import os
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import pandas as pd
+# share the backend's engine factory (pool settings, warm-up) instead of building our own
+from database.engine import get_engine
 
 # Load .env
 load_dotenv()  # <-- this is needed here
@@ -10,7 +12,7 @@ DB_URL = os.getenv('DB_URL')
 if not DB_URL:
     raise ValueError("DB_URL is not set. Please check your .env file.")
 
-engine = create_engine(DB_URL)
+engine = get_engine(DB_URL)
 
 
 def retrieve_data_from_postgres(sql_query: str) -> pd.DataFrame:
@@ -4,6 +4,8 @@ from google import genai
 
 from dotenv import load_dotenv
 import os
+# share the backend's persistent embedding cache, so re-running ingest doesn't embed again
+from embedding_cache.embedding_cache import cached_embeddings
 
 
 load_dotenv()
@@ -23,17 +25,33 @@ chroma_client = chromadb.PersistentClient("/home/subhash/Desktop/float/subhash_c
 collection = chroma_client.get_or_create_collection(name="documents")
 
 
-def generate_embeddings(summary):
+EMBEDDING_MODEL = "gemini-embedding-001"
+# texts per embed_content request (the API takes up to 100)
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '100'))
+
+client = genai.Client(
+    api_key=GEMINI_API_KEY
+)
 
-    client = genai.Client(
-        api_key=GEMINI_API_KEY
-    )
 
-    result = client.models.embed_content(
-            model="gemini-embedding-001",
-            contents=summary)
+def _embed(texts):
+    # one embed_content request per EMBED_BATCH_SIZE texts instead of one per text
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        result = client.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=texts[start:start + EMBED_BATCH_SIZE])
+        vectors += [embedding.values for embedding in result.embeddings]
+    return vectors
+
+
+def generate_embeddings(summary):
+    return cached_embeddings(EMBEDDING_MODEL, [summary], _embed)[0]
 
-    return result.embeddings[0].values
+
+def generate_embeddings_batch(summaries):
+    """Embeddings of summaries in order; only the ones not cached yet go to the API, batched"""
+    return cached_embeddings(EMBEDDING_MODEL, summaries, _embed)
 
 
 
@@ -49,6 +67,16 @@ def add_documents(documents, metadata, embeddings, float_id):
     print(f"Data added successfully {float_id}", end="\n\n\n\n")
 
 
+def add_documents_batch(documents, metadatas, embeddings, float_ids):
+    # upsert, so re-running the ingest over floats already stored replaces them instead of failing
+    collection.upsert(
+        documents=documents,
+        metadatas=metadatas,
+        embeddings=embeddings,
+        ids=float_ids
+    )
+
+
 def query_documents(query, filters):
     if(filters == {}):
         results = collection.query(
@@ -1,14 +1,28 @@
-from identify_drift.drift import get_sea_from_lat_lon
+from demo.identify_drift.drift import get_sea_from_lat_lon
 import pandas as pd
 from collections import Counter
 import xarray as xr
 from datetime import datetime
-from generate_summary.summary import create_summary
+from demo.generate_summary.summary import create_summary
 import numpy as np
-from store_in_vector_db.vector_db import add_documents, query_documents, generate_embeddings
+from demo.store_in_vector_db.vector_db import add_documents_batch, generate_embeddings_batch
+from data_version.version import bump_data_version
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import time
 import os
 
 
+# run from backend/ as a module, so the demo and the shared backend packages both import:
+#   python -m demo.vector_db_pipeline
+
+load_dotenv()
+# floats embedded per request and written per collection upsert
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '64'))
+# one <float_id>/ directory per float, next to this file whatever the working directory
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "argo_data")
+
+
 def clean_metadata(meta: dict) -> dict:
     """Ensure all metadata values are JSON-serializable for Chroma Cloud."""
     clean = {}
@@ -70,7 +84,7 @@ def decode_bytes_list(field):
 
     
 
-def decode_date_field(field):
+def decode_date_field(metadata, field):
     val = metadata[field]
     raw = decode_bytes_field(val)   # already safe string now
 
@@ -85,209 +99,245 @@ def decode_date_field(field):
 
 ###--- Ikkada start --- ###
 
-BASE_DIR = "./argo_data"
-floats_ids = sorted([f for f in os.listdir(BASE_DIR)])
+def build_float_document(float_id):
+    """(summary, metadata) of one float from its profiles CSV and meta NetCDF"""
+    data = {}
+
+    float_df = pd.read_csv(os.path.join(BASE_DIR, float_id, f"{float_id}_prof.csv"))
+    float_df['Date'] = pd.to_datetime(float_df['Date'], errors='coerce')
+    float_df['Date'] = float_df['Date'].dt.strftime('%y-%m-%d %H:%M:%S')
+    metadata = xr.open_dataset(os.path.join(BASE_DIR, float_id, f"{float_id}_meta.nc"))
+
+
+
+    unique_profiles = float_df.groupby(["Profile"], as_index=False).agg({
+                        "Latitude": "first",
+                        "Longitude": "first" 
+                    })
+
+
+
+    unique_profiles = unique_profiles[["Profile", "Latitude", "Longitude"]]
+    first_loc, last_loc = "", ""
+
+    locations = []
+    for idx, row in unique_profiles.iterrows():
+        # print("Profile : ", row['Profile'], row['Latitude'], row['Longitude'])
+        loc = get_sea_from_lat_lon(row['Latitude'], row['Longitude'])
+        locations.append(loc)
+
+        if(idx == 0):
+            first_loc = loc
+
+        elif(idx == len(unique_profiles) - 1):
+            last_loc = loc
+
+
+    locations_d = Counter(locations)
+    # print(locations_d)
+
+    dominant_region = ""
+    dominant_count = 0
+    mx = 0
+    for k, v in locations_d.items():
+        if(v > mx):
+            mx = v
+            dominant_region = k
+            dominant_count = mx
+
+
+    # adv - i just added some that chatgpt gave, if they are wrong or additional are there add.....
+    status = {
+        "T": "Terminated",
+        "D": "Dropped",
+        "R": "Recovered",
+        "F": "Technical Failure",
+        "S": "Stopped",
+        "U": "Unknown"
+    }
+
+
+    # drift summary
+    data['FIRST_REGION'] = first_loc
+    data['LAST_REGION'] = last_loc
+    data['LAT_MIN'] = unique_profiles["Latitude"].min()
+    data['LAT_MAX'] = unique_profiles['Latitude'].max()
+    data['LON_MIN'] = unique_profiles["Longitude"].min()
+    data['LON_MAX'] = unique_profiles['Longitude'].max()
+    data['CENTROID_LAT'] = unique_profiles['Latitude'].mean()
+    data['CENTROID_LON'] = unique_profiles['Longitude'].mean()
+    data['REGIONS_VISITED'] = ", ".join(list(locations_d.keys()))
+    for reg in locations_d.keys():
+        data[f'VISITED {reg.upper()}'] = True
+    data['DOMINANT_REGION'] = dominant_region
+
+
+    # float summary
+    data['FLOAT_ID'] = float_id
+    data['WMO_INST_TYPE'] = decode_bytes_field(metadata['WMO_INST_TYPE'])
+    data['PI_NAME'] = decode_bytes_field(metadata['PI_NAME'])
+    data['OPERATING_INSTITUTION'] = decode_bytes_field(metadata['OPERATING_INSTITUTION'])
+    data['PROJECT_NAME'] = decode_bytes_field(metadata['PROJECT_NAME'])
+
+
+    # date summary
+    ldt = decode_date_field(metadata, 'LAUNCH_DATE')
+    ld = None
+    if(ldt != None):
+        ld = int(ldt.timestamp())
+    data['LAUNCH_DATE'] = ld
+    data['LAUNCH_LATITUDE'] = np.ndarray.tolist(metadata['LAUNCH_LATITUDE'].values)
+    data['LAUNCH_LONGITUDE'] = np.ndarray.tolist(metadata['LAUNCH_LONGITUDE'].values)
+
+    sdt = decode_date_field(metadata, 'START_DATE')
+    sd = None
+    if(sdt != None):
+        sd = int(sdt.timestamp())
+    data['START_DATE'] = sd
+
+    edt = decode_date_field(metadata, 'END_MISSION_DATE')
+    ed = None
+    if(edt != None):
+        ed = int(edt.timestamp())
+    data['END_MISSION_DATE'] = ed
+
+    if(metadata['END_MISSION_STATUS'] == None):
+        s = "Mission not yet completed"
+    elif(status.get(decode_bytes_field(metadata['END_MISSION_STATUS'])) == None):
+        s = decode_bytes_field(metadata['END_MISSION_STATUS'])
+    else:
+        s = status.get(decode_bytes_field(metadata['END_MISSION_STATUS']))
+    data['END_MISSION_STATUS'] = s
 
+    data['NUM_PROFILES'] = len(unique_profiles)
 
-count = 1
-for float_id in floats_ids:
+    data['PCT_IN_DOMINANT_REGION'] = round((dominant_count / len(unique_profiles)) * 100, 2)
 
-    try:
-        print("Float id : ",float_id)
-
-        data = {}
-
-        float_df = pd.read_csv(f'argo_data/{float_id}/{float_id}_prof.csv')
-        float_df['Date'] = pd.to_datetime(float_df['Date'], errors='coerce')
-        float_df['Date'] = float_df['Date'].dt.strftime('%y-%m-%d %H:%M:%S')
-        metadata = xr.open_dataset(f"argo_data/{float_id}/{float_id}_meta.nc")
-
-
-
-        unique_profiles = float_df.groupby(["Profile"], as_index=False).agg({
-                            "Latitude": "first",
-                            "Longitude": "first" 
-                        })
-
-
-
-        unique_profiles = unique_profiles[["Profile", "Latitude", "Longitude"]]
-        first_loc, last_loc = "", ""
-
-        locations = []
-        for idx, row in unique_profiles.iterrows():
-            # print("Profile : ", row['Profile'], row['Latitude'], row['Longitude'])
-            loc = get_sea_from_lat_lon(row['Latitude'], row['Longitude'])
-            locations.append(loc)
-
-            if(idx == 0):
-                first_loc = loc
-            
-            elif(idx == len(unique_profiles) - 1):
-                last_loc = loc
-
-
-        locations_d = Counter(locations)
-        # print(locations_d)
-
-        dominant_region = ""
-        dominant_count = 0
-        mx = 0
-        for k, v in locations_d.items():
-            if(v > mx):
-                mx = v
-                dominant_region = k
-                dominant_count = mx
-
-
-        # adv - i just added some that chatgpt gave, if they are wrong or additional are there add.....
-        status = {
-            "T": "Terminated",
-            "D": "Dropped",
-            "R": "Recovered",
-            "F": "Technical Failure",
-            "S": "Stopped",
-            "U": "Unknown"
-        }
-
-
-        # drift summary
-        data['FIRST_REGION'] = first_loc
-        data['LAST_REGION'] = last_loc
-        data['LAT_MIN'] = unique_profiles["Latitude"].min()
-        data['LAT_MAX'] = unique_profiles['Latitude'].max()
-        data['LON_MIN'] = unique_profiles["Longitude"].min()
-        data['LON_MAX'] = unique_profiles['Longitude'].max()
-        data['CENTROID_LAT'] = unique_profiles['Latitude'].mean()
-        data['CENTROID_LON'] = unique_profiles['Longitude'].mean()
-        data['REGIONS_VISITED'] = ", ".join(list(locations_d.keys()))
-        for reg in locations_d.keys():
-            data[f'VISITED {reg.upper()}'] = True
-        data['DOMINANT_REGION'] = dominant_region
-            
-
-        # float summary
-        data['FLOAT_ID'] = float_id
-        data['WMO_INST_TYPE'] = decode_bytes_field(metadata['WMO_INST_TYPE'])
-        data['PI_NAME'] = decode_bytes_field(metadata['PI_NAME'])
-        data['OPERATING_INSTITUTION'] = decode_bytes_field(metadata['OPERATING_INSTITUTION'])
-        data['PROJECT_NAME'] = decode_bytes_field(metadata['PROJECT_NAME'])
-
-
-        # date summary
-        ldt = decode_date_field('LAUNCH_DATE')
-        ld = None
-        if(ldt != None):
-            ld = int(ldt.timestamp())
-        data['LAUNCH_DATE'] = ld
-        data['LAUNCH_LATITUDE'] = np.ndarray.tolist(metadata['LAUNCH_LATITUDE'].values)
-        data['LAUNCH_LONGITUDE'] = np.ndarray.tolist(metadata['LAUNCH_LONGITUDE'].values)
-
-        sdt = decode_date_field('START_DATE')
-        sd = None
-        if(sdt != None):
-            sd = int(sdt.timestamp())
-        data['START_DATE'] = sd
-
-        edt = decode_date_field('END_MISSION_DATE')
-        ed = None
-        if(edt != None):
-            ed = int(edt.timestamp())
-        data['END_MISSION_DATE'] = ed
-
-        if(metadata['END_MISSION_STATUS'] == None):
-            s = "Mission not yet completed"
-        elif(status.get(decode_bytes_field(metadata['END_MISSION_STATUS'])) == None):
-            s = decode_bytes_field(metadata['END_MISSION_STATUS'])
-        else:
-            s = status.get(decode_bytes_field(metadata['END_MISSION_STATUS']))
-        data['END_MISSION_STATUS'] = s
+    if(sdt and edt):
 
-        data['NUM_PROFILES'] = len(unique_profiles)
+        data['MISSION_DURATION_YEARS'] = round((edt - sdt).days/365, 2)
 
-        data['PCT_IN_DOMINANT_REGION'] = round((dominant_count / len(unique_profiles)) * 100, 2)
+        data['MISSION_DURATION_DAYS'] = (edt - sdt).days
 
-        if(sdt and edt):
+    else:
 
-            data['MISSION_DURATION_YEARS'] = round((edt - sdt).days/365, 2)
+        if(edt == None and sdt != None):
+            data['MISSION_DURATION_YEARS'] = round((datetime.now().replace(microsecond=0) - sdt).days/365, 2)
+            data['MISSION_DURATION_DAYS'] = (datetime.now().replace(microsecond=0) - sdt).days
 
-            data['MISSION_DURATION_DAYS'] = (edt - sdt).days
-        
         else:
+            data['MISSION_DURATION_YEARS'] = None
+            data['MISSION_DURATION_DAYS'] = None
 
-            if(edt == None and sdt != None):
-                data['MISSION_DURATION_YEARS'] = round((datetime.now().replace(microsecond=0) - sdt).days/365, 2)
-                data['MISSION_DURATION_DAYS'] = (datetime.now().replace(microsecond=0) - sdt).days
-            
-            else:
-                data['MISSION_DURATION_YEARS'] = None
-                data['MISSION_DURATION_DAYS'] = None
 
+    data['START_DATE_QC'] = decode_bytes_field(metadata['START_DATE_QC'])
+
+    data['PLATFORM_TYPE'] = decode_bytes_field(metadata['PLATFORM_TYPE'])
+
+    data['PLATFORM_MAKER'] = decode_bytes_field(metadata['PLATFORM_MAKER'])
+
+    # sensor summary
+    sensors = decode_bytes_list(metadata['SENSOR'])
+    makers = decode_bytes_list(metadata['SENSOR_MAKER'])
+    models = decode_bytes_list(metadata['SENSOR_MODEL'])
+    serials = decode_bytes_list(metadata['SENSOR_SERIAL_NO'])
+    params = decode_bytes_list(metadata['PARAMETER'])
+    units = decode_bytes_list(metadata['PARAMETER_UNITS'])
+
+    # print(sensors, makers, models, serials, params, units)
 
-        data['START_DATE_QC'] = decode_bytes_field(metadata['START_DATE_QC'])
+    sensor_summary = []
+    for s, mkr, mdl, sn, p, u in zip(sensors, makers, models, serials, params, units):
+        sensor_summary.append({
+            "Sensor": s,
+            "Maker": mkr,
+            "Model": mdl,
+            "SerialNo": sn,
+            "Parameter": p,
+            "Units": u
+        })
 
-        data['PLATFORM_TYPE'] = decode_bytes_field(metadata['PLATFORM_TYPE'])
+    summary = ["Sensor_summary:"]
+    for s in sensor_summary:
+        summary.append(f"Sensor: {s['Sensor']} | Maker: {s['Maker']} | Model: {s['Model']} | SerialNo: {s['SerialNo']} | Parameter: {s['Parameter']} | Units: {s['Units']}")
 
-        data['PLATFORM_MAKER'] = decode_bytes_field(metadata['PLATFORM_MAKER'])
+    summary = "\n".join(summary)
 
-        # sensor summary
-        sensors = decode_bytes_list(metadata['SENSOR'])
-        makers = decode_bytes_list(metadata['SENSOR_MAKER'])
-        models = decode_bytes_list(metadata['SENSOR_MODEL'])
-        serials = decode_bytes_list(metadata['SENSOR_SERIAL_NO'])
-        params = decode_bytes_list(metadata['PARAMETER'])
-        units = decode_bytes_list(metadata['PARAMETER_UNITS'])
+    data['SENSORS'] = summary
+    data['PARAMETER'] = params
 
-        # print(sensors, makers, models, serials, params, units)
+    for p in params:
+        data[f'HAS {p.upper()}'] = True
 
-        sensor_summary = []
-        for s, mkr, mdl, sn, p, u in zip(sensors, makers, models, serials, params, units):
-            sensor_summary.append({
-                "Sensor": s,
-                "Maker": mkr,
-                "Model": mdl,
-                "SerialNo": sn,
-                "Parameter": p,
-                "Units": u
-            })
+    ######################################################################################################
 
-        summary = ["Sensor_summary:"]
-        for s in sensor_summary:
-            summary.append(f"Sensor: {s['Sensor']} | Maker: {s['Maker']} | Model: {s['Model']} | SerialNo: {s['SerialNo']} | Parameter: {s['Parameter']} | Units: {s['Units']}")
+    # data -> metadata ------------------------------------------------------------------- avdaith
 
-        summary = "\n".join(summary)
 
-        data['SENSORS'] = summary
-        data['PARAMETER'] = params
+    summ = create_summary(data)
+    data = clean_metadata(data)
+    return summ, data
 
-        for p in params:
-            data[f'HAS {p.upper()}'] = True
 
-        ######################################################################################################
+def write_batch(batch):
+    """Embeds a batch of (float_id, summary, metadata) and upserts it into the collection in one write"""
+    float_ids = [float_id for float_id, _, _ in batch]
+    summaries = [summ for _, summ, _ in batch]
+    metadatas = [data for _, _, data in batch]
 
-        # data -> metadata ------------------------------------------------------------------- avdaith
+    embeddings = generate_embeddings_batch(summaries)
+    add_documents_batch(summaries, metadatas, embeddings, float_ids)
+    return len(batch)
 
-        summ = create_summary(data)
-        data = clean_metadata(data)
-        # here call another function to store summary and data in chroma 
 
+def ingest(floats_ids, batch_size=INGEST_BATCH_SIZE):
+    """Parses floats here while the previous batch is embedded and written on a worker
+    thread, so the network round trips overlap the NetCDF/CSV parsing"""
+    started = time.perf_counter()
+    stored = 0
+    failed = 0
+    pending = None
+    batch = []
 
-        # print(summ, data, end="\n\n")
+    def finish(future, size):
+        nonlocal stored, failed
+        try:
+            stored += future.result()
+        except Exception as e:
+            failed += size
+            print(f"Batch error : {e}", end="\n\n")
+        elapsed = time.perf_counter() - started
+        print(f"{stored} floats stored, {stored / max(elapsed, 1e-9):.2f} floats/sec")
 
-        embeddings = generate_embeddings(summ)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for count, float_id in enumerate(floats_ids, start=1):
+            try:
+                print("Float id : ", float_id, count)
+                summ, data = build_float_document(float_id)
+                batch.append((float_id, summ, data))
+            except Exception as e:
+                failed += 1
+                print(f"Error : {e}", end="\n\n")
 
-        # print("embeddings : ", embeddings[0].values, end="\n\n")
+            if(len(batch) >= batch_size or (count == len(floats_ids) and batch)):
+                # at most one batch in flight: wait for it before handing over the next
+                if(pending != None):
+                    finish(*pending)
+                pending = (executor.submit(write_batch, batch), len(batch))
+                batch = []
 
-        add_documents(summ, data, embeddings, float_id)
-        # query_documents("Indian Ocean")
+        if(pending != None):
+            finish(*pending)
 
-        print(count)
-        count+=1
+    # the collection changed under the API's answer, SQL result and template caches
+    if(stored > 0):
+        bump_data_version()
+
+    elapsed = time.perf_counter() - started
+    print(f"Ingested {stored} floats ({failed} failed) in {elapsed:.1f}s : {stored / max(elapsed, 1e-9):.2f} floats/sec")
+    return stored
 
-    
-
-    except Exception as e:
-        print(f"Error : {e}", end="\n\n")
 
+floats_ids = sorted([f for f in os.listdir(BASE_DIR)])
 
-    
\ No newline at end of file
+ingest(floats_ids)
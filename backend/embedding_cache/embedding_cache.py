@@ -0,0 +1,229 @@
+from dotenv import load_dotenv
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+# appends from several processes (API workers, an ingest) are serialised with flock, POSIX only
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+load_dotenv()
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', str(Path(__file__).parent.parent / "embedding_cache_store"))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MEMORY_ENTRIES', '5000'))
+
+# rows the vector file grows by when it fills up
+GROW_ROWS = 1024
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _ModelStore:
+    """Embeddings of one model on disk: <dir>/vectors.f32 is a memory-mapped float32
+    matrix, <dir>/keys.tsv an append-only "text hash <tab> row" list written after the
+    vector it points to, so a crash never leaves a key without its vector. Writers hold
+    an flock on <dir>/store.lock and first read the keys other processes appended, so
+    two processes never hand out the same row"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.directory / "vectors.f32"
+        self.keys_path = self.directory / "keys.tsv"
+        self.meta_path = self.directory / "meta.json"
+        self.lock_path = self.directory / "store.lock"
+
+        self.rows = {}
+        self.dim = None
+        self.next_row = 0
+        self._matrix = None
+        # bytes of keys.tsv already read
+        self._keys_offset = 0
+
+        self._reload()
+
+    def _capacity(self):
+        if(self.dim == None or not self.vectors_path.exists()):
+            return 0
+        return self.vectors_path.stat().st_size // (4 * self.dim)
+
+    def _open(self, capacity):
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim)) if capacity else None
+
+    @contextmanager
+    def _locked(self):
+        if(not FCNTL_AVAILABLE):
+            yield
+            return
+
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload(self):
+        """Picks up what other processes wrote since the last look: the dimension, a grown
+        vector file and the complete lines appended to keys.tsv"""
+        if(self.dim == None and self.meta_path.exists()):
+            self.dim = json.loads(self.meta_path.read_text())["dim"]
+
+        capacity = self._capacity()
+        if(capacity != (0 if self._matrix is None else self._matrix.shape[0])):
+            self._open(capacity)
+
+        if(not self.keys_path.exists() or self.keys_path.stat().st_size <= self._keys_offset):
+            return
+
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            appended = f.read()
+        # a line still being written is read next time
+        complete = appended[:appended.rfind(b"\n") + 1]
+        self._keys_offset += len(complete)
+
+        for line in complete.decode("utf-8").splitlines():
+            key, _, row = line.partition("\t")
+            if(row.isdigit() and int(row) < capacity):
+                self.rows[key] = int(row)
+                self.next_row = max(self.next_row, int(row) + 1)
+
+    def _grow(self, needed):
+        capacity = self._capacity()
+        if(needed <= capacity):
+            return
+
+        capacity = max(needed, capacity + GROW_ROWS, capacity * 2)
+        if(self._matrix is not None):
+            self._matrix.flush()
+            self._matrix = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * 4 * self.dim)
+        self._open(capacity)
+
+    def get(self, key):
+        row = self.rows.get(key)
+        if(row == None):
+            # another process may have stored it since
+            self._reload()
+            row = self.rows.get(key)
+            if(row == None):
+                return None
+        return np.array(self._matrix[row])
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+
+        with self._locked():
+            self._reload()
+            if(self.dim == None):
+                self.dim = int(vector.shape[0])
+                self.meta_path.write_text(json.dumps({"dim": self.dim}))
+            if(vector.shape[0] != self.dim):
+                raise ValueError(f"embedding has {vector.shape[0]} dimensions, the store holds {self.dim}")
+
+            if(key in self.rows):
+                return
+
+            row = self.next_row
+            self._grow(row + 1)
+            self._matrix[row] = vector
+            self._matrix.flush()
+
+            with open(self.keys_path, "a") as f:
+                f.write(f"{key}\t{row}\n")
+            self.rows[key] = row
+            self.next_row = row + 1
+
+
+class EmbeddingCache:
+    """Embeddings keyed on (model, sha256 of the text). An in-memory LRU in front of
+    one memory-mapped float32 store per model, so repeated queries and re-run ingests
+    don't call the embedding API again. Several processes may share a path"""
+
+    def __init__(self, path, memory_entries):
+        self.path = Path(path)
+        self.memory_entries = memory_entries
+
+        self._memory = OrderedDict()
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _store(self, model):
+        if(model not in self._stores):
+            self._stores[model] = _ModelStore(self.path / model.replace("/", "_"))
+        return self._stores[model]
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while(len(self._memory) > self.memory_entries):
+            self._memory.popitem(last=False)
+
+    def get(self, model, text):
+        key = (model, text_key(text))
+        with self._lock:
+            if(key in self._memory):
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._memory[key]
+
+            vector = self._store(model).get(key[1])
+            if(vector is None):
+                self._stats["misses"] += 1
+                return None
+
+            vector = vector.tolist()
+            self._remember(key, vector)
+            self._stats["disk_hits"] += 1
+            return vector
+
+    def put(self, model, text, vector):
+        key = (model, text_key(text))
+        with self._lock:
+            self._store(model).put(key[1], vector)
+            # what the store will hand back later, so a hit never differs from a miss
+            self._remember(key, np.asarray(vector, dtype=np.float32).tolist())
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": (lookups - self._stats["misses"]) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "stored": {model: len(store.rows) for model, store in self._stores.items()},
+            }
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MEMORY_ENTRIES)
+
+
+def cached_embeddings(model, texts, embed):
+    """Embeddings of texts (in order), calling embed(missing_texts) -> vectors only for texts
+    not cached yet. Query-time retrieval and ingest both go through here"""
+    if(not EMBEDDING_CACHE_ENABLED):
+        return [list(vector) for vector in embed(texts)]
+
+    vectors = [embedding_cache.get(model, text) for text in texts]
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+
+    if(missing):
+        for text, vector in zip(missing, embed(missing)):
+            embedding_cache.put(model, text, vector)
+        vectors = [vector if vector is not None else embedding_cache.get(model, text) for text, vector in zip(texts, vectors)]
+
+    return vectors
@@ -0,0 +1,176 @@
+from dotenv import load_dotenv
+import os
+import json
+import numpy as np
+import pandas as pd
+from retrieve_data_from_db.sampling import CHARS_PER_TOKEN, STRATUM_COLUMNS, SAMPLE_DEPTH_BAND
+
+
+load_dotenv()
+# hard cap on the tokens the data takes in the final answer prompt, whatever the row count
+FINAL_ANSWER_DATA_TOKENS = int(os.getenv('FINAL_ANSWER_DATA_TOKENS', '6000'))
+# results this small (and within the cap) are sent as plain rows
+DIGEST_RAW_ROWS = int(os.getenv('DIGEST_RAW_ROWS', '50'))
+DIGEST_MAX_GROUPS = int(os.getenv('DIGEST_MAX_GROUPS', '24'))
+DIGEST_EXAMPLE_ROWS = int(os.getenv('DIGEST_EXAMPLE_ROWS', '5'))
+# measured columns averaged per group
+DIGEST_GROUP_MEASURES = 4
+
+
+def _native(value):
+    """numpy scalars as the Python int / float / bool they hold, so JSON gets numbers, not strings"""
+    if(isinstance(value, np.generic)):
+        return value.item()
+    return str(value)
+
+
+def _round(value):
+    if(value == None or pd.isna(value)):
+        return None
+    if(isinstance(value, np.generic)):
+        value = value.item()
+    if(isinstance(value, float)):
+        return float(f"{value:.4g}")
+    return value
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_native)
+
+
+def _first_column(df, dimension):
+    for column in STRATUM_COLUMNS[dimension]:
+        if(column in df.columns):
+            return column
+    return None
+
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def column_stats(df):
+    """min / quartiles / max / mean of numeric columns, range of dates, top values of the rest"""
+    stats = {}
+    for column in df.columns:
+        series = df[column]
+        nulls = int(series.isna().sum())
+
+        if(_is_numeric(series)):
+            quantiles = series.quantile([0.25, 0.5, 0.75])
+            stats[column] = {
+                "min": _round(series.min()), "p25": _round(quantiles[0.25]), "median": _round(quantiles[0.5]),
+                "p75": _round(quantiles[0.75]), "max": _round(series.max()), "mean": _round(series.mean()),
+            }
+        elif(column in STRATUM_COLUMNS["time"] or pd.api.types.is_datetime64_any_dtype(series)):
+            values = series.dropna().astype(str)
+            stats[column] = {"min": values.min() if len(values) else None, "max": values.max() if len(values) else None, "distinct": int(values.nunique())}
+        else:
+            top = series.dropna().astype(str).value_counts().head(5)
+            stats[column] = {"distinct": int(series.nunique()), "top": {value: int(count) for value, count in top.items()}}
+
+        if(nulls):
+            stats[column]["nulls"] = nulls
+
+    return stats
+
+
+def grouped_aggregates(df):
+    """{"by float" / "by year" / "by depth band": [{key, rows, mean of each measure}]}, largest groups first"""
+    keys = {}
+
+    column = _first_column(df, "float")
+    if(column != None):
+        keys["by float"] = (column, df[column].astype(str))
+
+    column = _first_column(df, "time")
+    if(column != None):
+        keys["by year"] = ("year", df[column].astype(str).str.slice(0, 4))
+
+    column = _first_column(df, "depth")
+    if(column != None and _is_numeric(df[column])):
+        band = (df[column] // SAMPLE_DEPTH_BAND * SAMPLE_DEPTH_BAND).astype("Int64").astype(str)
+        keys["by depth band"] = (f"{column} from", band)
+
+    key_columns = {key_column for key_column, _ in keys.values()} | {_first_column(df, d) for d in STRATUM_COLUMNS}
+    measures = [c for c in df.columns if c not in key_columns and _is_numeric(df[c]) and c not in ("id", "Latitude", "Longitude")][:DIGEST_GROUP_MEASURES]
+
+    groups = {}
+    for name, (label, key) in keys.items():
+        if(key.nunique() < 2 and name != "by float"):
+            continue
+        grouped = df.groupby(key.to_numpy())
+        sizes = grouped.size().sort_values(ascending=False, kind="stable").head(DIGEST_MAX_GROUPS)
+        if(name != "by float"):
+            sizes = sizes.sort_index()
+        means = grouped[measures].mean().loc[sizes.index] if measures else pd.DataFrame(index=sizes.index)
+        groups[name] = [
+            {label: index, "rows": int(sizes[index]), **{c: _round(v) for c, v in means.loc[index].items()}}
+            for index in sizes.index
+        ]
+
+    return groups
+
+
+def _fits(digest, max_chars):
+    return len(_dumps(digest)) <= max_chars
+
+
+def _largest_prefix(digest, key, items, max_chars):
+    """digest with the longest prefix of items under key that still fits"""
+    low, high = 0, len(items)
+    while(low < high):
+        middle = (low + high + 1) // 2
+        digest[key] = items[:middle]
+        if(_fits(digest, max_chars)):
+            low = middle
+        else:
+            high = middle - 1
+
+    if(low == 0):
+        del digest[key]
+    else:
+        digest[key] = items[:low]
+    return digest
+
+
+def build_data_digest(df, token_budget=FINAL_ANSWER_DATA_TOKENS, total_rows=None):
+    """Compact JSON for the final answer prompt, never more than token_budget tokens.
+    Small results go as rows; anything bigger as the row count, per-column stats and
+    quantiles, averages by float / year / depth band and a few example rows, each part
+    cut down (least important first) until the whole digest fits. When df is a sample,
+    total_rows is the size of the result it was drawn from"""
+    max_chars = token_budget * CHARS_PER_TOKEN
+
+    if(df is None or len(df) == 0):
+        return "[]"
+
+    sampled = total_rows != None and total_rows > len(df)
+    if(len(df) <= DIGEST_RAW_ROWS and not sampled):
+        rows = df.to_json(orient="records", double_precision=4)
+        if(len(rows) <= max_chars):
+            return rows
+
+    if(sampled):
+        digest = {
+            "row_count": int(total_rows), "sample_rows": len(df),
+            "note": "the query returned row_count rows; stats, group averages and examples are from a representative sample of sample_rows of them, group rows count sampled rows",
+        }
+    else:
+        digest = {"row_count": len(df), "note": "summary of the retrieved rows; examples are a few of them"}
+
+    stats = list(column_stats(df).items())
+    digest = _largest_prefix(digest, "columns", stats, max_chars)
+    if("columns" in digest):
+        digest["columns"] = dict(digest["columns"])
+
+    groups = grouped_aggregates(df)
+    for name, entries in groups.items():
+        digest = _largest_prefix(digest, name, entries, max_chars)
+
+    examples = json.loads(df.head(DIGEST_EXAMPLE_ROWS).to_json(orient="records", double_precision=4))
+    digest = _largest_prefix(digest, "examples", examples, max_chars)
+
+    text = _dumps(digest)
+    # only reachable with a budget too small for even the row count
+    return text if len(text) <= max_chars else _dumps({"row_count": digest["row_count"]})[:max_chars]
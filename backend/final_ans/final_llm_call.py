@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm_client.gemini import chat_completion, chat_completion_async, chat_completion_stream_async
 from datetime import datetime
 import pytz
 
@@ -14,9 +14,9 @@ india_tz = pytz.timezone("Asia/Kolkata")
 current_time_india = datetime.now(india_tz).strftime("%Y-%m-%d %H:%M:%S")
 
 
-def get_ans_with_relevant_data(query, data, history, sources_to_cite, language="english"):
+def build_final_ans_messages(query, data, history, sources_to_cite, language="english"):
 
-    print("Data received : ", data, end="\n\n")
+    print(f"Data received : {len(data)} chars", end="\n\n")
 
     
     SYSTEM_PROMPT = f"""
@@ -50,7 +50,11 @@ Tone & Style:
 - Always human-like, never robotic.
 - Speak like a passionate oceanographer who loves to explain patterns and findings.
 
-Input Provided (this data is already the exact subset for the user query):
+Input Provided (this data is already the exact subset for the user query).
+It is either the rows themselves, or for larger results a digest: "row_count", per-column
+stats ("columns": min / quartiles / max / mean, date ranges, top values), averages
+"by float", "by year" and "by depth band", and a few "examples" rows. Treat a digest as
+describing all of its row_count rows; with "sample_rows" its stats come from a representative sample of them:
 {data}
 
 Conversation History:
@@ -63,21 +67,24 @@ Output format:
     
     
     
-    client = OpenAI(
-        api_key=GEMINI_API_KEY,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
-
-
-    response = client.chat.completions.create(
-        model="gemini-2.5-flash",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": query
-            }
-        ],
-    )
-
-    return response.choices[0].message.content
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": query
+        }
+    ]
+
+    return messages
+
+
+def get_ans_with_relevant_data(query, data, history, sources_to_cite, language="english"):
+    return chat_completion(GEMINI_API_KEY, build_final_ans_messages(query, data, history, sources_to_cite, language), name="final_ans")
+
+
+async def get_ans_with_relevant_data_async(query, data, history, sources_to_cite, language="english"):
+    return await chat_completion_async(GEMINI_API_KEY, build_final_ans_messages(query, data, history, sources_to_cite, language), name="final_ans")
+
+
+def stream_ans_with_relevant_data_async(query, data, history, sources_to_cite, language="english"):
+    return chat_completion_stream_async(GEMINI_API_KEY, build_final_ans_messages(query, data, history, sources_to_cite, language), name="final_ans")
@@ -0,0 +1,200 @@
+from dotenv import load_dotenv
+import os
+import asyncio
+import threading
+from retrieve_data_from_db.postgres_db import explain_sql
+from retrieve_data_from_db.result_cache import SQL_TOKEN_PATTERN
+from retrieve_data_from_db.sampling import tablesample_sql, THEORY_SAMPLING
+
+
+load_dotenv()
+SQL_GUARD_ENABLED = os.getenv('SQL_GUARD_ENABLED', 'true').lower() == 'true'
+SQL_GUARD_REPAIR_ATTEMPTS = int(os.getenv('SQL_GUARD_REPAIR_ATTEMPTS', '1'))
+
+
+def _budget(tab, rows, cost, timeout_ms):
+    tab = tab.upper()
+    return {
+        "rows": float(os.getenv(f'SQL_MAX_ROWS_{tab}', rows)),
+        "cost": float(os.getenv(f'SQL_MAX_COST_{tab}', cost)),
+        "timeout_ms": int(os.getenv(f'SQL_TIMEOUT_MS_{tab}', timeout_ms)),
+    }
+
+
+# planner estimates each tab may run with, and how long Postgres may spend on it
+SQL_BUDGETS = {
+    "theory": _budget("theory", 5000, 500000, 15000),
+    "table": _budget("table", 1000000, 5000000, 60000),
+    "plot": _budget("plot", 200000, 5000000, 30000),
+}
+
+# Once the statement is known to be one SELECT, these are the only ways it can write, lock,
+# change settings or run server-side code. Keywords of other statements (SET, DO, COMMENT...)
+# can't occur in a SELECT except as names, so a bare word alone is not rejected
+FORBIDDEN_FUNCTIONS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_terminate_backend", "pg_cancel_backend", "pg_reload_conf",
+    "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_stat_file", "pg_file_write", "set_config",
+    "nextval", "setval", "lo_import", "lo_export", "lo_create", "lo_unlink", "dblink", "dblink_exec",
+    "query_to_xml", "query_to_xml_and_xmlschema", "query_to_xmlschema", "cursor_to_xml",
+    "pg_advisory_lock", "pg_advisory_xact_lock", "pg_try_advisory_lock", "pg_try_advisory_xact_lock",
+}
+# SELECT ... FOR UPDATE / SHARE / NO KEY UPDATE / KEY SHARE take row locks
+LOCKING_WORDS = {"update", "share", "no", "key"}
+
+
+class UnsafeSQLError(ValueError):
+    pass
+
+
+def statement_timeout_ms(tab):
+    return SQL_BUDGETS.get(tab, SQL_BUDGETS["theory"])["timeout_ms"]
+
+
+def check_single_select(sql):
+    """Returns sql without its trailing ';' and comments, raises UnsafeSQLError unless it is one SELECT"""
+    tokens = [m for m in SQL_TOKEN_PATTERN.finditer(sql) if m.lastgroup != "comment"]
+    while(tokens and tokens[-1].group() == ";"):
+        tokens.pop()
+
+    if(len(tokens) == 0):
+        raise UnsafeSQLError("empty SQL")
+
+    if(tokens[0].lastgroup != "word" or tokens[0].group().lower() != "select"):
+        raise UnsafeSQLError("only a single SELECT statement is allowed")
+
+    if(any(m.group() == ";" for m in tokens)):
+        raise UnsafeSQLError("multiple statements are not allowed")
+
+    # names only count as words here: strings and quoted identifiers are never keywords
+    forbidden = set()
+    for i, token in enumerate(tokens):
+        if(token.lastgroup != "word"):
+            continue
+        word = token.group().lower()
+        following = tokens[i + 1].group().lower() if i + 1 < len(tokens) else ""
+
+        if(word == "into"):
+            # SELECT ... INTO creates a table
+            forbidden.add("into")
+        elif(word == "for" and following in LOCKING_WORDS):
+            forbidden.add(f"for {following}")
+        elif(word in FORBIDDEN_FUNCTIONS and following == "("):
+            forbidden.add(f"{word}()")
+
+    if(forbidden):
+        raise UnsafeSQLError(f"forbidden construct(s) in SELECT: {', '.join(sorted(forbidden))}")
+
+    return sql[tokens[0].start():tokens[-1].end()]
+
+
+def add_limit(sql, rows):
+    return f"SELECT * FROM (\n{sql}\n) AS guarded LIMIT {int(rows)}"
+
+
+def limits_rows(tab):
+    """Whether the tab's row budget applies. The reservoir sampler reads the whole result and
+    keeps a sample of it, so capping its rows would only keep the first ones"""
+    return not (tab == "theory" and THEORY_SAMPLING == "reservoir")
+
+
+def over_budget(estimate, tab):
+    """Why the planner estimate breaks the tab's budget, None if it fits"""
+    if(estimate == None):
+        return None
+
+    budget = SQL_BUDGETS.get(tab, SQL_BUDGETS["theory"])
+    if(estimate["cost"] > budget["cost"]):
+        return f"estimated cost {estimate['cost']:.0f} is over the {tab} budget of {budget['cost']:.0f}"
+    if(limits_rows(tab) and estimate["rows"] > budget["rows"]):
+        return f"estimated {estimate['rows']:.0f} rows is over the {tab} budget of {budget['rows']:.0f}"
+
+    return None
+
+
+_lock = threading.Lock()
+_stats = {"checked": 0, "rejected": 0, "sampled": 0, "limited": 0, "repaired": 0, "explain_errors": 0, "unresolved": 0}
+
+
+def _count(field):
+    with _lock:
+        _stats[field] += 1
+
+
+async def _estimate(sql, tab):
+    """(estimate, problem); a query Postgres can't even plan is a problem the LLM can repair"""
+    try:
+        estimate = await asyncio.to_thread(explain_sql, sql, statement_timeout_ms(tab))
+    except Exception as e:
+        _count("explain_errors")
+        return None, f"Postgres could not plan it: {str(e).splitlines()[0]}"
+
+    return estimate, over_budget(estimate, tab)
+
+
+async def guard_sql(sql, tab, repair=None):
+    """Checks LLM SQL before it runs. Rejects anything but a single SELECT, then compares the
+    EXPLAIN estimate with the tab's budget: theory answers get a TABLESAMPLE (when enabled) or a LIMIT,
+    except under reservoir sampling where only the cost budget and statement_timeout apply; other tabs
+    ask repair(sql, problem) -> new sql for a cheaper query. Returns the SQL to run"""
+    if(not SQL_GUARD_ENABLED):
+        return sql
+
+    _count("checked")
+    try:
+        sql = check_single_select(sql)
+    except UnsafeSQLError:
+        _count("rejected")
+        raise
+
+    budget = SQL_BUDGETS.get(tab, SQL_BUDGETS["theory"])
+
+    for attempt in range(SQL_GUARD_REPAIR_ATTEMPTS + 1):
+        estimate, problem = await _estimate(sql, tab)
+        if(problem == None):
+            return sql
+
+        print(f"SQL guard ({tab}) : {problem}")
+
+        if(tab == "theory" and estimate != None and THEORY_SAMPLING == "tablesample"):
+            # read a repeatable fraction of the table instead of its first rows
+            sampled = tablesample_sql(sql, estimate["rows"], budget["rows"])
+            if(sampled != None):
+                estimate, sampled_problem = await _estimate(sampled, tab)
+                if(sampled_problem == None):
+                    _count("sampled")
+                    return sampled
+
+        if(tab == "theory" and estimate != None and limits_rows(tab)):
+            limited = add_limit(sql, budget["rows"])
+            estimate, limited_problem = await _estimate(limited, tab)
+            if(limited_problem == None):
+                _count("limited")
+                return limited
+            problem = limited_problem
+
+        if(repair == None or attempt == SQL_GUARD_REPAIR_ATTEMPTS):
+            break
+
+        repaired = await repair(sql, problem)
+        if(repaired == None):
+            break
+
+        try:
+            sql = check_single_select(repaired)
+        except UnsafeSQLError:
+            _count("rejected")
+            raise
+        _count("repaired")
+        print("Repaired SQL : ", sql)
+
+    # still over budget: run it anyway, statement_timeout stops it if the estimate was right
+    _count("unresolved")
+    if(tab == "theory" and limits_rows(tab)):
+        return add_limit(sql, budget["rows"])
+
+    return sql
+
+
+def sql_guard_stats():
+    with _lock:
+        return dict(_stats)
@@ -142,8 +142,9 @@
 
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
 import json
+from llm_client.gemini import chat_completion, chat_completion_async
+from database.profiles_schema import schema_features, POINT_EXPRESSION
 
 
 load_dotenv()
@@ -166,14 +167,56 @@ def clean_response(res):
     
     return cleaned_response
 
-def sql_generator(query, type, retrieved_data=None):
+def schema_rules():
+    """Schema text, date rules and location rules for the columns and indexes profiles has right now"""
+    features = schema_features()
+
+    if(features["obs_date"]):
+        columns = '"id", "float_id", "Profile", "Date", "obs_date", "Latitude", "Longitude", '
+        date_rules = """4. "obs_date" is the observation date as a real DATE column (indexed); "Date" is the same date as TEXT.
+   - Always filter, group and extract on "obs_date", never on "Date" or "Date"::DATE (those can't use the index).
+   - Compare "obs_date" directly with date literals, keeping the column bare so the index applies:
+       * "obs_date" BETWEEN '2022-01-01' AND '2022-12-31'
+       * "obs_date" >= '2022-01-01' AND "obs_date" < '2023-01-01'   (prefer this over EXTRACT(YEAR FROM "obs_date") = 2022)
+       * "obs_date" >= (CURRENT_DATE - INTERVAL '10 years')
+   - DO NOT use DATE('now') or SQLite/MySQL-style functions."""
+    else:
+        columns = '"id", "float_id", "Profile", "Date", "Latitude", "Longitude", '
+        date_rules = """4. "Date" is TEXT in YYYY-MM-DD format.
+   - Always cast to DATE for comparisons: "Date"::DATE
+   - Valid Postgres date expressions:
+       * EXTRACT(YEAR FROM "Date"::DATE) = 2022
+       * "Date"::DATE BETWEEN '2022-01-01' AND '2022-12-31'
+       * "Date"::DATE >= (CURRENT_DATE - INTERVAL '10 years')
+   - DO NOT use DATE('now') or SQLite/MySQL-style functions."""
+
+    location_rules = """6. Location filtering:
+   - Use "Latitude" and "Longitude" for filtering, as a bounding box on the bare columns:
+       * "Latitude" BETWEEN 5 AND 25 AND "Longitude" BETWEEN 50 AND 75"""
+    if(features["postgis"]):
+        location_rules += f"""
+   - For distances use PostGIS on exactly this (indexed) expression, SRID=4326:
+       * ST_DWithin({POINT_EXPRESSION}::geography, ST_SetSRID(ST_MakePoint(72.8, 18.9), 4326)::geography, 500000)"""
+
+    return columns, date_rules, location_rules
+
+
+def vector_ids_text(retrieved_data):
+    # the ids themselves are bound at run time as :vector_ids, the prompt only says they exist
+    if(not retrieved_data):
+        return "None"
+    return f"{len(retrieved_data)} float_ids were found by the vector search. They are passed at run time as the array parameter :vector_ids."
+
+
+def build_sql_messages(query, type, retrieved_data=None):
+    columns, date_rules, location_rules = schema_rules()
     SYSTEM_PROMPT = f"""
 You are an expert PostgreSQL query generator. You always produce one and only one valid SQL SELECT statement.
 
 Context:
 Database schema:
     - Postgres SQL schema (structured numeric/geospatial data): 
-      "id", "float_id", "Profile", "Date", "Latitude", "Longitude", "Pres_raw(dbar)", "Pres_adj(dbar)", "Pres_raw_qc", "Pres_adj_qc", 
+      {columns}"Pres_raw(dbar)", "Pres_adj(dbar)", "Pres_raw_qc", "Pres_adj_qc", 
       "Temp_raw(C)", "Temp_adj(C)", "Temp_raw_qc", "Temp_adj_qc", 
       "Psal_raw(psu)", "Psal_adj(psu)", "Psal_raw_qc", "Psal_adj_qc"
 
@@ -181,7 +224,7 @@ User request:
 {query}
 
 Relevant float_ids from vector DB:
-{retrieved_data}
+{vector_ids_text(retrieved_data)}
 
 TYPE : {type}
 
@@ -191,18 +234,13 @@ STRICT RULES:
    - Never generate INSERT, UPDATE, DELETE, DROP, CREATE, WITH, CTEs, temp tables, or multi-statement SQL.
 2. The table name is always exactly profiles.
 3. Always wrap column names exactly as shown in the schema in double quotes.
-4. "Date" is TEXT in YYYY-MM-DD format.
-   - Always cast to DATE for comparisons: "Date"::DATE
-   - Valid Postgres date expressions:
-       * EXTRACT(YEAR FROM "Date"::DATE) = 2022
-       * "Date"::DATE BETWEEN '2022-01-01' AND '2022-12-31'
-       * "Date"::DATE >= (CURRENT_DATE - INTERVAL '10 years')
-   - DO NOT use DATE('now') or SQLite/MySQL-style functions.
-5. "float_id" is TEXT. Always wrap IDs in single quotes.
+{date_rules}
+5. "float_id" is TEXT. Always wrap IDs named in the user request in single quotes.
    - Example: WHERE "float_id" IN ('2902291','3902292')
-   - If {retrieved_data} is empty, default to no float_id filter (include all floats).
-6. Location filtering:
-   - Use "Latitude" and "Longitude" for filtering. If using PostGIS, assume SRID=4326.
+   - If the vector search found float_ids, filter on them only through the placeholder, never write them out:
+       * WHERE "float_id" = ANY(:vector_ids)
+   - If no float_ids were found, default to no float_id filter (include all floats).
+{location_rules}
 7. Only include columns needed to answer the user’s question. Never SELECT * unless explicitly requested.
 8. NULL handling:
    - Filter out NULL only if required by query intent or explicitly asked.
@@ -216,14 +254,14 @@ STRICT RULES:
    - Always return valid JSON in exactly this format, no extra text:
      {{
        "sql": "<generated SQL>",
-       "sources_to_cite": "<comma-separated float_ids or 'all' if none provided>"
+       "sources_to_cite": "<comma-separated float_ids from the request, 'vector_ids' if the query uses :vector_ids, or 'all' if none provided>"
      }}
 13. Safety fallback:
    - If user request is ambiguous, default to a safe aggregated query by "float_id" and year.
 14. Strict validation:
    - Double-check your SQL before output. It must run without errors on PostgreSQL.
    - Never hallucinate columns or functions outside the schema above.
-15. If type is theory then highly aggregate the data and select random 1000 data points from the data.
+15. If type is theory, return the rows (or aggregates) the answer needs. Never use ORDER BY random() or LIMIT to thin them out: the pipeline samples large results itself.
 16. If possible try including the float_ids, latitude, longitude, and dates. Better if included.
 
 GOAL:
@@ -232,25 +270,41 @@ Produce the minimal, correct, performant SQL SELECT query that answers the user
 
 
 
-    client = OpenAI(
-        api_key=GEMINI_API_KEY,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": query
+        }
+    ]
+
+    return messages
+
+
+def sql_generator(query, type, retrieved_data=None):
+    return chat_completion(GEMINI_API_KEY, build_sql_messages(query, type, retrieved_data), response_format={"type": "json_object"}, name="sql")
+
 
+async def sql_generator_async(query, type, retrieved_data=None):
+    return await chat_completion_async(GEMINI_API_KEY, build_sql_messages(query, type, retrieved_data), response_format={"type": "json_object"}, name="sql")
 
-    response = client.chat.completions.create(
-        model = "gemini-2.5-flash",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": query
-            }
-        ],
-        response_format={"type": "json_object"}
-    )
 
+def build_sql_repair_messages(query, type, sql, problem, retrieved_data=None):
+    messages = build_sql_messages(query, type, retrieved_data)
+    date_column = '"obs_date"' if schema_features()["obs_date"] else '"Date"'
+    messages.append({"role": "assistant", "content": json.dumps({"sql": sql})})
+    messages.append({
+        "role": "user",
+        "content": f"""That SQL was rejected before running: {problem}
+Rewrite it so it answers the same request more cheaply:
+- filter on "float_id", a "Latitude"/"Longitude" box or a {date_column} range,
+- compare {date_column} bare ({date_column} BETWEEN '2022-01-01' AND '2022-12-31') instead of casting or wrapping it inside WHERE, so indexes can be used,
+- aggregate (COUNT, AVG, MIN, MAX with GROUP BY) instead of returning raw rows.
+Return the same JSON format."""
+    })
 
+    return messages
 
-    return response.choices[0].message.content
 
+async def sql_repair_async(query, type, sql, problem, retrieved_data=None):
+    return await chat_completion_async(GEMINI_API_KEY, build_sql_repair_messages(query, type, sql, problem, retrieved_data), response_format={"type": "json_object"}, name="sql_repair")
@@ -0,0 +1,337 @@
+from dotenv import load_dotenv
+import os
+import re
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from retrieve_data_from_db.result_cache import SQL_TOKEN_PATTERN
+from data_version.version import get_data_version
+
+
+load_dotenv()
+SQL_TEMPLATES_ENABLED = os.getenv('SQL_TEMPLATES_ENABLED', 'true').lower() == 'true'
+SQL_TEMPLATES_MAX = int(os.getenv('SQL_TEMPLATES_MAX', '500'))
+SQL_TEMPLATES_PATH = os.getenv('SQL_TEMPLATES_PATH', str(Path(__file__).parent.parent / "sql_templates.json"))
+
+# literal slots in an enhanced query, most specific first
+SLOT_PATTERNS = [
+    ("date", re.compile(r"\b\d{4}-\d{2}-\d{2}\b")),
+    ("float_id", re.compile(r"\b\d{7}\b")),
+    ("year", re.compile(r"\b(?:19|20)\d{2}\b")),
+    ("num", re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")),
+]
+
+# tokens after which a literal is a filter value (or a LIMIT), the only places slots are looked for
+PREDICATE_TOKENS = {"=", "<", ">", "<=", ">=", "<>", "!=", "between", "and", "in", "(", ",", "limit"}
+
+# literals like these left in the SQL would come from the question in some way we can't see
+QUESTION_LIKE_LITERAL = re.compile(r"^'?(\d{7}|\d{4}-\d{2}-\d{2}|(?:19|20)\d{2})'?$")
+
+
+def extract_slots(text):
+    """(intent, [(kind, value)]): the query with its literals replaced by <kind>, and the literals in order"""
+    found = []
+    taken = []
+    for kind, pattern in SLOT_PATTERNS:
+        for match in pattern.finditer(text):
+            if(any(start < match.end() and match.start() < end for start, end in taken)):
+                continue
+            taken.append((match.start(), match.end()))
+            found.append((match.start(), match.end(), kind, match.group()))
+
+    found.sort()
+    intent = []
+    last = 0
+    for start, end, kind, _ in found:
+        intent.append(text[last:start])
+        intent.append(f"<{kind}>")
+        last = end
+    intent.append(text[last:])
+
+    intent = re.sub(r"\s+", " ", "".join(intent)).strip().lower()
+    return intent, [(kind, value) for _, _, kind, value in found]
+
+
+def _slot_names(slots):
+    counts = {}
+    names = []
+    for kind, _ in slots:
+        names.append(f"{kind}_{counts.get(kind, 0)}")
+        counts[kind] = counts.get(kind, 0) + 1
+    return names
+
+
+# kind is the SQL_TOKEN_PATTERN group (word, number, string, ...)
+_Token = namedtuple("_Token", ["kind", "text", "start", "end"])
+
+
+def _sql_tokens(sql):
+    """SQL tokens (comments dropped), with a minus sign that starts a number literal
+    ("BETWEEN -10 AND 5", "= -3.5") joined to it, so the sign is part of the bound value"""
+    tokens = []
+    for m in SQL_TOKEN_PATTERN.finditer(sql):
+        if(m.lastgroup == "comment"):
+            continue
+        previous = tokens[-2] if len(tokens) >= 2 else None
+        if(m.lastgroup == "number" and tokens and tokens[-1].text == "-" and tokens[-1].end == m.start()
+                and previous != None and previous.text.lower() in PREDICATE_TOKENS):
+            sign = tokens.pop()
+            tokens.append(_Token("number", "-" + m.group(), sign.start, m.end()))
+            continue
+        tokens.append(_Token(m.lastgroup, m.group(), m.start(), m.end()))
+    return tokens
+
+
+# {name} or {name+1} in a parameter format; +1 is only used on years (the exclusive end of a year range)
+FORMAT_FIELD = re.compile(r"\{(\w+)(\+1)?\}")
+
+# '2023-01-01' closing a year range of 2022 ("obs_date" < '2023-01-01')
+NEXT_YEAR_START = re.compile(r"^(\d{4})-01-01$")
+
+
+def _bound_slots(params):
+    """slot name -> how many parameters are filled from it"""
+    counts = {}
+    for spec in params.values():
+        for name, _ in FORMAT_FIELD.findall(spec.get("format", "")):
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def _format(template, values):
+    """template with {name} / {name+1} filled from values, None when a slot is missing"""
+    def field(match):
+        value = values[match.group(1)]
+        return str(int(value) + 1) if match.group(2) else value
+
+    try:
+        return FORMAT_FIELD.sub(field, template)
+    except (KeyError, ValueError):
+        return None
+
+
+def parameterize(sql, slots, vector_ids=None):
+    """Template SQL with :s0, :s1 ... bind parameters and how to fill each one from the slots,
+    or None when a literal looks question-specific but can't be traced back to a slot, or when
+    a slot of the question isn't bound to any parameter (the SQL would then keep an
+    answer-changing literal of this question, e.g. INTERVAL '10 years'). One slot may fill
+    several parameters, e.g. a year both bounds of a date range"""
+    names = _slot_names(slots)
+    values = {name: value for name, (_, value) in zip(names, slots)}
+    # two slots with the same value can't be told apart in the SQL
+    if(len(set(values.values())) != len(values)):
+        return None
+    tokens = _sql_tokens(sql)
+
+    out = []
+    params = {}
+    i = 0
+    previous = None
+    while(i < len(tokens)):
+        token = tokens[i]
+        kind, text = token.kind, token.text
+
+        # "x" IN ('id1', 'id2', ...) with exactly the vector search ids -> "x" = ANY(:vector_ids)
+        if(vector_ids and text.lower() == "in" and i + 1 < len(tokens) and tokens[i + 1].text == "("):
+            end = i + 2
+            literals = []
+            kinds = set()
+            while(end < len(tokens) and tokens[end].kind in ("string", "number")):
+                literals.append(tokens[end].text.strip("'"))
+                kinds.add(tokens[end].kind)
+                end += 1
+                if(end < len(tokens) and tokens[end].text == ","):
+                    end += 1
+            if(end < len(tokens) and tokens[end].text == ")" and len(kinds) == 1 and set(literals) == set(str(v) for v in vector_ids)):
+                if(previous == "not"):
+                    return None
+                out += ["= ANY", "(", ":vector_ids", ")"]
+                params["vector_ids"] = {"vector_ids": True, "type": kinds.pop()}
+                i = end + 1
+                previous = ")"
+                continue
+
+        # :vector_ids written by the generator is already a parameter
+        if(text == ":" and i + 1 < len(tokens) and tokens[i + 1].start == token.end and tokens[i + 1].kind == "word"):
+            if(tokens[i + 1].text != "vector_ids" or not vector_ids):
+                return None
+            out.append(":vector_ids")
+            params["vector_ids"] = {"vector_ids": True, "type": "string"}
+            i += 2
+            previous = "literal"
+            continue
+
+        if(kind in ("string", "number") and previous in PREDICATE_TOKENS):
+            inner = text[1:-1] if kind == "string" else text
+            template = inner
+            for name in sorted(values, key=lambda n: -len(values[n])):
+                value = values[name]
+                if(inner == value or (kind == "string" and value in inner and name.split("_")[0] in ("year", "date"))):
+                    template = template.replace(value, "{" + name + "}")
+
+            next_year = NEXT_YEAR_START.match(inner) if kind == "string" and template == inner else None
+            if(next_year != None):
+                for name, value in values.items():
+                    if(name.startswith("year_") and int(next_year.group(1)) == int(value) + 1):
+                        template = "{" + name + "+1}-01-01"
+                        break
+
+            if(template != inner):
+                param = f"s{sum(1 for name in params if name != 'vector_ids')}"
+                params[param] = {"format": template, "type": kind}
+                out.append(":" + param)
+                i += 1
+                previous = "literal"
+                continue
+
+        if(kind in ("string", "number") and QUESTION_LIKE_LITERAL.match(text)):
+            return None
+
+        out.append(text)
+        previous = text.lower()
+        i += 1
+
+    while(out and out[-1] == ";"):
+        out.pop()
+
+    bound = _bound_slots(params)
+    if(any(bound.get(name, 0) == 0 for name in names)):
+        return None
+
+    return " ".join(out), params
+
+
+def fill_params(params, slots, vector_ids=None):
+    names = _slot_names(slots)
+    values = {name: value for name, (_, value) in zip(names, slots)}
+
+    filled = {}
+    for param, spec in params.items():
+        if(spec.get("vector_ids")):
+            if(not vector_ids):
+                return None
+            if(spec["type"] == "number" and not all(str(v).isdigit() for v in vector_ids)):
+                return None
+            filled[param] = [int(v) if spec["type"] == "number" else str(v) for v in vector_ids]
+            continue
+
+        value = _format(spec["format"], values)
+        if(value == None):
+            return None
+        filled[param] = value if spec["type"] == "string" else (float(value) if "." in value else int(value))
+
+    return filled
+
+
+class SQLTemplateStore:
+    """Generated SQL keyed on the shape of the question (tab, search type and the enhanced
+    query with its literals taken out). A question of a known shape gets the stored SQL
+    with its own literals bound as parameters, without a sql_generator call."""
+
+    def __init__(self, path, max_templates):
+        self.path = Path(path) if path else None
+        self.max_templates = max_templates
+
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "learned": 0, "unparameterizable": 0, "invalidations": 0}
+        self._data_version = get_data_version()
+
+        if(self.path != None and self.path.exists()):
+            try:
+                stored = json.loads(self.path.read_text())
+                # templates learned against another data version (schema, rollups) aren't trusted
+                if(isinstance(stored, dict) and stored.get("data_version") == self._data_version):
+                    for entry in stored["templates"]:
+                        self._templates[entry["key"]] = entry
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                print(f"Ignoring unreadable SQL templates file: {e}")
+
+
+    @staticmethod
+    def _key(intent, tab, search_type, has_vector_ids):
+        return json.dumps([tab, search_type, bool(has_vector_ids), intent])
+
+
+    def _save(self):
+        if(self.path == None):
+            return
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"data_version": self._data_version, "templates": list(self._templates.values())}, indent=1))
+        os.replace(tmp_path, self.path)
+
+
+    def _check_data_version(self):
+        version = get_data_version()
+        if(version != self._data_version):
+            self._templates.clear()
+            self._data_version = version
+            self._stats["invalidations"] += 1
+            self._save()
+
+
+    def match(self, enhanced_query, tab, search_type, vector_ids=None):
+        """(sql, params, sources_to_cite) for a known question shape, else None"""
+        intent, slots = extract_slots(enhanced_query)
+        key = self._key(intent, tab, search_type, vector_ids)
+
+        with self._lock:
+            self._check_data_version()
+            entry = self._templates.get(key)
+            params = fill_params(entry["params"], slots, vector_ids) if entry != None else None
+            if(params == None):
+                self._stats["misses"] += 1
+                return None
+
+            self._templates.move_to_end(key)
+            self._stats["hits"] += 1
+
+        sources_to_cite = entry["sources_to_cite"]
+        if(sources_to_cite == "ids"):
+            ids = vector_ids or [value for kind, value in slots if kind == "float_id"]
+            sources_to_cite = ", ".join(str(v) for v in ids) if ids else "all"
+
+        return entry["sql"], params, sources_to_cite
+
+
+    def learn(self, enhanced_query, tab, search_type, sql, sources_to_cite, vector_ids=None):
+        intent, slots = extract_slots(enhanced_query)
+        parameterized = parameterize(sql, slots, vector_ids)
+
+        with self._lock:
+            self._check_data_version()
+            if(parameterized == None):
+                self._stats["unparameterizable"] += 1
+                return False
+
+            template_sql, params = parameterized
+            key = self._key(intent, tab, search_type, vector_ids)
+            self._templates[key] = {
+                "key": key,
+                "intent": intent,
+                "sql": template_sql,
+                "params": params,
+                "sources_to_cite": sources_to_cite if sources_to_cite in (None, "all") else "ids"
+            }
+            self._templates.move_to_end(key)
+            while(len(self._templates) > self.max_templates):
+                self._templates.popitem(last=False)
+
+            self._stats["learned"] += 1
+            self._save()
+
+        return True
+
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "templates": len(self._templates)
+            }
+
+
+sql_templates = SQLTemplateStore(SQL_TEMPLATES_PATH, SQL_TEMPLATES_MAX)
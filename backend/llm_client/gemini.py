@@ -0,0 +1,100 @@
+import asyncio
+from llm_client.response_cache import response_cache, cache_key, LLM_CACHE_ENABLED
+from llm_client.registry import call_with_retry, call_with_retry_async, async_in_flight_limit
+
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+
+def chat_completion(api_key, messages, response_format=None, name=None, timeout=None):
+    key = None
+    if(LLM_CACHE_ENABLED):
+        key = cache_key(GEMINI_MODEL, messages, response_format)
+        cached = response_cache.get(key, name)
+        if(cached != None):
+            return cached
+
+    kwargs = {}
+    if(response_format != None):
+        kwargs['response_format'] = response_format
+
+    response = call_with_retry(api_key, lambda client, timeout: client.chat.completions.create(
+        model=GEMINI_MODEL,
+        messages=messages,
+        timeout=timeout,
+        **kwargs
+    ), timeout)
+
+    content = response.choices[0].message.content
+    if(key != None and content != None):
+        response_cache.put(key, name, content)
+
+    return content
+
+
+async def chat_completion_async(api_key, messages, response_format=None, name=None, timeout=None):
+    key = None
+    if(LLM_CACHE_ENABLED):
+        key = cache_key(GEMINI_MODEL, messages, response_format)
+        # memory tier inline, SQLite tier off the event loop
+        cached = response_cache.get_memory(key, name)
+        if(cached == None):
+            cached = await asyncio.to_thread(response_cache.get_disk, key, name)
+        if(cached != None):
+            return cached
+
+    kwargs = {}
+    if(response_format != None):
+        kwargs['response_format'] = response_format
+
+    response = await call_with_retry_async(api_key, lambda client, timeout: client.chat.completions.create(
+        model=GEMINI_MODEL,
+        messages=messages,
+        timeout=timeout,
+        **kwargs
+    ), timeout)
+
+    content = response.choices[0].message.content
+    if(key != None and content != None):
+        response_cache.put_memory(key, content)
+        await asyncio.to_thread(response_cache.put_disk, key, name, content)
+
+    return content
+
+
+async def chat_completion_stream_async(api_key, messages, name=None, timeout=None):
+    """Yields the completion text piece by piece as Gemini streams it"""
+    key = None
+    if(LLM_CACHE_ENABLED):
+        key = cache_key(GEMINI_MODEL, messages, None)
+        cached = response_cache.get_memory(key, name)
+        if(cached == None):
+            cached = await asyncio.to_thread(response_cache.get_disk, key, name)
+        if(cached != None):
+            yield cached
+            return
+
+    chunks = []
+
+    # the in-flight slot is held until the whole stream has been read
+    async with async_in_flight_limit(api_key):
+        stream = await call_with_retry_async(api_key, lambda client, timeout: client.chat.completions.create(
+            model=GEMINI_MODEL,
+            messages=messages,
+            stream=True,
+            timeout=timeout
+        ), timeout, limit=False)
+
+        async for chunk in stream:
+            if(not chunk.choices):
+                continue
+
+            token = chunk.choices[0].delta.content
+            if(token):
+                chunks.append(token)
+                yield token
+
+    if(key != None and chunks):
+        content = "".join(chunks)
+        response_cache.put_memory(key, content)
+        await asyncio.to_thread(response_cache.put_disk, key, name, content)
@@ -0,0 +1,150 @@
+from dotenv import load_dotenv
+import os
+import asyncio
+import random
+import threading
+import time
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+
+load_dotenv()
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+
+LLM_MAX_IN_FLIGHT_PER_KEY = int(os.getenv('LLM_MAX_IN_FLIGHT_PER_KEY', '8'))
+LLM_MAX_CONNECTIONS_PER_KEY = int(os.getenv('LLM_MAX_CONNECTIONS_PER_KEY', '20'))
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '60'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5'))
+
+# HTTP/2 needs the optional h2 package, fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# GEMINI_API_KEY1..4 are the keys the prompt modules use
+GEMINI_API_KEYS = [key for key in (os.getenv(f"GEMINI_API_KEY{i}") for i in range(1, 5)) if key]
+
+_lock = threading.Lock()
+_clients = {}
+_async_clients = {}
+_semaphores = {}
+_async_semaphores = {}
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS_PER_KEY,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS_PER_KEY,
+        keepalive_expiry=120
+    )
+
+
+def get_client(api_key):
+    """One pooled OpenAI client per API key, kept for the life of the process"""
+    with _lock:
+        if(api_key not in _clients):
+            _clients[api_key] = OpenAI(
+                api_key=api_key,
+                base_url=GEMINI_BASE_URL,
+                max_retries=0,
+                timeout=LLM_TIMEOUT_SECONDS,
+                http_client=httpx.Client(http2=HTTP2_AVAILABLE, limits=_limits(), timeout=LLM_TIMEOUT_SECONDS)
+            )
+            _semaphores[api_key] = threading.BoundedSemaphore(LLM_MAX_IN_FLIGHT_PER_KEY)
+
+        return _clients[api_key]
+
+
+def get_async_client(api_key):
+    with _lock:
+        if(api_key not in _async_clients):
+            _async_clients[api_key] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=GEMINI_BASE_URL,
+                max_retries=0,
+                timeout=LLM_TIMEOUT_SECONDS,
+                http_client=httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=_limits(), timeout=LLM_TIMEOUT_SECONDS)
+            )
+            _async_semaphores[api_key] = asyncio.Semaphore(LLM_MAX_IN_FLIGHT_PER_KEY)
+
+        return _async_clients[api_key]
+
+
+def in_flight_limit(api_key):
+    get_client(api_key)
+    return _semaphores[api_key]
+
+
+def async_in_flight_limit(api_key):
+    get_async_client(api_key)
+    return _async_semaphores[api_key]
+
+
+def is_retryable(error):
+    if(isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError))):
+        return True
+
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_delay(attempt):
+    # full jitter: sleep somewhere in [0, base * 2^attempt]
+    return random.uniform(0, LLM_RETRY_BASE_DELAY * (2 ** attempt))
+
+
+def call_with_retry(api_key, create, timeout=None):
+    """Runs create(client, timeout) under the key's in-flight limit, retrying 429 / 5xx / timeouts"""
+    client = get_client(api_key)
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            with in_flight_limit(api_key):
+                return create(client, timeout or LLM_TIMEOUT_SECONDS)
+        except Exception as e:
+            if(attempt == LLM_MAX_RETRIES or not is_retryable(e)):
+                raise
+            delay = retry_delay(attempt)
+            print(f"LLM call failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+async def call_with_retry_async(api_key, create, timeout=None, limit=True):
+    """limit=False when the caller already holds the key's in-flight slot (streaming)"""
+    client = get_async_client(api_key)
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            if(not limit):
+                return await create(client, timeout or LLM_TIMEOUT_SECONDS)
+
+            async with async_in_flight_limit(api_key):
+                return await create(client, timeout or LLM_TIMEOUT_SECONDS)
+        except Exception as e:
+            if(attempt == LLM_MAX_RETRIES or not is_retryable(e)):
+                raise
+            delay = retry_delay(attempt)
+            print(f"LLM call failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+def warm_up_clients():
+    for api_key in GEMINI_API_KEYS:
+        get_client(api_key)
+        get_async_client(api_key)
+
+
+async def close_clients():
+    with _lock:
+        clients = list(_clients.values())
+        async_clients = list(_async_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+
+    for client in clients:
+        client.close()
+    for client in async_clients:
+        await client.close()
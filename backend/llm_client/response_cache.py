@@ -0,0 +1,182 @@
+from dotenv import load_dotenv
+import os
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+load_dotenv()
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '2000'))
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', str(Path(__file__).parent.parent / "llm_cache.sqlite3"))
+# SQLite tier: rows older than the TTL are ignored and pruned, least recently used ones past the cap dropped
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 86400)))
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv('LLM_CACHE_DISK_MAX_ENTRIES', '50000'))
+
+# writes between two prunes of the SQLite tier
+PRUNE_EVERY = 100
+
+
+def cache_key(model, messages, response_format):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "response_format": response_format},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Completion text keyed on model + messages + response_format.
+
+    Two tiers: an in-memory LRU in front of a SQLite table, so repeated prompts
+    are answered without a network call and survive restarts. Entries expire
+    after `ttl_seconds` in both tiers; the SQLite table keeps at most
+    `disk_max_entries` rows, least recently used dropped first. Hits and misses
+    are counted per calling module.
+    """
+
+    def __init__(self, path, max_entries, ttl_seconds=LLM_CACHE_TTL_SECONDS, disk_max_entries=LLM_CACHE_DISK_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._writes = 0
+        self.expired = 0
+
+        self._db = None
+        if(path):
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_responses (key TEXT PRIMARY KEY, name TEXT, response TEXT)")
+            # tables written before expiry existed count as created now
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(llm_responses)")}
+            for column in ("created_at", "used_at"):
+                if(column not in columns):
+                    self._db.execute(f"ALTER TABLE llm_responses ADD COLUMN {column} REAL NOT NULL DEFAULT {time.time()}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_used_at ON llm_responses (used_at)")
+            self._db.commit()
+            with self._lock:
+                self._prune()
+
+
+    def _count(self, name, field):
+        stats = self._stats.setdefault(name or "default", {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        stats[field] += 1
+
+
+    def _remember(self, key, response, created_at=None):
+        self._memory[key] = (response, created_at or time.time())
+        self._memory.move_to_end(key)
+        while(len(self._memory) > self.max_entries):
+            self._memory.popitem(last=False)
+
+
+    def _prune(self):
+        """Deletes expired rows and the least recently used ones past disk_max_entries (lock held)"""
+        expired = self._db.execute("DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+        self._db.execute(
+            "DELETE FROM llm_responses WHERE key IN (SELECT key FROM llm_responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,)
+        )
+        self._db.commit()
+        self.expired += expired
+
+
+    def get_memory(self, key, name=None):
+        with self._lock:
+            entry = self._memory.get(key)
+            if(entry != None and time.time() - entry[1] > self.ttl_seconds):
+                self._memory.pop(key)
+                self.expired += 1
+                entry = None
+            if(entry != None):
+                self._memory.move_to_end(key)
+                self._count(name, "memory_hits")
+            return entry[0] if entry != None else None
+
+
+    def get_disk(self, key, name=None):
+        response = None
+        created_at = None
+        if(self._db != None):
+            with self._lock:
+                now = time.time()
+                row = self._db.execute(
+                    "SELECT response, created_at FROM llm_responses WHERE key = ? AND created_at >= ?",
+                    (key, now - self.ttl_seconds)
+                ).fetchone()
+                if(row != None):
+                    self._db.execute("UPDATE llm_responses SET used_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+            if(row != None):
+                response, created_at = row
+
+        with self._lock:
+            if(response != None):
+                self._remember(key, response, created_at)
+                self._count(name, "disk_hits")
+            else:
+                self._count(name, "misses")
+
+        return response
+
+
+    def get(self, key, name=None):
+        response = self.get_memory(key, name)
+        if(response == None):
+            response = self.get_disk(key, name)
+        return response
+
+
+    def put_memory(self, key, response):
+        with self._lock:
+            self._remember(key, response)
+
+
+    def put_disk(self, key, name, response):
+        if(self._db == None):
+            return
+
+        with self._lock:
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, name, response, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, name, response, now, now)
+            )
+            self._db.commit()
+
+            self._writes += 1
+            if(self._writes % PRUNE_EVERY == 0):
+                self._prune()
+
+
+    def put(self, key, name, response):
+        self.put_memory(key, response)
+        self.put_disk(key, name, response)
+
+
+    def stats(self):
+        with self._lock:
+            modules = {}
+            for name, stats in self._stats.items():
+                lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+                hits = stats["memory_hits"] + stats["disk_hits"]
+                modules[name] = {**stats, "hit_rate": hits / lookups if lookups else 0.0}
+
+            return {
+                "memory_entries": len(self._memory),
+                "expired": self.expired,
+                "modules": modules
+            }
+
+
+response_cache = LLMResponseCache(LLM_CACHE_PATH if LLM_CACHE_ENABLED else None, LLM_CACHE_MAX_ENTRIES)
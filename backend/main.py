@@ -52,18 +52,36 @@ from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import pandas as pd
 import json
+import re
 import asyncio
-from query_enhancement.enhance import query_enhancer
-from query_enhancement.classify import query_classifier
-from query_enhancement.filters import generate_filters
-from store_in_vector_db.vector_db import query_documents
-from generate_sql.sql import sql_generator
-from fastapi.staticfiles import StaticFiles
+from concurrent.futures import ThreadPoolExecutor
+from query_enhancement.enhance import query_enhancer_async
+from query_enhancement.fast_classify import query_classifier_fast_async, fast_classifier_stats
+from query_enhancement.filters import generate_filters_async
+from query_enhancement.understand import understand_query_async
+from store_in_vector_db.vector_db import query_documents, generate_embeddings, EMBEDDING_BACKEND
+from generate_sql.sql import sql_generator_async, sql_repair_async
+from generate_sql.guard import guard_sql, check_single_select, statement_timeout_ms, sql_guard_stats
+from generate_sql.templates import sql_templates, SQL_TEMPLATES_ENABLED
+from rollups.router import route_to_rollup, rollup_router_stats
+from fastapi.responses import StreamingResponse
 from pathlib import Path
-from retrieve_data_from_db.postgres_db import retrieve_data_from_postgres
-from final_ans.final_llm_call import get_ans_with_relevant_data
+from retrieve_data_from_db.postgres_db import retrieve_data_from_postgres, retrieve_data_from_postgres_async, stream_data_from_postgres, render_sql
+from retrieve_data_from_db.postgres_db import sample_from_postgres, sample_from_postgres_async
+from retrieve_data_from_db.sampling import THEORY_SAMPLING, THEORY_DATA_TOKEN_BUDGET
+from database.engine import warm_up_engine, warm_up_async_engine, async_engine_available, dispose_engines, pool_stats
+from retrieve_data_from_db.result_cache import sql_result_cache, is_volatile_sql
+from final_ans.final_llm_call import get_ans_with_relevant_data_async, stream_ans_with_relevant_data_async
+from final_ans.digest import build_data_digest
+from answer_cache.semantic_cache import semantic_cache, SEMANTIC_CACHE_ENABLED
+from llm_client.response_cache import response_cache
+from embedding_cache.embedding_cache import embedding_cache
+from llm_client.registry import warm_up_clients, close_clients
+from artifact_store.artifacts import find_artifact, publish_artifact, artifact_url, artifact_stats, ARTIFACT_DIRS, ARTIFACT_FORMATS
+from artifact_store.static_files import ArtifactStaticFiles
+from observability.tracing import span, traced, set_request_labels, metrics_payload
+from fastapi import Response
 
 from typing import Optional
 from fastapi import File, UploadFile
@@ -88,6 +106,15 @@ import torch
 load_dotenv()
 DB_URL = os.getenv('DB_URL')
 
+# "staged" = enhance -> classify -> filters (3 LLM calls), "fused" = one understand_query call
+QUERY_UNDERSTANDING_MODE = os.getenv('QUERY_UNDERSTANDING_MODE', 'staged').lower()
+
+# run classify, filters and query embedding concurrently once the enhanced query is known
+SPECULATIVE_STAGES = os.getenv('SPECULATIVE_STAGES', 'true').lower() == 'true'
+
+# the theory answer stops reading the Postgres cursor after this many rows
+FINAL_ANSWER_MAX_ROWS = int(os.getenv('FINAL_ANSWER_MAX_ROWS', '5000'))
+
 # Global Whisper model - loaded once at startup
 whisper_model = None
 
@@ -111,6 +138,15 @@ app = FastAPI()
 @app.on_event("startup")
 async def startup_event():
     load_whisper_model()
+    warm_up_clients()
+    await run_blocking(warm_up_engine)
+    await warm_up_async_engine()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_clients()
+    await dispose_engines()
 
 origins = ["http://localhost:5173","http://localhost:8080", "http://127.0.0.1:5173"]
 app.add_middleware(
@@ -162,233 +198,443 @@ def clean_response(res):
     return res
 
 
-async def save_pg_data_async(pg_data, path):
-    await asyncio.to_thread(pg_data.to_csv, path, index=False)
+# Chroma, Postgres and pandas calls are blocking, so they run on this pool
+# instead of holding up the event loop that serves every request
+blocking_executor = ThreadPoolExecutor(max_workers=int(os.getenv('BLOCKING_IO_WORKERS', '32')))
 
 
-def text_answer(query, language):
-    res = clean_response(query_enhancer(query, language, []))
-    print("Query : ",query)
-    
-    # reply
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, lambda: func(*args, **kwargs))
+
+
+async def understand_query_staged(query, language):
+    res = clean_response(await traced("enhance", query_enhancer_async(query, language, [])))
+
     if(res.get('reply') != None):
+        return {"reply": res['reply']}
+
+    if(res.get('enhanced_query') == None):
+        return {}
+
+    enhanced_query = res['enhanced_query']
+
+    if(SPECULATIVE_STAGES):
+        return await understand_query_speculative(enhanced_query)
+
+    res = clean_response(await traced("classify", query_classifier_fast_async(enhanced_query)))
+    search_type = res.get('search_type')
+
+    where = None
+    if(search_type == "vector"):
+        res = clean_response(await traced("filters", generate_filters_async(enhanced_query)))
+        where = res.get('where')
+
+    return {
+        "reply": None,
+        "enhanced_query": enhanced_query,
+        "search_type": search_type,
+        "where": where
+    }
+
+
+def discard_task(task):
+    # cancel a speculative stage and swallow whatever it ends with
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def understand_query_speculative(enhanced_query):
+    """Classifier, filters and embedding only need enhanced_query, so start all three at once
+    and throw the vector-only results away if the classifier picks sql"""
+    filters_task = asyncio.create_task(traced("filters", generate_filters_async(enhanced_query)))
+    embed_task = asyncio.create_task(traced("embed", run_blocking(generate_embeddings, enhanced_query)))
+
+    try:
+        res = clean_response(await traced("classify", query_classifier_fast_async(enhanced_query)))
+    except Exception:
+        discard_task(filters_task)
+        discard_task(embed_task)
+        raise
+
+    search_type = res.get('search_type')
+
+    if(search_type != "vector"):
+        discard_task(filters_task)
+
+        # the semantic cache still wants the embedding on the sql path
+        query_embedding = None
+        if(SEMANTIC_CACHE_ENABLED):
+            query_embedding = await embed_task
+        else:
+            discard_task(embed_task)
+
         return {
-            "text": res['reply']
+            "reply": None,
+            "enhanced_query": enhanced_query,
+            "search_type": search_type,
+            "where": None,
+            "query_embedding": query_embedding
         }
 
-    if(res.get('enhanced_query') != None):
-        enhanced_query = res['enhanced_query']
-        print("enhanced query : ", enhanced_query)
+    try:
+        res, query_embedding = await asyncio.gather(filters_task, embed_task)
+    except Exception:
+        discard_task(filters_task)
+        discard_task(embed_task)
+        raise
+
+    return {
+        "reply": None,
+        "enhanced_query": enhanced_query,
+        "search_type": search_type,
+        "where": clean_response(res).get('where'),
+        "query_embedding": query_embedding
+    }
+
+
+async def understand_query(query, language):
+    """Returns {reply, enhanced_query, search_type, where} using the configured mode"""
+    if(QUERY_UNDERSTANDING_MODE == "fused"):
+        res = clean_response(await traced("understand", understand_query_async(query, language)))
+        if(res.get('search_type') == "vector" and res.get('where') == None):
+            res['where'] = {}
+    else:
+        res = await understand_query_staged(query, language)
+
+    set_request_labels(search_type=res.get('search_type') or "none")
+    return res
 
-        res = clean_response(query_classifier(enhanced_query))
 
-        if(res.get('search_type') != None):
+async def lookup_cached_answer(understanding, tab, language):
+    if(not SEMANTIC_CACHE_ENABLED):
+        return None
 
-            search_type = res['search_type']
-            print("search type : ", search_type)
-            print("Query :",query)
+    if(understanding.get('query_embedding') == None):
+        understanding['query_embedding'] = await traced("embed", run_blocking(generate_embeddings, understanding['enhanced_query']))
 
-            # direct SQL
-            if(search_type == "sql"):
-                res = clean_response(sql_generator(enhanced_query, 'theory'))
-                if(res.get('sql') != None):
-                    sql = res['sql']
-                    print("SQL : ", sql, end="\n\n")
+    return await traced("answer_cache_lookup", run_blocking(semantic_cache.lookup, understanding['query_embedding'], tab, language, understanding['enhanced_query'], EMBEDDING_BACKEND))
 
-                    pg_data = retrieve_data_from_postgres(sql)
-                    pg_data = pg_data.to_json(orient="records")
 
-                    sources_to_cite=None
-                    if(res.get('sources_to_cite')):
-                        sources_to_cite = res['sources_to_cite']
-                        print("Sources to cite : ", sources_to_cite, end="\n\n")
+async def remember_answer(understanding, tab, language, answer, complete=True):
+    if(not SEMANTIC_CACHE_ENABLED or understanding.get('query_embedding') == None):
+        return answer
 
-                    final_ans_text = get_ans_with_relevant_data(enhanced_query, pg_data, [], sources_to_cite, language)
-                    print("FInal ans : ", final_ans_text)
+    # an answer that still says the export is running, or that changes with the clock, isn't replayed
+    if(not complete or is_volatile_sql(understanding.get('sql') or "")):
+        return answer
 
-                    return {
-                        "text": final_ans_text,
-                    }
-                
-            elif(search_type == "vector"):
+    return await run_blocking(
+        semantic_cache.store,
+        understanding['query_embedding'],
+        tab,
+        language,
+        understanding['enhanced_query'],
+        answer,
+        EMBEDDING_BACKEND
+    )
 
-                res = clean_response(generate_filters(enhanced_query))
-                print("Retrieved vector data : ", res)
 
-                if(res.get('where') != None):
-                    where_filters = res['where']
-                    res = query_documents(enhanced_query, where_filters)
-                    vector_ids = res['ids'][0]
+async def generate_relevant_sql(understanding, tab):
+    """Vector search (if needed) and SQL generation for an understood query.
+    Returns (sql, sources_to_cite, params), sql is None if nothing could be generated.
+    params holds the values to bind into sql: the vector search ids as :vector_ids, and the
+    slot values when a question with the shape of an earlier one reuses its SQL as a template"""
+    enhanced_query = understanding['enhanced_query']
+    search_type = understanding.get('search_type')
+    print("search type : ", search_type)
 
-                    print(vector_ids)
+    vector_ids = None
 
+    if(search_type == "vector"):
+        print("Retrieved vector data : ", understanding.get('where'))
 
-                    res = clean_response(sql_generator(enhanced_query, 'theory', vector_ids))
-                    print(res)
-                    if(res.get('sql') != None):
-                        sql = res['sql']
-                        print("SQL : ", sql)
+        if(understanding.get('where') == None):
+            return None, None, None
 
-                        pg_data = retrieve_data_from_postgres(sql)
-                        pg_data = pg_data.to_json(orient="records")
+        res = await traced("vector_search", run_blocking(query_documents, enhanced_query, understanding['where'], understanding.get('query_embedding')))
+        vector_ids = res['ids'][0]
+        print(vector_ids)
 
-                        sources_to_cite=None
-                        if(res.get('sources_to_cite')):
-                            sources_to_cite = res['sources_to_cite']
-                            print("Sources to cite : ", sources_to_cite, end="\n\n")
+    elif(search_type != "sql"):
+        return None, None, None
 
+    template = sql_templates.match(enhanced_query, tab, search_type, vector_ids) if SQL_TEMPLATES_ENABLED else None
 
-                        final_ans_text = get_ans_with_relevant_data(enhanced_query, pg_data, [], sources_to_cite, language)
-                        print("FInal ans : ", final_ans_text)
+    if(template != None):
+        template_sql, params, sources_to_cite = template
+        print("SQL template : ", template_sql, params)
+    else:
+        res = clean_response(await traced("sql_generation", sql_generator_async(enhanced_query, tab, vector_ids)))
+        print(res)
 
-                        return {
-                            "text": final_ans_text,
-                        }
+        if(res.get('sql') == None):
+            return None, None, None
 
+        # the vector search ids are bound as :vector_ids, the LLM never sees or copies them
+        template_sql = res['sql']
+        params = {"vector_ids": [str(v) for v in vector_ids]} if vector_ids and ":vector_ids" in template_sql else {}
+        sources_to_cite = res.get('sources_to_cite') or None
+        if(sources_to_cite == "vector_ids"):
+            sources_to_cite = ", ".join(params.get("vector_ids", [])) or "all"
 
+    generated_sql = render_sql(template_sql, params)
 
-def table_answer(query, language="english"):
-    res = clean_response(query_enhancer(query, language, []))
-    
-    # reply
-    if(res.get('reply') != None):
-        return {
-            "text": res['reply'],
-            "csv_url": None
-        }
+    async def repair(bad_sql, problem):
+        if(params.get("vector_ids")):
+            bad_sql = bad_sql.replace(render_sql(":vector_ids", params), ":vector_ids")
+        fixed = clean_response(await traced("sql_repair", sql_repair_async(enhanced_query, tab, bad_sql, problem, vector_ids)))
+        return render_sql(fixed['sql'], params) if fixed.get('sql') != None else None
 
-    if(res.get('enhanced_query') != None):
-        enhanced_query = res['enhanced_query']
-        print("enhanced query : ", enhanced_query)
+    routed = await run_blocking(route_to_rollup, generated_sql)
+    sql = await traced("sql_guard", guard_sql(routed, tab, repair))
+    print("SQL : ", sql, end="\n\n")
+    # remember_answer checks it before caching the answer
+    understanding['sql'] = sql
 
-        res = clean_response(query_classifier(enhanced_query))
+    if(sources_to_cite):
+        print("Sources to cite : ", sources_to_cite, end="\n\n")
 
-        if(res.get('search_type') != None):
+    # only SQL the guard let through as it was is worth reusing
+    accepted = sql == routed or sql == check_single_select(routed)
 
-            search_type = res['search_type']
-            print("search type : ", search_type)
+    if(template == None and accepted and SQL_TEMPLATES_ENABLED):
+        await run_blocking(sql_templates.learn, enhanced_query, tab, search_type, template_sql, sources_to_cite, vector_ids)
 
-            # direct SQL
-            if(search_type == "sql"):
-                res = clean_response(sql_generator(enhanced_query, 'table'))
-                if(res.get('sql') != None):
-                    sql = res['sql']
-                    print("SQL : ", sql)
+    if(accepted and routed == generated_sql):
+        return template_sql, sources_to_cite, params or None
+    return sql, sources_to_cite, None
 
-                    pg_data = retrieve_data_from_postgres(sql)
-                    if(res.get('sources_to_cite')):
-                        sources_to_cite = res['sources_to_cite']
-                        print("Sources to cite : ", sources_to_cite, end="\n\n")
 
-                    asyncio.run(save_pg_data_async(pg_data, 'static/tables/userId_chatId_uniqueId.csv'))
+async def retrieve_relevant_data(understanding, tab):
+    """Returns (pg_data, sources_to_cite), pg_data is None if nothing could be retrieved"""
+    sql, sources_to_cite, params = await generate_relevant_sql(understanding, tab)
 
-                    return {
-                        "text": f"Query returned {len(pg_data)} row(s). Showing first {min(len(pg_data), 100)} rows.",
-                        "csv_url": "static/tables/userId_chatId_uniqueId.csv"
-                    }
-                
-            elif(search_type == "vector"):
+    if(sql == None):
+        return None, None
 
-                res = clean_response(generate_filters(enhanced_query))
-                print("Retrieved vector data : ", res)
+    # theory answers get a stratified sample sized to the prompt's token budget, not the first rows
+    if(tab == "theory" and THEORY_SAMPLING != "off"):
+        if(async_engine_available()):
+            pg_data = await traced("postgres", sample_from_postgres_async(sql, THEORY_DATA_TOKEN_BUDGET, statement_timeout_ms(tab), params))
+        else:
+            pg_data = await traced("postgres", run_blocking(sample_from_postgres, sql, THEORY_DATA_TOKEN_BUDGET, statement_timeout_ms(tab), params))
+    elif(async_engine_available()):
+        pg_data = await traced("postgres", retrieve_data_from_postgres_async(sql, FINAL_ANSWER_MAX_ROWS, statement_timeout_ms(tab), params=params))
+    else:
+        pg_data = await traced("postgres", run_blocking(retrieve_data_from_postgres, sql, FINAL_ANSWER_MAX_ROWS, statement_timeout_ms(tab), params))
 
-                if(res.get('where') != None):
-                    where_filters = res['where']
-                    res = query_documents(enhanced_query, where_filters)
-                    vector_ids = res['ids'][0]
+    return pg_data, sources_to_cite
 
-                    print(vector_ids)
 
+ARTIFACT_URL_PATTERN = re.compile(r"^static/(" + "|".join(ARTIFACT_DIRS.values()) + r")/[0-9a-f]{32}\.csv$")
 
-                    res = clean_response(sql_generator(enhanced_query, 'table', vector_ids))
-                    print(res)
-                    if(res.get('sql') != None):
-                        sql = res['sql']
-                        print("SQL : ", sql)
+# artifact path without its suffix -> task exporting it, so a download that races the export waits for it
+pending_artifacts = {}
 
-                        pg_data = retrieve_data_from_postgres(sql)
-                        if(res.get('sources_to_cite')):
-                            sources_to_cite = res['sources_to_cite']
-                            print("Sources to cite : ", sources_to_cite, end="\n\n")
 
-                        asyncio.run(save_pg_data_async(pg_data, 'static/tables/userId_chatId_uniqueId.csv'))
+def _pending_key(url):
+    return url.rsplit(".", 1)[0]
 
-                        return {
-                            "text": f"Query returned {len(pg_data)} row(s). Showing first {min(len(pg_data), 10)} rows.",
-                            "csv_url": "static/tables/userId_chatId_uniqueId.csv"
-                        }
 
+async def publish_result(tab, sql, params=None):
+    """Streams sql from Postgres into a per-result artifact and returns {"csv_url", "rows", "columns",
+    "preview", "complete"} as soon as the first chunk is in memory; the rest of the CSV / Parquet /
+    Arrow export finishes in the background. When the same SQL was already published for this
+    data version the file is reused and Postgres is skipped"""
+    literal_sql = render_sql(sql, params)
+    # CURRENT_DATE / now() / random(): an earlier run's file isn't this run's answer
+    artifact = None if is_volatile_sql(literal_sql) else await run_blocking(find_artifact, tab, literal_sql)
+    if(artifact != None):
+        print("Reusing artifact : ", artifact['csv_url'])
+        return {**artifact, "complete": True}
+
+    url = artifact_url(tab, literal_sql)
+    key = _pending_key(url)
+    if(key in pending_artifacts):
+        await asyncio.wait([pending_artifacts[key]])
+        artifact = await run_blocking(find_artifact, tab, literal_sql)
+        if(artifact != None):
+            return {**artifact, "complete": True}
+
+    loop = asyncio.get_running_loop()
+    first_chunk = loop.create_future()
+
+    def on_first_chunk(meta):
+        # called on the export thread
+        loop.call_soon_threadsafe(lambda: first_chunk.done() or first_chunk.set_result(meta))
+
+    def export_done(task):
+        pending_artifacts.pop(key, None)
+        if(not task.cancelled() and task.exception() != None):
+            print(f"Export of {url} failed : {task.exception()}")
+
+    chunks = stream_data_from_postgres(sql, timeout_ms=statement_timeout_ms(tab), params=params)
+    task = asyncio.create_task(traced("export", run_blocking(publish_artifact, tab, literal_sql, chunks, on_first_chunk)))
+    pending_artifacts[key] = task
+    task.add_done_callback(export_done)
+
+    await asyncio.wait([first_chunk, task], return_when=asyncio.FIRST_COMPLETED)
+    if(task.done()):
+        # small result (or a failure before the first chunk): the export is already complete
+        return {**task.result(), "complete": True}
+
+    return {"csv_url": url, **first_chunk.result(), "complete": False}
+
+
+async def text_answer(query, language):
+    understanding = await understand_query(query, language)
+    print("Query : ",query)
 
-def plot_answer(query, language="english"):
-    res = clean_response(query_enhancer(query, language, []))
-    
     # reply
-    if(res.get('reply') != None):
+    if(understanding.get('reply') != None):
         return {
-            "text": res['reply'],
-            "csv_url": None
+            "text": understanding['reply']
         }
 
-    if(res.get('enhanced_query') != None):
-        enhanced_query = res['enhanced_query']
+    if(understanding.get('enhanced_query') != None):
+        enhanced_query = understanding['enhanced_query']
         print("enhanced query : ", enhanced_query)
 
-        res = clean_response(query_classifier(enhanced_query))
+        cached_answer = await lookup_cached_answer(understanding, 'theory', language)
+        if(cached_answer != None):
+            return cached_answer
 
-        if(res.get('search_type') != None):
+        pg_data, sources_to_cite = await retrieve_relevant_data(understanding, 'theory')
 
-            search_type = res['search_type']
-            print("search type : ", search_type)
+        if(pg_data is not None):
+            pg_data = await run_blocking(build_data_digest, pg_data, total_rows=pg_data.attrs.get("rows_seen"))
 
-            # direct SQL
-            if(search_type == "sql"):
-                res = clean_response(sql_generator(enhanced_query, 'plot'))
-                if(res.get('sql') != None):
-                    sql = res['sql']
-                    print("SQL : ", sql)
+            final_ans_text = await traced("final_answer", get_ans_with_relevant_data_async(enhanced_query, pg_data, [], sources_to_cite, language))
+            print("FInal ans : ", final_ans_text)
 
-                    pg_data = retrieve_data_from_postgres(sql)
-                    if(res.get('sources_to_cite')):
-                        sources_to_cite = res['sources_to_cite']
-                        print("Sources to cite : ", sources_to_cite, end="\n\n")
+            return await remember_answer(understanding, 'theory', language, {
+                "text": final_ans_text,
+            })
 
-                    asyncio.run(save_pg_data_async(pg_data, 'static/plots/userId_chatId_uniqueId.csv'))
 
-                    return {
-                        "text": f"Query returned {len(pg_data)} row(s). Data prepared for plotting visualization.",
-                        "csv_url": "static/plots/userId_chatId_uniqueId.csv"
-                    }
-                
-            elif(search_type == "vector"):
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-                res = clean_response(generate_filters(enhanced_query))
-                print("Retrieved vector data : ", res)
 
-                if(res.get('where') != None):
-                    where_filters = res['where']
-                    res = query_documents(enhanced_query, where_filters)
-                    vector_ids = res['ids'][0]
+async def stream_text_answer(query, language):
+    """Theory tab answer as Server-Sent Events:
+    enhanced_query -> rows -> token* -> done, or an error event"""
+    set_request_labels(tab="theory")
 
-                    print(vector_ids)
+    try:
+        understanding = await understand_query(query, language)
+
+        if(understanding.get('reply') != None):
+            yield sse_event("token", {"text": understanding['reply']})
+            yield sse_event("done", {"text": understanding['reply']})
+            return
+
+        if(understanding.get('enhanced_query') == None):
+            yield sse_event("error", {"detail": "Invalid response from query understanding"})
+            return
+
+        enhanced_query = understanding['enhanced_query']
+        yield sse_event("enhanced_query", {
+            "enhanced_query": enhanced_query,
+            "search_type": understanding.get('search_type')
+        })
+
+        cached_answer = await lookup_cached_answer(understanding, 'theory', language)
+        if(cached_answer != None):
+            yield sse_event("token", {"text": cached_answer['text']})
+            yield sse_event("done", {"text": cached_answer['text'], "cached": True})
+            return
+
+        pg_data, sources_to_cite = await retrieve_relevant_data(understanding, 'theory')
+        if(pg_data is None):
+            yield sse_event("error", {"detail": "No data could be retrieved for this query"})
+            return
+
+        rows_seen = pg_data.attrs.get("rows_seen")
+        yield sse_event("rows", {
+            "row_count": rows_seen if rows_seen != None else len(pg_data),
+            "columns": pg_data.columns.to_list(),
+            "sources_to_cite": sources_to_cite
+        })
+
+        pg_data = await run_blocking(build_data_digest, pg_data, total_rows=rows_seen)
+
+        chunks = []
+        with span("final_answer"):
+            async for token in stream_ans_with_relevant_data_async(enhanced_query, pg_data, [], sources_to_cite, language):
+                chunks.append(token)
+                yield sse_event("token", {"text": token})
+
+        final_ans_text = "".join(chunks)
+        await remember_answer(understanding, 'theory', language, {"text": final_ans_text})
+
+        yield sse_event("done", {"text": final_ans_text})
 
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Internal Server Error: {str(e)}"})
 
-                    res = clean_response(sql_generator(enhanced_query, 'plot', vector_ids))
-                    print(res)
-                    if(res.get('sql') != None):
-                        sql = res['sql']
-                        print("SQL : ", sql)
 
-                        pg_data = retrieve_data_from_postgres(sql)
-                        if(res.get('sources_to_cite')):
-                            sources_to_cite = res['sources_to_cite']
-                            print("Sources to cite : ", sources_to_cite, end="\n\n")
+async def table_answer(query, language="english"):
+    understanding = await understand_query(query, language)
 
-                        asyncio.run(save_pg_data_async(pg_data, 'static/plots/userId_chatId_uniqueId.csv'))
+    # reply
+    if(understanding.get('reply') != None):
+        return {
+            "text": understanding['reply'],
+            "csv_url": None
+        }
+
+    if(understanding.get('enhanced_query') != None):
+        enhanced_query = understanding['enhanced_query']
+        print("enhanced query : ", enhanced_query)
+
+        cached_answer = await lookup_cached_answer(understanding, 'table', language)
+        if(cached_answer != None):
+            return cached_answer
+
+        sql, sources_to_cite, params = await generate_relevant_sql(understanding, 'table')
+
+        if(sql != None):
+            artifact = await publish_result('table', sql, params)
+
+            return await remember_answer(understanding, 'table', language, {
+                "text": f"Query returned {artifact['rows']} row(s). Showing first {min(artifact['rows'], 10)} rows." if artifact['complete']
+                        else f"Showing first {len(artifact['preview'])} rows. The full result is still being exported, the CSV downloads once it is ready.",
+                "csv_url": artifact['csv_url'],
+                "raw_data": artifact['preview'],
+                "columns": artifact['columns']
+            }, artifact['complete'])
+
+
+async def plot_answer(query, language="english"):
+    understanding = await understand_query(query, language)
+
+    # reply
+    if(understanding.get('reply') != None):
+        return {
+            "text": understanding['reply'],
+            "csv_url": None
+        }
+
+    if(understanding.get('enhanced_query') != None):
+        enhanced_query = understanding['enhanced_query']
+        print("enhanced query : ", enhanced_query)
+
+        cached_answer = await lookup_cached_answer(understanding, 'plot', language)
+        if(cached_answer != None):
+            return cached_answer
+
+        sql, sources_to_cite, params = await generate_relevant_sql(understanding, 'plot')
 
-                        return {
-                            "text": f"Query returned {len(pg_data)} row(s). Data prepared for plotting visualization.",
-                            "csv_url": "static/plots/userId_chatId_uniqueId.csv"
-                        }
+        if(sql != None):
+            artifact = await publish_result('plot', sql, params)
+
+            return await remember_answer(understanding, 'plot', language, {
+                "text": f"Query returned {artifact['rows']} row(s). Data prepared for plotting visualization." if artifact['complete']
+                        else "Data prepared for plotting visualization.",
+                "csv_url": artifact['csv_url']
+            }, artifact['complete'])
 
 
 
@@ -397,12 +643,77 @@ def plot_answer(query, language="english"):
 @app.get("/")
 def main():
     return { "message" : "Welcome to Float chat, what do you want to know today... ?" }
+
+
+@app.get("/metrics")
+def metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+
+@app.get("/classifier/stats")
+def classifier_stats():
+    return fast_classifier_stats()
+
+
+@app.get("/sql/stats")
+def sql_stats():
+    return {
+        "guard": sql_guard_stats(),
+        "templates": sql_templates.stats(),
+        "rollup_router": rollup_router_stats(),
+        "db_pool": pool_stats()
+    }
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "semantic_answer_cache": semantic_cache.stats(),
+        "llm_response_cache": response_cache.stats(),
+        "artifacts": artifact_stats(),
+        "sql_results": sql_result_cache.stats(),
+        "embeddings": embedding_cache.stats()
+    }
+
 static_path = Path(__file__).parent / "static"
 print(static_path)  # Optional: check the resolved path
 
-app.mount("/static", StaticFiles(directory=static_path), name="static")
+@app.get("/artifact")
+async def artifact_status(csv_url: str):
+    """Whether the export behind csv_url has finished, with its row count and formats once it has"""
+    if(ARTIFACT_URL_PATTERN.match(csv_url) == None):
+        raise HTTPException(status_code=400, detail="Not an artifact csv_url")
+
+    key = _pending_key(csv_url)
+    if(key in pending_artifacts):
+        return {"csv_url": csv_url, "ready": False}
+
+    meta_path = Path(__file__).parent / f"{key}.json"
+    if(meta_path.exists()):
+        meta = json.loads(meta_path.read_text())
+        return {
+            "csv_url": csv_url,
+            "ready": True,
+            "rows": meta["rows"],
+            "urls": {fmt: f"{key}{ARTIFACT_FORMATS[fmt][0]}" for fmt in meta.get("formats", ["csv"])}
+        }
+
+    raise HTTPException(status_code=404, detail="Unknown or failed artifact")
+
+
+@app.middleware("http")
+async def wait_for_pending_artifact(request, call_next):
+    # a fresh table / plot result may still be being exported
+    task = pending_artifacts.get(_pending_key(request.url.path.lstrip("/")))
+    if(task != None):
+        await asyncio.wait([task])
+    return await call_next(request)
+
+
+app.mount("/static", ArtifactStaticFiles(directory=static_path), name="static")
 @app.post("/query")
-def get_answer(req: QueryRequest):
+async def get_answer(req: QueryRequest):
     global history
 
     try:
@@ -412,6 +723,8 @@ def get_answer(req: QueryRequest):
         else:
             tab_chosen = req.tab.lower()
 
+        set_request_labels(tab=tab_chosen)
+
         # Validate query
         if not req.query or req.query.strip() == "":
             raise HTTPException(status_code=400, detail="Query can't be empty")
@@ -420,7 +733,7 @@ def get_answer(req: QueryRequest):
 
         # Handle "table" tab
         if tab_chosen == "table":
-            answer = table_answer(user_query)
+            answer = await traced("total", table_answer(user_query))
 
             if not answer or 'text' not in answer or 'csv_url' not in answer:
                 raise HTTPException(status_code=500, detail="Invalid response from table_answer")
@@ -428,19 +741,17 @@ def get_answer(req: QueryRequest):
             text = answer['text']
             url = answer['csv_url']
 
-            df = pd.read_csv(url)
-
             return TableResponse(
                 type=tab_chosen,
                 message=text,
-                raw_data=df.head(10).to_dict(orient="records"),
-                columns=df.columns.to_list(),
+                raw_data=answer.get('raw_data', []),
+                columns=answer.get('columns', []),
                 csv_url=url
             )
 
         # Handle "plot" tab
         elif tab_chosen == "plot":
-            answer = plot_answer(user_query)
+            answer = await traced("total", plot_answer(user_query))
 
             if not answer or 'text' not in answer or 'csv_url' not in answer:
                 raise HTTPException(status_code=500, detail="Invalid response from plot_answer")
@@ -456,7 +767,7 @@ def get_answer(req: QueryRequest):
 
         # Handle "theory" or default tab
         else:
-            answer = text_answer(user_query, req.language)
+            answer = await traced("total", text_answer(user_query, req.language))
 
             if not answer or 'text' not in answer:
                 raise HTTPException(status_code=500, detail="Invalid response from text_answer")
@@ -476,6 +787,23 @@ def get_answer(req: QueryRequest):
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
+@app.post("/query/stream")
+async def stream_answer(req: QueryRequest):
+    """Theory tab only: streams the answer as Server-Sent Events"""
+    if not req.query or req.query.strip() == "":
+        raise HTTPException(status_code=400, detail="Query can't be empty")
+
+    return StreamingResponse(
+        stream_text_answer(req.query.strip(), req.language),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# also the search_type label of speech requests, so only these may reach the metrics
+SPEECH_METHODS = ("whisper", "whisper-api", "google", "azure")
+
+
 @app.post("/speech-to-text")
 async def speech_to_text(
     audio_file: UploadFile = File(...),
@@ -491,30 +819,37 @@ async def speech_to_text(
         # Validate file type
         if not audio_file.content_type.startswith('audio/'):
             raise HTTPException(status_code=400, detail="File must be an audio file")
-        
+
+        if method not in SPEECH_METHODS:
+            raise HTTPException(status_code=400, detail="Unsupported method. Use: whisper, whisper-api, google, or azure")
+
+        set_request_labels(tab="speech", search_type=method)
+
         # Create a temporary file to store the uploaded audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
+        with span("speech_upload"), tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
             content = await audio_file.read()
             temp_file.write(content)
             temp_file_path = temp_file.name
         
         try:
-            if method == "whisper":
-                return await transcribe_with_whisper(temp_file_path, language)
-            elif method == "whisper-api":
-                return await transcribe_with_whisper_api(temp_file_path, language)
-            elif method == "google":
-                return await transcribe_with_google(temp_file_path, language)
-            elif method == "azure":
-                return await transcribe_with_azure(temp_file_path, language)
-            else:
-                raise HTTPException(status_code=400, detail="Unsupported method. Use: whisper, whisper-api, google, or azure")
+            with span("transcribe"):
+                if method == "whisper":
+                    return await transcribe_with_whisper(temp_file_path, language)
+                elif method == "whisper-api":
+                    return await transcribe_with_whisper_api(temp_file_path, language)
+                elif method == "google":
+                    return await transcribe_with_google(temp_file_path, language)
+                elif method == "azure":
+                    return await transcribe_with_azure(temp_file_path, language)
                 
         finally:
             # Clean up the temporary file
             if os.path.exists(temp_file_path):
                 os.unlink(temp_file_path)
-                
+
+    except HTTPException as http_exc:
+        # Let FastAPI handle HTTP errors
+        raise http_exc
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
@@ -536,7 +871,8 @@ async def transcribe_with_whisper(audio_path: str, language: Optional[str] = Non
         
         # Transcribe using local Whisper
         print(f"Transcribing with local Whisper model...")
-        result = whisper_model.transcribe(
+        result = await run_blocking(
+            whisper_model.transcribe,
             audio_path,
             language=language,  # Optional: specify language code
             task="transcribe",  # or "translate" to translate to English
@@ -0,0 +1,82 @@
+from dotenv import load_dotenv
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from prometheus_client import Histogram, Counter, generate_latest, CONTENT_TYPE_LATEST
+
+
+load_dotenv()
+
+# set once per request, read by every span started inside it
+current_tab = ContextVar('current_tab', default="none")
+current_search_type = ContextVar('current_search_type', default="none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_LATENCY = Histogram(
+    'floatchat_stage_latency_seconds',
+    'Latency of each /query and /speech-to-text stage',
+    ['stage', 'tab', 'search_type'],
+    buckets=LATENCY_BUCKETS
+)
+
+STAGE_ERRORS = Counter(
+    'floatchat_stage_errors_total',
+    'Stages that raised',
+    ['stage', 'tab', 'search_type']
+)
+
+
+# Optional OpenTelemetry export, enabled by pointing OTEL_EXPORTER_OTLP_ENDPOINT at a collector
+tracer = None
+if(os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')):
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider = TracerProvider(resource=Resource.create({"service.name": os.getenv('OTEL_SERVICE_NAME', 'floatchat-backend')}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        tracer = trace.get_tracer("floatchat")
+    except ImportError:
+        print("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk / opentelemetry-exporter-otlp are not installed")
+
+
+def set_request_labels(tab=None, search_type=None):
+    if(tab != None):
+        current_tab.set(tab)
+    if(search_type != None):
+        current_search_type.set(search_type)
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block into the stage histogram (and an OTel span when enabled)"""
+    start = time.perf_counter()
+    otel_span = tracer.start_as_current_span(stage) if tracer != None else nullcontext()
+
+    with otel_span as active:
+        try:
+            yield
+        except Exception:
+            STAGE_ERRORS.labels(stage, current_tab.get(), current_search_type.get()).inc()
+            raise
+        finally:
+            tab, search_type = current_tab.get(), current_search_type.get()
+            STAGE_LATENCY.labels(stage, tab, search_type).observe(time.perf_counter() - start)
+            if(active != None):
+                active.set_attribute("floatchat.tab", tab)
+                active.set_attribute("floatchat.search_type", search_type)
+
+
+async def traced(stage, awaitable):
+    with span(stage):
+        return await awaitable
+
+
+def metrics_payload():
+    return generate_latest(), CONTENT_TYPE_LATEST
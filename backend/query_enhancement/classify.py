@@ -1,14 +1,17 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
+from llm_client.gemini import chat_completion, chat_completion_async
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY1")
 
+# IHO sea / ocean names the drift pipeline tags floats with
+SEAS_AND_OCEANS = ['Rio de La Plata', 'Bass Strait', 'Great Australian Bight', 'Tasman Sea', 'Mozambique Channel', 'Savu Sea', 'Timor Sea', 'Bali Sea', 'Coral Sea', 'Flores Sea', 'Solomon Sea', 'Arafura Sea', 'Gulf of Boni', 'Java Sea', 'Ceram Sea', 'Bismarck Sea', 'Banda Sea', 'Gulf of California', 'Bay of Fundy', 'Strait of Gibraltar', 'Alboran Sea', 'Caribbean Sea', 'Gulf of Alaska', 'Bering Sea', 'Chukchi Sea', 'Beaufort Sea', 'Labrador Sea', 'Hudson Strait', 'Davis Strait', 'Baffin Bay', 'Lincoln Sea', 'Bristol Channel', "Irish Sea and St. George's Channel", 'Inner Seas off the West Coast of Scotland', 'Gulf of Aden', 'Gulf of Oman', 'Red Sea', 'Gulf of Aqaba', 'Persian Gulf', 'Ionian Sea', 'Tyrrhenian Sea', 'Adriatic Sea', 'Gulf of Suez', 'Mediterranean Sea - Eastern Basin', 'Aegean Sea', 'Sea of Marmara', 'Singapore Strait', 'Celebes Sea', 'Malacca Strait', 'Sulu Sea', 'Gulf of Thailand', 'Eastern China Sea', 'Seto Naikai or Inland Sea', 'Philippine Sea', 'Yellow Sea', 'Gulf of Riga', 'Baltic Sea', 'Gulf of Finland', 'Gulf of Bothnia', 'White Sea', 'East Siberian Sea', 'South Atlantic Ocean', 'Southern Ocean', 'South Pacific Ocean', 'Gulf of Tomini', 'Makassar Strait', 'Halmahera Sea', 'Molukka Sea', 'Indian Ocean', 'Bay of Bengal', 'South China Sea', 'Arabian Sea', 'North Pacific Ocean', 'The Coastal Waters of Southeast Alaska and British Columbia', 'Gulf of Mexico', 'North Atlantic Ocean', 'Gulf of St. Lawrence', 'Balearic (Iberian Sea)', 'Bay of Biscay', 'Celtic Sea', 'Mediterranean Sea - Western Basin', 'Hudson Bay', 'The Northwestern Passages', 'Arctic Ocean', 'English Channel', 'Barentsz Sea', 'Greenland Sea', 'North Sea', 'Andaman or Burma Sea', 'Black Sea', 'Sea of Azov', 'Japan Sea', 'Sea of Okhotsk', 'Kara Sea', 'Laptev Sea', 'Kattegat', 'Laccadive Sea', 'Skagerrak', 'Norwegian Sea', 'Ligurian Sea', 'Gulf of Guinea']
 
 
 
-def query_classifier(query):
+
+def build_classifier_messages(query):
     SYSTEM_PROMPT = """
 
         You are FloatChat, an AI-powered assistant for ARGO float oceanographic data. You are also a query classifier for FloatChat. Remember that if you select SQL, then that query doesnt require 
@@ -32,7 +35,7 @@ def query_classifier(query):
             - Queries about these fields, including aggregations or filtering (e.g., average temp, salinity at depth, nearest float to location) require **SQL search**.
    
             
-        3. Seas and Oceans - ['Rio de La Plata', 'Bass Strait', 'Great Australian Bight', 'Tasman Sea', 'Mozambique Channel', 'Savu Sea', 'Timor Sea', 'Bali Sea', 'Coral Sea', 'Flores Sea', 'Solomon Sea', 'Arafura Sea', 'Gulf of Boni', 'Java Sea', 'Ceram Sea', 'Bismarck Sea', 'Banda Sea', 'Gulf of California', 'Bay of Fundy', 'Strait of Gibraltar', 'Alboran Sea', 'Caribbean Sea', 'Gulf of Alaska', 'Bering Sea', 'Chukchi Sea', 'Beaufort Sea', 'Labrador Sea', 'Hudson Strait', 'Davis Strait', 'Baffin Bay', 'Lincoln Sea', 'Bristol Channel', "Irish Sea and St. George's Channel", 'Inner Seas off the West Coast of Scotland', 'Gulf of Aden', 'Gulf of Oman', 'Red Sea', 'Gulf of Aqaba', 'Persian Gulf', 'Ionian Sea', 'Tyrrhenian Sea', 'Adriatic Sea', 'Gulf of Suez', 'Mediterranean Sea - Eastern Basin', 'Aegean Sea', 'Sea of Marmara', 'Singapore Strait', 'Celebes Sea', 'Malacca Strait', 'Sulu Sea', 'Gulf of Thailand', 'Eastern China Sea', 'Seto Naikai or Inland Sea', 'Philippine Sea', 'Yellow Sea', 'Gulf of Riga', 'Baltic Sea', 'Gulf of Finland', 'Gulf of Bothnia', 'White Sea', 'East Siberian Sea', 'South Atlantic Ocean', 'Southern Ocean', 'South Pacific Ocean', 'Gulf of Tomini', 'Makassar Strait', 'Halmahera Sea', 'Molukka Sea', 'Indian Ocean', 'Bay of Bengal', 'South China Sea', 'Arabian Sea', 'North Pacific Ocean', 'The Coastal Waters of Southeast Alaska and British Columbia', 'Gulf of Mexico', 'North Atlantic Ocean', 'Gulf of St. Lawrence', 'Balearic (Iberian Sea)', 'Bay of Biscay', 'Celtic Sea', 'Mediterranean Sea - Western Basin', 'Hudson Bay', 'The Northwestern Passages', 'Arctic Ocean', 'English Channel', 'Barentsz Sea', 'Greenland Sea', 'North Sea', 'Andaman or Burma Sea', 'Black Sea', 'Sea of Azov', 'Japan Sea', 'Sea of Okhotsk', 'Kara Sea', 'Laptev Sea', 'Kattegat', 'Laccadive Sea', 'Skagerrak', 'Norwegian Sea', 'Ligurian Sea', 'Gulf of Guinea']
+        3. Seas and Oceans - """ + str(SEAS_AND_OCEANS) + """
         
 
         Behavior Rules:
@@ -55,24 +58,20 @@ def query_classifier(query):
     """
 
 
-    client = OpenAI(
-        api_key=GEMINI_API_KEY,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
-
-
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": query}
     ]
 
-    response = client.chat.completions.create(
-        model="gemini-2.5-flash",
-        messages=messages,
-        response_format={"type": "json_object"}
-    )
+    return messages
+
+
+def query_classifier(query):
+    return chat_completion(GEMINI_API_KEY, build_classifier_messages(query), response_format={"type": "json_object"}, name="classify")
+
 
-    return response.choices[0].message.content
+async def query_classifier_async(query):
+    return await chat_completion_async(GEMINI_API_KEY, build_classifier_messages(query), response_format={"type": "json_object"}, name="classify")
 
 
 
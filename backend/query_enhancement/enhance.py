@@ -251,14 +251,14 @@
 #     return response.choices[0].message.content
 
 
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
+from llm_client.gemini import chat_completion, chat_completion_async
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY1")
 
-def query_enhancer(user_query, language, history):
+def build_enhancer_messages(user_query, language):
 
     SYSTEM_PROMPT = f"LANGUAGE: {language}" + """
 You are FloatChat, an AI-powered assistant specialized in ARGO float oceanographic data discovery, exploration, and visualization.
@@ -291,19 +291,15 @@ Output Format:
 """
 
 
-    client = OpenAI(
-        api_key=GEMINI_API_KEY,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
-
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     messages.append({"role": "user", "content": user_query})
 
-    response = client.chat.completions.create(
-        model="gemini-2.5-flash",
-        messages=messages,
-        response_format={"type": "json_object"}
-    )
+    return messages
+
+
+def query_enhancer(user_query, language, history):
+    return chat_completion(GEMINI_API_KEY, build_enhancer_messages(user_query, language), response_format={"type": "json_object"}, name="enhance")
+
 
-    # print(response, end = "\n\n\n\n")
-    return response.choices[0].message.content
+async def query_enhancer_async(user_query, language, history):
+    return await chat_completion_async(GEMINI_API_KEY, build_enhancer_messages(user_query, language), response_format={"type": "json_object"}, name="enhance")
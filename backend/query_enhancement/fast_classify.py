@@ -0,0 +1,137 @@
+from dotenv import load_dotenv
+import os
+import re
+import json
+import random
+import asyncio
+import threading
+from query_enhancement.classify import SEAS_AND_OCEANS, query_classifier_async
+
+
+load_dotenv()
+FAST_CLASSIFIER_ENABLED = os.getenv('FAST_CLASSIFIER_ENABLED', 'true').lower() == 'true'
+# share of confident local decisions that are also sent to the LLM to measure agreement
+FAST_CLASSIFIER_SHADOW_RATE = float(os.getenv('FAST_CLASSIFIER_SHADOW_RATE', '0.05'))
+
+
+def _sea_aliases(name):
+    # "Andaman or Burma Sea" -> both names, "Mediterranean Sea - Eastern Basin" -> "mediterranean sea",
+    # "Balearic (Iberian Sea)" -> "balearic", "iberian sea"
+    name = name.lower()
+    aliases = {name}
+
+    base = name.split(" - ")[0]
+    aliases.add(base)
+
+    if("(" in base):
+        outer, inner = base.split("(", 1)
+        aliases.update([outer.strip(), inner.strip(" )")])
+
+    if(" or " in base):
+        first, second = base.split(" or ", 1)
+        suffix = second.split(" ")[-1]
+        aliases.update([f"{first} {suffix}", second])
+
+    return {alias for alias in aliases if alias}
+
+
+SEA_PATTERN = re.compile(
+    r"\b(" + "|".join(sorted({re.escape(alias) for sea in SEAS_AND_OCEANS for alias in _sea_aliases(sea)}, key=len, reverse=True)) + r")\b"
+)
+
+# Classifier prompt rule: vector DB metadata fields and semantic / fuzzy requests -> vector.
+# Proximity, location and coordinate wording (near, nearest, latitude, 10N 60E...) is left to the LLM:
+# "nearest float to a location" is SQL by the prompt's rules, other location questions may not be
+METADATA_PATTERN = re.compile(
+    r"\b(pi|pi_name|principal investigator|institution|institute|incois|project|sensors?|platform|maker|manufacturer|"
+    r"wmo|mission|launch(ed)?|deploy(ed|ment)?|end of mission|status|regions?|visited|dominant|centroid|"
+    r"similar|compare|places?|areas?|doxy|oxygen|bgc)\b"
+)
+
+# Classifier prompt rule: numeric columns and aggregations on them -> sql
+PARAMETER_PATTERN = re.compile(r"\b(temp|temperature|psal|salinity|pres|pressure|depth)s?\b")
+AGGREGATE_PATTERN = re.compile(r"\b(average|avg|mean|maximum|max|minimum|min|count|sum|total|median|std|standard deviation|range|highest|lowest)\b")
+
+
+def fast_classify(query):
+    """Returns ("sql" | "vector", rule) when the prompt rules decide locally, else (None, None)"""
+    text = query.lower()
+
+    if(SEA_PATTERN.search(text)):
+        return "vector", "sea_name"
+
+    if(METADATA_PATTERN.search(text)):
+        return "vector", "metadata_field"
+
+    if(PARAMETER_PATTERN.search(text) and AGGREGATE_PATTERN.search(text)):
+        return "sql", "parameter_aggregate"
+
+    return None, None
+
+
+_lock = threading.Lock()
+_stats = {"local": {}, "llm_fallback": 0, "shadow_checks": 0, "shadow_agreements": 0, "shadow_disagreements": {}}
+
+
+def _record_local(rule):
+    with _lock:
+        _stats["local"][rule] = _stats["local"].get(rule, 0) + 1
+
+
+async def _shadow_check(query, search_type, rule):
+    try:
+        res = json.loads(await query_classifier_async(query))
+    except Exception as e:
+        print(f"Fast classifier shadow check failed: {e}")
+        return
+
+    with _lock:
+        _stats["shadow_checks"] += 1
+        if(res.get('search_type') == search_type):
+            _stats["shadow_agreements"] += 1
+        else:
+            _stats["shadow_disagreements"][rule] = _stats["shadow_disagreements"].get(rule, 0) + 1
+            print(f"Fast classifier disagreement ({rule}) : local={search_type} llm={res.get('search_type')} query={query}")
+
+        checks = _stats["shadow_checks"]
+        print(f"Fast classifier agreement : {_stats['shadow_agreements']}/{checks} ({_stats['shadow_agreements'] / checks:.1%})")
+
+
+_shadow_tasks = set()
+
+
+async def query_classifier_fast_async(query):
+    """Same contract as query_classifier_async, but answers locally when the rules are sure"""
+    if(FAST_CLASSIFIER_ENABLED):
+        search_type, rule = fast_classify(query)
+
+        if(search_type != None):
+            _record_local(rule)
+
+            if(random.random() < FAST_CLASSIFIER_SHADOW_RATE):
+                task = asyncio.create_task(_shadow_check(query, search_type, rule))
+                _shadow_tasks.add(task)
+                task.add_done_callback(_shadow_tasks.discard)
+
+            return json.dumps({"search_type": search_type})
+
+    with _lock:
+        _stats["llm_fallback"] += 1
+
+    return await query_classifier_async(query)
+
+
+def fast_classifier_stats():
+    with _lock:
+        local = sum(_stats["local"].values())
+        decisions = local + _stats["llm_fallback"]
+        checks = _stats["shadow_checks"]
+
+        return {
+            "local_decisions": dict(_stats["local"]),
+            "llm_fallback": _stats["llm_fallback"],
+            "local_rate": local / decisions if decisions else 0.0,
+            "shadow_checks": checks,
+            "agreement_rate": _stats["shadow_agreements"] / checks if checks else None,
+            "disagreements_by_rule": dict(_stats["shadow_disagreements"])
+        }
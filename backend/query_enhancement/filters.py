@@ -1,6 +1,6 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
+from llm_client.gemini import chat_completion, chat_completion_async
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY1")
@@ -8,7 +8,7 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY1")
 
 
 
-def generate_filters(query):
+def build_filters_messages(query):
     SYSTEM_PROMPT = """
 You are an expert AI assistant for FloatChat and your job is to generate "where" filters for chroma db matadata filtering. 
 
@@ -249,24 +249,20 @@ Output Schema:
 
 
 
-    client = OpenAI(
-        api_key=GEMINI_API_KEY,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
-
-
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": query}
     ]
 
-    response = client.chat.completions.create(
-        model="gemini-2.5-flash",
-        messages=messages,
-        response_format={"type": "json_object"}
-    )
+    return messages
+
+
+def generate_filters(query):
+    return chat_completion(GEMINI_API_KEY, build_filters_messages(query), response_format={"type": "json_object"}, name="filters")
+
 
-    return response.choices[0].message.content
+async def generate_filters_async(query):
+    return await chat_completion_async(GEMINI_API_KEY, build_filters_messages(query), response_format={"type": "json_object"}, name="filters")
 
 
 
@@ -1,15 +1,277 @@
-from dotenv import load_dotenv
 import os
-from sqlalchemy import create_engine, text
+import re
+import json
+import asyncio
+from contextlib import closing, aclosing
+from sqlalchemy import text
 import pandas as pd
+from database.engine import get_engine, get_async_engine
+from retrieve_data_from_db.result_cache import sql_result_cache, SQL_RESULT_CACHE_ENABLED, SQL_TOKEN_PATTERN
+from retrieve_data_from_db.sampling import StratifiedReservoir, sample_chunks, rows_for_token_budget, THEORY_DATA_TOKEN_BUDGET, SAMPLING_SEED
 
 
-DB_URL = os.getenv('DB_URL')
-engine = create_engine(DB_URL)
+engine = get_engine()
 
+# rows fetched from the server-side cursor per chunk
+POSTGRES_CHUNK_ROWS = int(os.getenv('POSTGRES_CHUNK_ROWS', '10000'))
+# array parameters (e.g. :vector_ids) with at least this many items are joined from a temp table instead
+SQL_ARRAY_TEMP_TABLE_MIN = int(os.getenv('SQL_ARRAY_TEMP_TABLE_MIN', '1000'))
+
+
+def set_statement_timeout(conn, timeout_ms):
+    # SET LOCAL only lasts for the current transaction, so pooled connections don't keep it
+    if(timeout_ms and engine.dialect.name == "postgresql"):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+
+def explain_sql(sql_query, timeout_ms=None):
+    """Planner estimate {"rows", "cost"} of the top plan node, None when the database has no EXPLAIN (FORMAT JSON)"""
+    if(engine.dialect.name != "postgresql"):
+        return None
 
-def retrieve_data_from_postgres(sql_query):
     with engine.connect() as conn:
-        df = pd.read_sql(sql_query, conn)
+        set_statement_timeout(conn, timeout_ms)
+        plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql_query}").scalar()
+
+    if(isinstance(plan, str)):
+        plan = json.loads(plan)
+
+    top = plan[0]["Plan"]
+    return {"rows": top["Plan Rows"], "cost": top["Total Cost"]}
+
+
+def _bind_tokens(sql_query, params):
+    """(start, end, name) of every :name in sql_query that is one of params"""
+    tokens = list(SQL_TOKEN_PATTERN.finditer(sql_query))
+    binds = []
+    for i in range(len(tokens) - 1):
+        if(tokens[i].group() == ":" and tokens[i + 1].lastgroup == "word" and tokens[i + 1].group() in params and tokens[i].end() == tokens[i + 1].start()):
+            binds.append((tokens[i].start(), tokens[i + 1].end(), tokens[i + 1].group()))
+    return binds
+
+
+def _literal(value):
+    if(isinstance(value, (list, tuple))):
+        return "ARRAY[" + ", ".join(_literal(v) for v in value) + "]"
+    if(isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _replace_binds(sql_query, params, replacement):
+    out = []
+    last = 0
+    for start, end, name in _bind_tokens(sql_query, params):
+        out.append(sql_query[last:start])
+        out.append(replacement(name))
+        last = end
+    out.append(sql_query[last:])
+    return "".join(out)
+
+
+def render_sql(sql_query, params=None):
+    """sql_query with its :name parameters written out as literals. Result cache and
+    artifact keys, EXPLAIN and the rollup router all work on this form"""
+    if(not params):
+        return sql_query
+    return _replace_binds(sql_query, params, lambda name: _literal(params[name]))
+
+
+def _large_arrays(params):
+    if(not params or engine.dialect.name != "postgresql"):
+        return set()
+    return {name for name, value in params.items() if isinstance(value, (list, tuple)) and len(value) >= SQL_ARRAY_TEMP_TABLE_MIN}
+
+
+def _temp_table_binds(sql_query, params):
+    """(sql_query, params, [(table, type, values)]): large array parameters moved into temp tables,
+    "= ANY(:name)" turned into a semi-join on the table and any other :name into ARRAY(SELECT ...)"""
+    large = _large_arrays(params)
+    if(len(large) == 0):
+        return sql_query, params, []
+
+    tables = []
+    for name in sorted(large):
+        table = f"bind_{name}"
+        values = params[name]
+        column_type = "bigint" if all(isinstance(v, int) for v in values) else "text"
+        sql_query = re.sub(rf"=\s*ANY\s*\(\s*:{name}\s*\)", f"IN (SELECT value FROM {table})", sql_query, flags=re.IGNORECASE)
+        sql_query = _replace_binds(sql_query, {name: None}, lambda _: f"ARRAY(SELECT value FROM {table})")
+        tables.append((table, column_type, values if column_type == "bigint" else [str(v) for v in values]))
+
+    return sql_query, {name: value for name, value in params.items() if name not in large}, tables
+
+
+def _temp_table_statements(table, column_type):
+    # ON COMMIT DROP: gone with the transaction, so the pooled connection comes back clean
+    return (
+        f"CREATE TEMP TABLE {table} (value {column_type}) ON COMMIT DROP",
+        f"INSERT INTO {table} (value) VALUES (:value)",
+        f"ANALYZE {table}",
+    )
+
+
+def _load_temp_tables(conn, tables):
+    for table, column_type, values in tables:
+        create, insert, analyze = _temp_table_statements(table, column_type)
+        conn.exec_driver_sql(create)
+        conn.execute(text(insert), [{"value": value} for value in values])
+        conn.exec_driver_sql(analyze)
+
+
+def stream_data_from_postgres(sql_query, chunk_rows=POSTGRES_CHUNK_ROWS, timeout_ms=None, params=None):
+    """Yields the result as DataFrames of at most chunk_rows rows.
+    stream_results makes psycopg2 use a named server-side cursor, so only one chunk
+    is held in client memory whatever the size of the result"""
+    sql_query, params, tables = _temp_table_binds(sql_query, params)
+
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunk_rows) as conn:
+        set_statement_timeout(conn, timeout_ms)
+        _load_temp_tables(conn, tables)
+        query = text(sql_query) if params else sql_query
+        for chunk in pd.read_sql(query, conn, params=params or None, chunksize=chunk_rows):
+            yield chunk
+
+
+def retrieve_data_from_postgres(sql_query, max_rows=None, timeout_ms=None, params=None):
+    """Whole result as one DataFrame, or only the first max_rows rows
+    (the rest of the cursor is never fetched). Served from the SQL result cache when possible.
+    With params, sql_query is a template whose :name parameters are bound on the server-side cursor"""
+    cache_key = render_sql(sql_query, params)
+    if(SQL_RESULT_CACHE_ENABLED):
+        df = sql_result_cache.get(cache_key, max_rows)
+        if(df is not None):
+            return df
+
+    chunks = []
+    fetched = 0
+
+    # closing() releases the cursor and connection as soon as we stop early
+    with closing(stream_data_from_postgres(sql_query, timeout_ms=timeout_ms, params=params)) as stream:
+        for chunk in stream:
+            chunks.append(chunk)
+            fetched += len(chunk)
+            if(max_rows != None and fetched >= max_rows):
+                break
+
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 0 else pd.DataFrame()
+
+    if(max_rows != None):
+        df = df.head(max_rows)
+
+    if(SQL_RESULT_CACHE_ENABLED):
+        sql_result_cache.put(cache_key, df, max_rows)
+
+    return df
+
+
+def _as_text(sql_query):
+    # text() would read ":name" as a bind parameter, escape lone colons ("::" casts stay)
+    return text(re.sub(r"(?<![:\\]):(?!:)", r"\\:", sql_query))
+
+
+async def stream_data_from_postgres_async(sql_query, chunk_rows=POSTGRES_CHUNK_ROWS, timeout_ms=None, params=None):
+    """stream_data_from_postgres on the asyncpg engine: the query is awaited on the event loop
+    instead of holding a worker thread. asyncpg prepares (and caches per connection) every
+    statement it runs, templates included. An empty result still yields one empty DataFrame"""
+    sql_query, params, tables = _temp_table_binds(sql_query, params)
+
+    async with get_async_engine().connect() as conn:
+        if(timeout_ms):
+            await conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+        for table, column_type, values in tables:
+            create, insert, analyze = _temp_table_statements(table, column_type)
+            await conn.exec_driver_sql(create)
+            await conn.execute(text(insert), [{"value": value} for value in values])
+            await conn.exec_driver_sql(analyze)
+
+        result = await conn.stream(text(sql_query) if params else _as_text(sql_query), params or None)
+        columns = list(result.keys())
+
+        try:
+            empty = True
+            async for partition in result.partitions(chunk_rows):
+                empty = False
+                yield pd.DataFrame(partition, columns=columns)
+            if(empty):
+                yield pd.DataFrame(columns=columns)
+        finally:
+            await result.close()
+
+
+async def retrieve_data_from_postgres_async(sql_query, max_rows=None, timeout_ms=None, chunk_rows=POSTGRES_CHUNK_ROWS, params=None):
+    """retrieve_data_from_postgres over stream_data_from_postgres_async"""
+    cache_key = render_sql(sql_query, params)
+    if(SQL_RESULT_CACHE_ENABLED):
+        df = await asyncio.to_thread(sql_result_cache.get, cache_key, max_rows)
+        if(df is not None):
+            return df
+
+    chunks = []
+    fetched = 0
+
+    async with aclosing(stream_data_from_postgres_async(sql_query, chunk_rows, timeout_ms, params)) as stream:
+        async for chunk in stream:
+            chunks.append(chunk)
+            fetched += len(chunk)
+            if(max_rows != None and fetched >= max_rows):
+                break
+
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 0 else pd.DataFrame()
+
+    if(max_rows != None):
+        df = df.head(max_rows)
+
+    if(SQL_RESULT_CACHE_ENABLED):
+        await asyncio.to_thread(sql_result_cache.put, cache_key, df, max_rows)
+
+    return df
+
+
+def _sample_label(token_budget, seed):
+    # stands in for the row limit in the result cache key
+    return f"sample({token_budget}, seed={seed})"
+
+
+def sample_from_postgres(sql_query, token_budget=THEORY_DATA_TOKEN_BUDGET, timeout_ms=None, params=None, seed=SAMPLING_SEED):
+    """Deterministic stratified sample of the whole result, as many rows as fit in
+    token_budget. The cursor is streamed through the reservoir, so only the sample is kept"""
+    cache_key = render_sql(sql_query, params)
+    if(SQL_RESULT_CACHE_ENABLED):
+        df = sql_result_cache.get(cache_key, _sample_label(token_budget, seed))
+        if(df is not None):
+            return df
+
+    with closing(stream_data_from_postgres(sql_query, timeout_ms=timeout_ms, params=params)) as stream:
+        df, rows_seen = sample_chunks(stream, token_budget, seed)
+    print(f"Sampled {len(df)} of {rows_seen} rows")
+
+    if(SQL_RESULT_CACHE_ENABLED):
+        sql_result_cache.put(cache_key, df, _sample_label(token_budget, seed))
+
+    return df
+
+
+async def sample_from_postgres_async(sql_query, token_budget=THEORY_DATA_TOKEN_BUDGET, timeout_ms=None, params=None, seed=SAMPLING_SEED):
+    """sample_from_postgres over stream_data_from_postgres_async"""
+    cache_key = render_sql(sql_query, params)
+    if(SQL_RESULT_CACHE_ENABLED):
+        df = await asyncio.to_thread(sql_result_cache.get, cache_key, _sample_label(token_budget, seed))
+        if(df is not None):
+            return df
+
+    reservoir = None
+    async with aclosing(stream_data_from_postgres_async(sql_query, timeout_ms=timeout_ms, params=params)) as stream:
+        async for chunk in stream:
+            if(reservoir == None):
+                reservoir = StratifiedReservoir(rows_for_token_budget(chunk, token_budget), seed)
+            await asyncio.to_thread(reservoir.add, chunk)
+
+    df = reservoir.result()
+    print(f"Sampled {len(df)} of {reservoir.rows_seen} rows")
+
+    if(SQL_RESULT_CACHE_ENABLED):
+        await asyncio.to_thread(sql_result_cache.put, cache_key, df, _sample_label(token_budget, seed))
 
-        return df
+    return df
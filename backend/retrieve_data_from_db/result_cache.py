@@ -0,0 +1,273 @@
+from dotenv import load_dotenv
+import os
+import re
+import hashlib
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import pandas as pd
+from data_version.version import get_data_version
+
+# the disk tier stores Parquet, which needs the optional pyarrow package
+try:
+    import pyarrow
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+load_dotenv()
+SQL_RESULT_CACHE_ENABLED = os.getenv('SQL_RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+SQL_RESULT_CACHE_MAX_BYTES = int(os.getenv('SQL_RESULT_CACHE_MAX_BYTES', str(256 * 1024 ** 2)))
+# unset = memory only
+SQL_RESULT_CACHE_DISK_PATH = os.getenv('SQL_RESULT_CACHE_DISK_PATH')
+SQL_RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv('SQL_RESULT_CACHE_DISK_MAX_BYTES', str(2 * 1024 ** 3)))
+
+
+SQL_TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<identifier>"(?:[^"]|"")*")
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<symbol><>|!=|<=|>=|::|\|\||\S)
+""", re.VERBOSE | re.DOTALL)
+
+
+def _tokens(sql):
+    for match in SQL_TOKEN_PATTERN.finditer(sql):
+        kind = match.lastgroup
+        if(kind == "comment"):
+            continue
+        value = match.group()
+        # keywords and unquoted names are case-insensitive, literals and quoted names are not
+        yield kind, value.lower() if kind in ("word", "symbol") else value
+
+
+def _sort_in_lists(tokens):
+    """IN (3, 1, 2) and IN (1, 2, 3) select the same rows, so list their literals in one order"""
+    out = []
+    i = 0
+    while(i < len(tokens)):
+        out.append(tokens[i])
+
+        if(tokens[i] == ("word", "in") and i + 1 < len(tokens) and tokens[i + 1] == ("symbol", "(")):
+            end = i + 2
+            literals = []
+            while(end < len(tokens) and tokens[end][0] in ("string", "number")):
+                literals.append(tokens[end])
+                if(end + 1 < len(tokens) and tokens[end + 1] == ("symbol", ",")):
+                    end += 2
+                else:
+                    end += 1
+                    break
+
+            if(literals and end < len(tokens) and tokens[end] == ("symbol", ")") and tokens[end - 1] != ("symbol", ",")):
+                literals = sorted(set(literals))
+                out.append(("symbol", "("))
+                for j, literal in enumerate(literals):
+                    if(j > 0):
+                        out.append(("symbol", ","))
+                    out.append(literal)
+                out.append(("symbol", ")"))
+                i = end + 1
+                continue
+
+        i += 1
+
+    return out
+
+
+def normalize_sql(sql):
+    """Whitespace, comments, keyword case, a trailing ';' and the order of IN (...) literals don't change the result"""
+    tokens = list(_tokens(sql))
+    while(tokens and tokens[-1] == ("symbol", ";")):
+        tokens.pop()
+
+    return " ".join(value for _, value in _sort_in_lists(tokens))
+
+
+# give a different answer on every run (or every day), so their results are never cached
+VOLATILE_KEYWORDS = {"current_date", "current_time", "current_timestamp", "localtime", "localtimestamp"}
+VOLATILE_FUNCTIONS = {
+    "now", "random", "clock_timestamp", "statement_timestamp", "transaction_timestamp", "timeofday",
+    "age", "gen_random_uuid", "uuid_generate_v4", "nextval", "setseed", "random_normal",
+}
+
+
+def is_volatile_sql(sql):
+    """True when sql uses CURRENT_DATE, now(), random() or another volatile function"""
+    tokens = list(_tokens(sql))
+    for i, (kind, value) in enumerate(tokens):
+        if(kind != "word"):
+            continue
+        if(value in VOLATILE_KEYWORDS):
+            return True
+        if(value in VOLATILE_FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1] == ("symbol", "(")):
+            return True
+    return False
+
+
+def result_key(sql, max_rows=None):
+    payload = f"{normalize_sql(sql)}\nlimit={max_rows}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class SQLResultCache:
+    """Query results keyed on normalized SQL (+ row limit) for the current data version.
+
+    An in-memory LRU bounded by bytes, optionally backed by Parquet files on disk.
+    Everything is dropped when the data version changes. SQL using a volatile
+    function (CURRENT_DATE, now(), random()...) bypasses the cache.
+    """
+
+    def __init__(self, max_bytes, disk_path=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_path = Path(disk_path) if disk_path and PYARROW_AVAILABLE else None
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._data_version = get_data_version()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "volatile_bypasses": 0, "bytes_saved": 0, "evictions": 0, "invalidations": 0}
+
+
+    def _check_data_version(self):
+        version = get_data_version()
+        if(version != self._data_version):
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._data_version = version
+            self._stats["invalidations"] += 1
+
+            if(self.disk_path != None and self.disk_path.exists()):
+                shutil.rmtree(self.disk_path, ignore_errors=True)
+
+
+    def _disk_file(self, key):
+        # one folder per data version so stale files are easy to drop
+        return self.disk_path / self._data_version / f"{key}.parquet"
+
+
+    def _remember(self, key, df, nbytes):
+        if(nbytes > self.max_bytes):
+            return
+
+        if(key in self._memory):
+            self._memory_bytes -= self._memory.pop(key)[1]
+
+        self._memory[key] = (df, nbytes)
+        self._memory_bytes += nbytes
+
+        while(self._memory_bytes > self.max_bytes):
+            _, (_, dropped) = self._memory.popitem(last=False)
+            self._memory_bytes -= dropped
+            self._stats["evictions"] += 1
+
+
+    def get(self, sql, max_rows=None):
+        if(is_volatile_sql(sql)):
+            with self._lock:
+                self._stats["volatile_bypasses"] += 1
+            return None
+
+        key = result_key(sql, max_rows)
+
+        with self._lock:
+            self._check_data_version()
+
+            if(key in self._memory):
+                self._memory.move_to_end(key)
+                df, nbytes = self._memory[key]
+                self._stats["memory_hits"] += 1
+                self._stats["bytes_saved"] += nbytes
+                return df
+
+            disk_file = self._disk_file(key) if self.disk_path != None else None
+
+        df = None
+        if(disk_file != None and disk_file.exists()):
+            try:
+                df = pd.read_parquet(disk_file)
+                os.utime(disk_file)
+            except Exception as e:
+                print(f"SQL result cache disk read failed: {e}")
+
+        with self._lock:
+            if(df is None):
+                self._stats["misses"] += 1
+                return None
+
+            nbytes = frame_bytes(df)
+            self._remember(key, df, nbytes)
+            self._stats["disk_hits"] += 1
+            self._stats["bytes_saved"] += nbytes
+            return df
+
+
+    def put(self, sql, df, max_rows=None):
+        if(is_volatile_sql(sql)):
+            return
+
+        key = result_key(sql, max_rows)
+        nbytes = frame_bytes(df)
+
+        with self._lock:
+            self._check_data_version()
+            self._remember(key, df, nbytes)
+            disk_file = self._disk_file(key) if self.disk_path != None else None
+
+        if(disk_file != None):
+            try:
+                disk_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file = disk_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                df.to_parquet(tmp_file, index=False, compression="zstd")
+                os.replace(tmp_file, disk_file)
+                self._evict_disk()
+            except Exception as e:
+                print(f"SQL result cache disk write failed: {e}")
+
+
+    def _evict_disk(self):
+        files = []
+        for path in self.disk_path.glob("*/*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if(total <= self.disk_max_bytes):
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+
+            return {
+                **self._stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_tier": str(self.disk_path) if self.disk_path != None else None
+            }
+
+
+sql_result_cache = SQLResultCache(
+    SQL_RESULT_CACHE_MAX_BYTES if SQL_RESULT_CACHE_ENABLED else 0,
+    SQL_RESULT_CACHE_DISK_PATH if SQL_RESULT_CACHE_ENABLED else None,
+    SQL_RESULT_CACHE_DISK_MAX_BYTES
+)
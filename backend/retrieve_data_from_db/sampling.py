@@ -0,0 +1,172 @@
+from dotenv import load_dotenv
+import os
+import math
+import pandas as pd
+from retrieve_data_from_db.result_cache import SQL_TOKEN_PATTERN
+
+
+load_dotenv()
+# reservoir: stratified sample of the streamed result, tablesample: also TABLESAMPLE big raw-row queries, off: first rows
+THEORY_SAMPLING = os.getenv('THEORY_SAMPLING', 'reservoir').lower()
+SAMPLING_SEED = int(os.getenv('SAMPLING_SEED', '42'))
+# tokens of row data the theory answer prompt may spend; the sample size follows from it
+THEORY_DATA_TOKEN_BUDGET = int(os.getenv('THEORY_DATA_TOKEN_BUDGET', '6000'))
+SAMPLE_MIN_ROWS = int(os.getenv('SAMPLE_MIN_ROWS', '20'))
+SAMPLE_MAX_ROWS = int(os.getenv('SAMPLE_MAX_ROWS', '2000'))
+# pressure band (dbar) used as the depth stratum
+SAMPLE_DEPTH_BAND = float(os.getenv('SAMPLE_DEPTH_BAND', '100'))
+
+# rough size of a token in characters of JSON, as the rows are sent to the LLM
+CHARS_PER_TOKEN = 4
+
+# result columns each stratum dimension can come from, first match wins
+STRATUM_COLUMNS = {
+    "float": ["float_id"],
+    "time": ["obs_date", "Date", "month", "date", "year"],
+    "depth": ["Pres_adj(dbar)", "Pres_raw(dbar)", "pres_bin", "pres"],
+}
+
+
+def rows_for_token_budget(df, token_budget=THEORY_DATA_TOKEN_BUDGET):
+    """How many rows shaped like df fit in token_budget when sent as JSON records"""
+    if(len(df) == 0):
+        return SAMPLE_MIN_ROWS
+
+    head = df.head(200)
+    tokens_per_row = max(1.0, len(head.to_json(orient="records")) / len(head) / CHARS_PER_TOKEN)
+    return max(SAMPLE_MIN_ROWS, min(SAMPLE_MAX_ROWS, int(token_budget / tokens_per_row)))
+
+
+def _stratum_column(df, dimension):
+    for column in STRATUM_COLUMNS[dimension]:
+        if(column in df.columns):
+            return column
+    return None
+
+
+def strata(df):
+    """float / month / depth band of every row, from whichever of those columns the result has"""
+    parts = []
+
+    column = _stratum_column(df, "float")
+    if(column != None):
+        parts.append(df[column].astype(str))
+
+    column = _stratum_column(df, "time")
+    if(column != None):
+        parts.append(df[column].astype(str).str.slice(0, 7))
+
+    column = _stratum_column(df, "depth")
+    if(column != None):
+        band = pd.to_numeric(df[column], errors="coerce") // SAMPLE_DEPTH_BAND
+        parts.append(band.astype(str))
+
+    if(len(parts) == 0):
+        return pd.Series("", index=df.index)
+
+    stratum = parts[0]
+    for part in parts[1:]:
+        stratum = stratum + "|" + part
+    return stratum
+
+
+class StratifiedReservoir:
+    """Deterministic sample of a streamed result. Every row gets a key hashed from its
+    values and the seed, so for a given size the same rows give the same sample whatever order (or chunking)
+    they arrive in. Kept: the lowest-key row of each float/month/depth stratum (so every
+    stratum is represented while there is room) and the size lowest-key rows overall
+    to fill up with. Memory stays at about 2 * size rows however long the stream is"""
+
+    def __init__(self, size, seed=SAMPLING_SEED):
+        self.size = size
+        self.hash_key = str(seed).rjust(16, "0")[:16]
+        self.rows_seen = 0
+        self._columns = []
+        self._overall = None
+        self._per_stratum = None
+
+    def _keyed(self, chunk):
+        chunk = chunk.reset_index(drop=True)
+        keyed = chunk.copy()
+        keyed["_key"] = pd.util.hash_pandas_object(chunk, index=False, hash_key=self.hash_key).to_numpy()
+        keyed["_stratum"] = strata(chunk).to_numpy()
+        keyed["_position"] = range(self.rows_seen, self.rows_seen + len(chunk))
+        return keyed
+
+    def add(self, chunk):
+        self._columns = self._columns or list(chunk.columns)
+        if(len(chunk) == 0):
+            return
+
+        keyed = self._keyed(chunk)
+        self.rows_seen += len(chunk)
+
+        overall = keyed if self._overall is None else pd.concat([self._overall, keyed], ignore_index=True)
+        self._overall = overall.nsmallest(self.size, "_key")
+
+        per_stratum = keyed if self._per_stratum is None else pd.concat([self._per_stratum, keyed], ignore_index=True)
+        per_stratum = per_stratum.loc[per_stratum.groupby("_stratum", sort=False)["_key"].idxmin()]
+        self._per_stratum = per_stratum.nsmallest(self.size, "_key")
+
+    def result(self):
+        if(self._overall is None):
+            return pd.DataFrame(columns=self._columns)
+
+        picked = self._per_stratum
+        rest = self._overall[~self._overall["_position"].isin(picked["_position"])]
+        picked = pd.concat([picked, rest.head(max(0, self.size - len(picked)))], ignore_index=True)
+
+        # back in result order, so ORDER BY in the SQL still holds
+        picked = picked.sort_values("_position")
+        sample = picked.drop(columns=["_key", "_stratum", "_position"]).reset_index(drop=True)
+        # how many rows the sample stands for; attrs travel with the frame through the result cache
+        sample.attrs["rows_seen"] = self.rows_seen
+        return sample
+
+
+def sample_chunks(chunks, token_budget=THEORY_DATA_TOKEN_BUDGET, seed=SAMPLING_SEED):
+    """(sample, rows_seen) of a stream of DataFrames, sized from the first chunk's row width"""
+    reservoir = None
+    for chunk in chunks:
+        if(reservoir == None):
+            reservoir = StratifiedReservoir(rows_for_token_budget(chunk, token_budget), seed)
+        reservoir.add(chunk)
+
+    if(reservoir == None):
+        return pd.DataFrame(), 0
+
+    return reservoir.result(), reservoir.rows_seen
+
+
+# a query that aggregates, dedupes or pages has a result TABLESAMPLE would change, not just thin out
+NOT_SAMPLEABLE_WORDS = {"avg", "min", "max", "sum", "count", "group", "distinct", "limit", "offset", "join", "union", "intersect", "except", "over", "tablesample", "with"}
+
+
+def tablesample_sql(sql, estimated_rows, target_rows, seed=SAMPLING_SEED):
+    """sql reading a fraction of the profiles pages (TABLESAMPLE SYSTEM ... REPEATABLE)
+    big enough for target_rows, or None when sampling the table would change the answer"""
+    tokens = [m for m in SQL_TOKEN_PATTERN.finditer(sql) if m.lastgroup != "comment"]
+    words = [m.group().lower() for m in tokens if m.lastgroup == "word"]
+    if(set(words) & NOT_SAMPLEABLE_WORDS or words.count("select") != 1 or words.count("from") != 1):
+        return None
+
+    for i, token in enumerate(tokens[:-1]):
+        if(token.group().lower() == "from" and tokens[i + 1].group().strip('"').lower() == "profiles"):
+            break
+    else:
+        return None
+
+    # pages are sampled whole and filters drop more rows, so take a few times what's needed
+    percent = min(100.0, 100.0 * 4 * target_rows / max(estimated_rows, 1))
+    if(percent >= 100.0):
+        return None
+
+    # TABLESAMPLE goes after the table alias, if there is one
+    j = i + 2
+    if(j < len(tokens) and tokens[j].group().lower() == "as"):
+        j += 2
+    elif(j < len(tokens) and tokens[j].lastgroup in ("word", "identifier") and tokens[j].group().lower() not in ("where", "order", "fetch", "for", "window")):
+        j += 1
+
+    end = tokens[min(j, len(tokens)) - 1].end()
+    return f"{sql[:end]} TABLESAMPLE SYSTEM ({math.ceil(percent * 1000) / 1000}) REPEATABLE ({seed}){sql[end:]}"
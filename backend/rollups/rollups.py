@@ -0,0 +1,158 @@
+from dotenv import load_dotenv
+import os
+import sys
+from sqlalchemy import text
+from retrieve_data_from_db.postgres_db import engine
+from data_version.version import bump_data_version
+from database.profiles_schema import SAFE_DATE_FUNCTION_STATEMENT
+
+
+load_dotenv()
+# pressure band width (dbar) of profiles_rollup_float_month_pres
+ROLLUP_PRES_BIN = float(os.getenv('ROLLUP_PRES_BIN', '10'))
+# lat / lon cell size (degrees) of profiles_rollup_region_month
+ROLLUP_REGION_DEGREES = float(os.getenv('ROLLUP_REGION_DEGREES', '5'))
+
+# measured column -> prefix of its <prefix>_count / _sum / _min / _max rollup columns
+MEASURES = {
+    "Temp_adj(C)": "temp",
+    "Psal_adj(psu)": "psal",
+    "Pres_adj(dbar)": "pres",
+}
+
+# Each rollup keeps the raw "float_id" (if listed in keys), the month of "Date" and
+# some binned columns. The router uses the same description to rewrite SQL onto it.
+# Rows whose "Date" isn't a valid date have no month and are left out (counted in
+# rollup_state.skipped_rows, so the router knows the rollup may miss rows).
+ROLLUPS = [
+    {
+        "table": "profiles_rollup_float_month_pres",
+        "keys": ["float_id"],
+        "binned": {"Pres_adj(dbar)": ("pres_bin", ROLLUP_PRES_BIN)},
+    },
+    {
+        "table": "profiles_rollup_region_month",
+        "keys": [],
+        "binned": {"Latitude": ("lat_bin", ROLLUP_REGION_DEGREES), "Longitude": ("lon_bin", ROLLUP_REGION_DEGREES)},
+    },
+]
+
+STATE_TABLE = "rollup_state"
+
+# NULL for text that isn't a real YYYY-MM-DD date (e.g. 2021-02-31) instead of failing the refresh
+SAFE_DATE_EXPRESSION = 'profiles_safe_date("Date")'
+
+
+def _key_columns(rollup):
+    """[(rollup column, type, expression over profiles)]"""
+    columns = [(key, "text", f'"{key}"') for key in rollup["keys"]]
+    columns.append(("month", "date", f"date_trunc('month', {SAFE_DATE_EXPRESSION})::DATE"))
+    for raw, (column, size) in rollup["binned"].items():
+        columns.append((column, "double precision", f'floor("{raw}" / {size}) * {size}'))
+    return columns
+
+
+def _measure_columns():
+    """[(rollup column, type, aggregate over profiles, how it merges with the EXCLUDED row on upsert)]"""
+    columns = [("row_count", "bigint", "COUNT(*)", "r.row_count + EXCLUDED.row_count")]
+    for raw, prefix in MEASURES.items():
+        columns += [
+            (f"{prefix}_count", "bigint", f'COUNT("{raw}")', f"r.{prefix}_count + EXCLUDED.{prefix}_count"),
+            (f"{prefix}_sum", "double precision", f'SUM("{raw}")', f"COALESCE(r.{prefix}_sum + EXCLUDED.{prefix}_sum, r.{prefix}_sum, EXCLUDED.{prefix}_sum)"),
+            (f"{prefix}_min", "double precision", f'MIN("{raw}")', f"LEAST(r.{prefix}_min, EXCLUDED.{prefix}_min)"),
+            (f"{prefix}_max", "double precision", f'MAX("{raw}")', f"GREATEST(r.{prefix}_max, EXCLUDED.{prefix}_max)"),
+        ]
+    return columns
+
+
+def _bucket_expression(keys):
+    # NULL keys are kept (so rollup counts match profiles), which rules out a plain
+    # primary key over them; "bucket" is a non-null text version of the key to upsert on
+    return "concat_ws('|', " + ", ".join(f"COALESCE(({expression})::text, '-')" for _, _, expression in keys) + ")"
+
+
+def create_rollup_sql(rollup):
+    keys = _key_columns(rollup)
+    columns = ["bucket text PRIMARY KEY"]
+    columns += [f'"{name}" {type}' for name, type, _ in keys]
+    columns += [f"{name} {type}" for name, type, _, _ in _measure_columns()]
+
+    statements = [f"CREATE TABLE IF NOT EXISTS {rollup['table']} (\n    " + ",\n    ".join(columns) + "\n)"]
+    for name, _, _ in keys:
+        statements.append(f'CREATE INDEX IF NOT EXISTS idx_{rollup["table"]}_{name} ON {rollup["table"]} ("{name}")')
+
+    return statements
+
+
+def refresh_rollup_sql(rollup):
+    """Folds profiles rows with last_id < id <= max_id and a valid date into the rollup"""
+    keys = _key_columns(rollup)
+    measures = _measure_columns()
+
+    names = ["bucket"] + [f'"{name}"' for name, _, _ in keys] + [name for name, _, _, _ in measures]
+    select = [_bucket_expression(keys)] + [expression for _, _, expression in keys] + [aggregate for _, _, aggregate, _ in measures]
+    group_by = ", ".join(str(i) for i in range(1, len(keys) + 2))
+
+    return f"""
+INSERT INTO {rollup['table']} AS r ({", ".join(names)})
+SELECT {", ".join(select)}
+FROM profiles
+WHERE id > :last_id AND id <= :max_id AND {SAFE_DATE_EXPRESSION} IS NOT NULL
+GROUP BY {group_by}
+ON CONFLICT (bucket) DO UPDATE SET
+    {", ".join(f"{name} = {merge}" for name, _, _, merge in measures)}
+"""
+
+
+def _last_id(conn, table):
+    row = conn.execute(text(f"SELECT last_id FROM {STATE_TABLE} WHERE name = :name"), {"name": table}).fetchone()
+    return row[0] if row != None else 0
+
+
+def refresh_rollups(rebuild=False):
+    """Brings every rollup up to date with profiles. Only rows added since the last refresh
+    are read (profiles is append-only, tracked by id); rebuild=True starts from scratch.
+    Run after each ingest; bumps the data version when any rollup changed"""
+    changed = False
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} (name text PRIMARY KEY, last_id bigint NOT NULL, refreshed_at timestamptz NOT NULL DEFAULT now())"))
+        conn.execute(text(f"ALTER TABLE {STATE_TABLE} ADD COLUMN IF NOT EXISTS skipped_rows bigint NOT NULL DEFAULT 0"))
+        conn.execute(text(SAFE_DATE_FUNCTION_STATEMENT))
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM profiles")).scalar()
+
+        for rollup in ROLLUPS:
+            table = rollup["table"]
+            if(rebuild):
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+                conn.execute(text(f"DELETE FROM {STATE_TABLE} WHERE name = :name"), {"name": table})
+
+            for statement in create_rollup_sql(rollup):
+                conn.execute(text(statement))
+
+            last_id = _last_id(conn, table)
+            if(last_id >= max_id):
+                print(f"{table} : up to date")
+                continue
+
+            conn.execute(text(refresh_rollup_sql(rollup)), {"last_id": last_id, "max_id": max_id})
+            skipped = conn.execute(
+                text(f"SELECT COUNT(*) FROM profiles WHERE id > :last_id AND id <= :max_id AND {SAFE_DATE_EXPRESSION} IS NULL"),
+                {"last_id": last_id, "max_id": max_id}
+            ).scalar()
+            conn.execute(
+                text(f"""INSERT INTO {STATE_TABLE} (name, last_id, skipped_rows, refreshed_at) VALUES (:name, :max_id, :skipped, now())
+                         ON CONFLICT (name) DO UPDATE SET last_id = EXCLUDED.last_id, skipped_rows = {STATE_TABLE}.skipped_rows + EXCLUDED.skipped_rows,
+                         refreshed_at = EXCLUDED.refreshed_at"""),
+                {"name": table, "max_id": max_id, "skipped": skipped}
+            )
+            changed = True
+            print(f"{table} : folded in profiles rows {last_id + 1}..{max_id}, {skipped} without a valid date skipped")
+
+    # after the commit, so nothing cached against the old rollups survives
+    if(changed or rebuild):
+        bump_data_version()
+
+
+# after an ingest: python -m rollups.rollups [--rebuild]
+if __name__ == "__main__":
+    refresh_rollups(rebuild="--rebuild" in sys.argv[1:])
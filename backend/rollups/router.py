@@ -0,0 +1,338 @@
+from dotenv import load_dotenv
+import os
+import calendar
+import threading
+import time
+from sqlalchemy import inspect, text
+from retrieve_data_from_db.postgres_db import engine
+from retrieve_data_from_db.result_cache import SQL_TOKEN_PATTERN
+from data_version.version import get_data_version
+from rollups.rollups import ROLLUPS, MEASURES, STATE_TABLE
+
+
+load_dotenv()
+ROLLUP_ROUTER_ENABLED = os.getenv('ROLLUP_ROUTER_ENABLED', 'true').lower() == 'true'
+# profiles can grow without a data version bump, so rollup freshness is also re-checked this often
+ROLLUP_FRESHNESS_SECONDS = float(os.getenv('ROLLUP_FRESHNESS_SECONDS', '30'))
+
+# every column of profiles; a reference to one the rollup can't stand in for stops the rewrite
+PROFILE_COLUMNS = {
+    "id", "float_id", "Profile", "Date", "Latitude", "Longitude", "Pres_raw(dbar)", "Pres_adj(dbar)", "Pres_raw_qc", "Pres_adj_qc",
+    "Temp_raw(C)", "Temp_adj(C)", "Temp_raw_qc", "Temp_adj_qc", "Psal_raw(psu)", "Psal_adj(psu)", "Psal_raw_qc", "Psal_adj_qc", "obs_date",
+}
+
+# anything that needs the raw rows (or is too hard to prove equivalent) is left to profiles
+UNROUTABLE_WORDS = {"select", "join", "distinct", "over", "union", "intersect", "except", "lateral", "with", "random", "tablesample"}
+
+AGGREGATES = {"avg", "min", "max", "sum", "count"}
+COMPARISONS = {"=", "<", ">", "<=", ">=", "<>", "!="}
+MONTH_GRAIN_UNITS = {"year", "month", "quarter", "decade", "century", "millennium"}
+
+
+class NotRoutable(Exception):
+    pass
+
+
+def _tokens(sql):
+    tokens = [(m.lastgroup, m.group()) for m in SQL_TOKEN_PATTERN.finditer(sql) if m.lastgroup != "comment"]
+    while(tokens and tokens[-1][1] == ";"):
+        tokens.pop()
+    return tokens
+
+
+def _word(token):
+    return token[1].lower() if token != None and token[0] in ("word", "symbol") else None
+
+
+def _identifier(token):
+    if(token == None):
+        return None
+    if(token[0] == "identifier"):
+        return token[1][1:-1].replace('""', '"')
+    if(token[0] == "word" and token[1].lower() in ("float_id", "id", "obs_date")):
+        return token[1].lower()
+    return None
+
+
+def _number(token):
+    if(token == None or token[0] != "number"):
+        return None
+    return float(token[1])
+
+
+def _is_multiple(value, size):
+    return value != None and abs(value / size - round(value / size)) < 1e-9
+
+
+def _month_start(literal):
+    return literal[0] == "string" and len(literal[1]) == 12 and literal[1][9:11] == "01"
+
+
+def _month_end(literal):
+    if(literal[0] != "string" or len(literal[1]) != 12):
+        return False
+    try:
+        year, month, day = (int(part) for part in literal[1][1:-1].split("-"))
+    except ValueError:
+        return False
+    return day == calendar.monthrange(year, month)[1]
+
+
+class _Rewriter:
+    """Rewrites one SELECT over profiles onto a rollup, raising NotRoutable when the
+    result could differ from running it on the raw rows. A rollup that left out rows
+    without a valid date (needs_date_filter) only answers queries whose WHERE filters
+    on the date, which drops those rows from the raw result too"""
+
+    def __init__(self, tokens, rollup, needs_date_filter=False):
+        self.tokens = tokens
+        self.rollup = rollup
+        self.needs_date_filter = needs_date_filter
+        self.out = []
+        self.i = 0
+        self.clause = None
+        self.date_filtered = False
+
+    def peek(self, offset=0):
+        j = self.i + offset
+        return self.tokens[j] if 0 <= j < len(self.tokens) else None
+
+    def prev_words(self, count):
+        return [_word(self.tokens[j]) if j >= 0 else None for j in range(self.i - count, self.i)]
+
+    def emit(self, text):
+        self.out.append(text)
+
+    def rewrite(self):
+        words = {_word(t) for t in self.tokens}
+        if(words & UNROUTABLE_WORDS - {"select"} or sum(1 for t in self.tokens if _word(t) == "select") != 1):
+            raise NotRoutable("query shape")
+
+        while(self.i < len(self.tokens)):
+            token = self.peek()
+            word = _word(token)
+            if(word in ("where", "group", "having", "order", "limit")):
+                self.clause = word
+
+            if(word == "from" and (_word(self.peek(1)) == "profiles" or _identifier(self.peek(1)) == "profiles")):
+                self.emit("FROM " + self.rollup["table"])
+                self.i += 2
+            elif(word in AGGREGATES and _word(self.peek(1)) == "("):
+                self.aggregate(word)
+            elif(_identifier(token) in ("Date", "obs_date")):
+                self.date()
+            elif(_identifier(token) in self.rollup["binned"]):
+                self.binned(_identifier(token))
+            elif(_identifier(token) in self.rollup["keys"]):
+                self.emit(f'"{_identifier(token)}"')
+                self.i += 1
+            elif(_identifier(token) in PROFILE_COLUMNS):
+                raise NotRoutable(f'column "{_identifier(token)}"')
+            else:
+                self.emit(token[1])
+                self.i += 1
+
+        # under OR the date comparison may not apply to every row
+        if(self.needs_date_filter and (not self.date_filtered or "or" in words)):
+            raise NotRoutable("rows without a valid date are not in the rollup and the query doesn't filter on the date")
+
+        return " ".join(self.out)
+
+    def aggregate(self, name):
+        inner = self.peek(2)
+        if(_word(self.peek(3)) != ")"):
+            raise NotRoutable(f"{name}() argument")
+
+        if(name == "count" and (_word(inner) == "*" or _number(inner) != None)):
+            # COUNT is 0 when no row matches, SUM is NULL
+            self.emit("COALESCE(SUM(row_count), 0)")
+        elif(_identifier(inner) in MEASURES):
+            prefix = MEASURES[_identifier(inner)]
+            self.emit({
+                "avg": f"(SUM({prefix}_sum) / NULLIF(SUM({prefix}_count), 0))",
+                "sum": f"SUM({prefix}_sum)",
+                "count": f"COALESCE(SUM({prefix}_count), 0)",
+                "min": f"MIN({prefix}_min)",
+                "max": f"MAX({prefix}_max)",
+            }[name])
+        else:
+            raise NotRoutable(f"{name}() argument")
+
+        self.i += 4
+
+    def date(self):
+        # only obs_date, "Date"::DATE (or CAST("Date" AS DATE)) at month grain or coarser
+        cast = None
+        if(_identifier(self.peek()) == "obs_date"):
+            cast = 1
+        elif(_word(self.peek(1)) == "::" and _word(self.peek(2)) == "date"):
+            cast = 3
+        elif(self.prev_words(2) == ["cast", "("] and _word(self.peek(1)) == "as" and _word(self.peek(2)) == "date" and _word(self.peek(3)) == ")"):
+            self.out.pop()
+            self.out.pop()
+            cast = 4
+        if(cast == None):
+            raise NotRoutable('"Date" used as text')
+
+        # words before "Date" (or before CAST) to spot EXTRACT(<unit> FROM ...)
+        before = [w for w in (self.prev_words(3) if cast != 4 else self.prev_words(5)[:3]) if w != None]
+        after_index = self.i + cast
+        after = self.tokens[after_index] if after_index < len(self.tokens) else None
+
+        inside_extract = len(before) >= 3 and before[-1] == "from" and before[-3] == "("
+        inside_trunc = len(self.out) >= 3 and self.out[-1] == "," and self.out[-3] == "(" and _unquote(self.out[-2]) in MONTH_GRAIN_UNITS
+
+        if(inside_extract):
+            if(before[-2] not in MONTH_GRAIN_UNITS):
+                raise NotRoutable("EXTRACT below month grain")
+            # EXTRACT(YEAR FROM "Date"::DATE) = 2022 in WHERE
+            following = self.tokens[after_index + 1] if after_index + 1 < len(self.tokens) else None
+            if(_word(after) == ")" and (_word(following) in COMPARISONS or _word(following) == "between") and self.clause == "where"):
+                self.date_filtered = True
+        elif(inside_trunc):
+            pass
+        elif(_word(after) in COMPARISONS or _word(after) == "between"):
+            self.check_month_bounds(after_index)
+            if(self.clause == "where"):
+                self.date_filtered = True
+        else:
+            raise NotRoutable('"Date" below month grain')
+
+        self.emit('"month"')
+        self.i += cast
+
+    def check_month_bounds(self, index):
+        op = _word(self.tokens[index])
+        first = self.tokens[index + 1] if index + 1 < len(self.tokens) else ("", "")
+
+        if(op == "between"):
+            second = self.tokens[index + 3] if index + 3 < len(self.tokens) else ("", "")
+            if(_month_start(first) and _month_end(second)):
+                return
+        elif(op in (">=", "<") and _month_start(first)):
+            return
+        elif(op in ("<=", ">") and _month_end(first)):
+            return
+
+        raise NotRoutable('"Date" bound not on a month boundary')
+
+    def binned(self, raw):
+        column, size = self.rollup["binned"][raw]
+        after = self.peek(1)
+
+        # floor("X" / N) with N a multiple of the bin size
+        if(self.prev_words(2) == ["floor", "("] and _word(after) == "/" and _is_multiple(_number(self.peek(2)), size) and _word(self.peek(3)) == ")"):
+            self.emit(f'"{column}"')
+            self.i += 1
+            return
+
+        # "X" >= a / "X" < b with a, b on bin edges
+        if(_word(after) in (">=", "<") and _is_multiple(_number(self.peek(2)), size)):
+            self.emit(f'"{column}"')
+            self.i += 1
+            return
+
+        raise NotRoutable(f'"{raw}" not on {column} edges')
+
+
+def _unquote(text):
+    return text[1:-1].lower() if len(text) >= 2 and text[0] == "'" and text[-1] == "'" else text.lower()
+
+
+_lock = threading.Lock()
+_available = {"version": None, "checked_at": 0.0, "tables": set(), "stale": set(), "skipped_rows": {}}
+_stats = {"routed": {}, "not_routed": 0}
+
+
+def _current_rollups():
+    """(tables folded up to MAX(profiles.id), tables that exist but are behind it,
+    {table: profiles rows left out for having no valid date})"""
+    inspector = inspect(engine)
+    existing = {rollup["table"] for rollup in ROLLUPS if inspector.has_table(rollup["table"])}
+    if(len(existing) == 0 or not inspector.has_table(STATE_TABLE)):
+        return set(), existing, {}
+
+    with engine.connect() as conn:
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM profiles")).scalar()
+        state = conn.execute(text(f"SELECT name, last_id, skipped_rows FROM {STATE_TABLE}")).fetchall()
+
+    last_ids = {name: last_id for name, last_id, _ in state}
+    skipped_rows = {name: skipped for name, _, skipped in state}
+    current = {table for table in existing if last_ids.get(table, -1) >= max_id}
+    return current, existing - current, skipped_rows
+
+
+def available_rollups():
+    """Rollup tables that exist and have folded in every profiles row. Checked again whenever
+    the data version changes and at least every ROLLUP_FRESHNESS_SECONDS; a stale rollup would
+    answer with aggregates that miss the latest ingest"""
+    version = get_data_version()
+    with _lock:
+        if(_available["version"] == version and time.time() - _available["checked_at"] < ROLLUP_FRESHNESS_SECONDS):
+            return _available["tables"]
+
+    try:
+        tables, stale, skipped_rows = _current_rollups()
+    except Exception as e:
+        print(f"Rollup check failed: {e}")
+        tables, stale, skipped_rows = set(), set(), {}
+
+    if(stale):
+        print("Stale rollups, not routed to until refreshed : ", ", ".join(sorted(stale)))
+
+    with _lock:
+        _available["version"] = version
+        _available["checked_at"] = time.time()
+        _available["tables"] = tables
+        _available["stale"] = stale
+        _available["skipped_rows"] = skipped_rows
+
+    return tables
+
+
+def route_to_rollup(sql):
+    """The same query over the first rollup that can answer it exactly, or sql unchanged"""
+    if(not ROLLUP_ROUTER_ENABLED):
+        return sql
+
+    tables = available_rollups()
+    if(len(tables) == 0):
+        return sql
+
+    tokens = _tokens(sql)
+    if(not any(_word(t) in AGGREGATES for t in tokens)):
+        return sql
+
+    with _lock:
+        skipped_rows = dict(_available["skipped_rows"])
+
+    reasons = []
+    for rollup in ROLLUPS:
+        if(rollup["table"] not in tables):
+            continue
+        try:
+            routed = _Rewriter(tokens, rollup, skipped_rows.get(rollup["table"], 0) > 0).rewrite()
+        except NotRoutable as e:
+            reasons.append(f"{rollup['table']}: {e}")
+            continue
+
+        with _lock:
+            _stats["routed"][rollup["table"]] = _stats["routed"].get(rollup["table"], 0) + 1
+        print(f"Routed to {rollup['table']} : {routed}")
+        return routed
+
+    with _lock:
+        _stats["not_routed"] += 1
+    print("Not routed to a rollup : ", "; ".join(reasons))
+    return sql
+
+
+def rollup_router_stats():
+    with _lock:
+        return {
+            "routed": dict(_stats["routed"]),
+            "not_routed": _stats["not_routed"],
+            "available": sorted(_available["tables"]),
+            "stale": sorted(_available["stale"]),
+            "skipped_rows": dict(_available["skipped_rows"])
+        }
@@ -0,0 +1,101 @@
+import sys
+import json
+import time
+import statistics
+from store_in_vector_db.vector_db import get_embedding_backend, get_collection
+
+
+# representative vector-path questions, used when no --queries file is given
+QUERIES = [
+    "floats in the Arabian Sea measuring dissolved oxygen",
+    "Argo floats deployed in the Bay of Bengal after 2020",
+    "floats operated by INCOIS with CTD sensors",
+    "which floats drifted from the Laccadive Sea into the Arabian Sea",
+    "floats with chlorophyll and nitrate sensors in the Indian Ocean",
+    "long running floats with a mission longer than five years",
+    "floats whose mission ended or that stopped transmitting",
+    "floats near the equator in the southern Indian Ocean",
+    "APEX floats measuring salinity and temperature",
+    "floats launched near Sri Lanka",
+    "floats that mostly stayed in the Andaman Sea",
+    "biogeochemical floats measuring pH",
+]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _top_ids(backend, query_embedding, k):
+    started = time.perf_counter()
+    result = get_collection(backend).query(query_embeddings=[query_embedding], n_results=k, include=[])
+    return result["ids"][0], (time.perf_counter() - started) * 1000
+
+
+def run_benchmark(backend_names, queries, ks=(1, 5, 10), reference="gemini"):
+    """Per backend: embedding latency (uncached), Chroma query latency and recall@k, where the
+    relevant documents of a query are the top-k the reference backend (the current gemini
+    embeddings) returns for it"""
+    k_max = max(ks)
+    reference_backend = get_embedding_backend(reference)
+
+    truth = []
+    for query in queries:
+        ids, _ = _top_ids(reference_backend, reference_backend.embed([query])[0], k_max)
+        truth.append(ids)
+
+    report = {"reference": reference_backend.name, "queries": len(queries), "results": {}}
+    for name in backend_names:
+        backend = get_embedding_backend(name)
+        # first call loads the model / opens the connection, not part of the timings
+        backend.embed([queries[0]])
+
+        embed_ms, query_ms, recalls = [], [], {k: [] for k in ks}
+        for query, relevant in zip(queries, truth):
+            started = time.perf_counter()
+            embedding = backend.embed([query])[0]
+            embed_ms.append((time.perf_counter() - started) * 1000)
+
+            ids, ms = _top_ids(backend, embedding, k_max)
+            query_ms.append(ms)
+            for k in ks:
+                if(len(relevant[:k])):
+                    recalls[k].append(len(set(ids[:k]) & set(relevant[:k])) / len(relevant[:k]))
+
+        started = time.perf_counter()
+        backend.embed(queries)
+        batch_ms = (time.perf_counter() - started) * 1000
+
+        result = {
+            "embed_ms_p50": statistics.median(embed_ms),
+            "embed_ms_p95": _percentile(embed_ms, 0.95),
+            "query_ms_p50": statistics.median(query_ms),
+            "batch_texts_per_sec": len(queries) / max(batch_ms / 1000, 1e-9),
+            **{f"recall@{k}": statistics.mean(values) if values else None for k, values in recalls.items()},
+        }
+        report["results"][backend.name] = result
+
+        recall_text = "  ".join(f"recall@{k} {result[f'recall@{k}']:.3f}" for k in ks if result[f"recall@{k}"] != None)
+        print(f"{backend.name:<28} embed p50 {result['embed_ms_p50']:>8.1f} ms  p95 {result['embed_ms_p95']:>8.1f} ms  query p50 {result['query_ms_p50']:>7.1f} ms  {result['batch_texts_per_sec']:>8.1f} texts/sec  {recall_text}")
+
+    return report
+
+
+# python -m store_in_vector_db.reindex --backend onnx   (first)
+# python -m store_in_vector_db.benchmark_embeddings [--backends gemini,onnx] [--k 1,5,10] [--queries questions.txt] [--save report.json]
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    backend_names = args[args.index("--backends") + 1].split(",") if "--backends" in args else ["gemini", "onnx"]
+    ks = [int(k) for k in args[args.index("--k") + 1].split(",")] if "--k" in args else [1, 5, 10]
+
+    queries = QUERIES
+    if("--queries" in args):
+        with open(args[args.index("--queries") + 1]) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    report = run_benchmark(backend_names, queries, ks)
+
+    if("--save" in args):
+        with open(args[args.index("--save") + 1], "w") as f:
+            json.dump(report, f, indent=1)
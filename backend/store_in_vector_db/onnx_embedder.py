@@ -0,0 +1,88 @@
+from dotenv import load_dotenv
+import os
+import threading
+from pathlib import Path
+import numpy as np
+
+# the local backend needs the optional onnxruntime and tokenizers packages
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+
+load_dotenv()
+# folder with model.onnx and tokenizer.json of a sentence-embedding model (e.g. all-MiniLM-L6-v2 exported to ONNX)
+ONNX_EMBEDDING_MODEL_PATH = os.getenv('ONNX_EMBEDDING_MODEL_PATH', str(Path(__file__).parent.parent / "onnx_models" / "all-MiniLM-L6-v2"))
+# threads one inference may use; 0 lets ONNX Runtime pick (all cores)
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '4'))
+ONNX_BATCH_SIZE = int(os.getenv('ONNX_BATCH_SIZE', '32'))
+# longer texts are truncated; float summaries fit in 512 word pieces
+ONNX_MAX_TOKENS = int(os.getenv('ONNX_MAX_TOKENS', '512'))
+
+
+class OnnxEmbedder:
+    """Sentence embeddings on the CPU: the transformer runs in ONNX Runtime on batches of
+    ONNX_BATCH_SIZE texts, token vectors are mean-pooled over the attention mask and
+    L2-normalised. Loaded on first use, thread-safe after that"""
+
+    def __init__(self, model_path=ONNX_EMBEDDING_MODEL_PATH, threads=ONNX_THREADS, batch_size=ONNX_BATCH_SIZE, max_tokens=ONNX_MAX_TOKENS):
+        self.model_path = Path(model_path)
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        # the cache and collection key, so vectors of different models never mix
+        self.name = f"onnx-{self.model_path.name}"
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._tokenizer = None
+        self._inputs = []
+
+    def _load(self):
+        with self._lock:
+            if(self._session != None):
+                return
+
+            if(not ONNX_AVAILABLE):
+                raise RuntimeError("The onnx embedding backend needs: pip install -r requirements-optional.txt")
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+            tokenizer = Tokenizer.from_file(str(self.model_path / "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=self.max_tokens)
+            tokenizer.enable_padding()
+
+            self._session = onnxruntime.InferenceSession(str(self.model_path / "model.onnx"), options, providers=["CPUExecutionProvider"])
+            self._inputs = [model_input.name for model_input in self._session.get_inputs()]
+            self._tokenizer = tokenizer
+
+    def _embed_batch(self, texts):
+        encodings = self._tokenizer.encode_batch(texts)
+        mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feed = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+
+        output = self._session.run(None, {name: feed[name] for name in self._inputs})[0]
+        if(output.ndim == 3):
+            # token vectors -> one vector per text, padding left out
+            weights = mask[:, :, None].astype(np.float32)
+            output = (output * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return output / np.clip(norms, 1e-12, None)
+
+    def embed(self, texts):
+        self._load()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors += self._embed_batch(texts[start:start + self.batch_size]).tolist()
+        return vectors
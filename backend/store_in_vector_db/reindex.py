@@ -0,0 +1,41 @@
+import sys
+import time
+from embedding_cache.embedding_cache import cached_embeddings
+from store_in_vector_db.vector_db import collection, get_embedding_backend, get_collection
+
+
+def reindex(backend_name, batch_size=256):
+    """Embeds every document of the "documents" collection with backend_name and upserts it
+    (same id, text and metadata) into that backend's collection. Safe to run again: upserts,
+    and texts embedded before come from the embedding cache"""
+    backend = get_embedding_backend(backend_name)
+    target = get_collection(backend)
+    if(target is collection):
+        print(f"{backend.name} is what the documents collection already holds, nothing to do")
+        return 0
+
+    total = collection.count()
+    started = time.perf_counter()
+    done = 0
+
+    for offset in range(0, total, batch_size):
+        page = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if(len(page["ids"]) == 0):
+            break
+
+        embeddings = cached_embeddings(backend.name, page["documents"], backend.embed)
+        target.upsert(ids=page["ids"], documents=page["documents"], metadatas=page["metadatas"], embeddings=embeddings)
+
+        done += len(page["ids"])
+        elapsed = time.perf_counter() - started
+        print(f"{done} / {total} documents re-indexed, {done / max(elapsed, 1e-9):.1f} docs/sec")
+
+    return done
+
+
+# python -m store_in_vector_db.reindex --backend onnx [--batch 256]
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    backend_name = args[args.index("--backend") + 1] if "--backend" in args else "onnx"
+    batch_size = int(args[args.index("--batch") + 1]) if "--batch" in args else 256
+    reindex(backend_name, batch_size)
@@ -4,6 +4,10 @@ from google import genai
 
 from dotenv import load_dotenv
 import os
+import re
+import threading
+from embedding_cache.embedding_cache import cached_embeddings
+from store_in_vector_db.onnx_embedder import OnnxEmbedder
 
 
 load_dotenv()
@@ -23,17 +27,80 @@ chroma_client = chromadb.PersistentClient("/home/subhash/Desktop/float/subhash_c
 collection = chroma_client.get_or_create_collection(name="documents")
 
 
-def generate_embeddings(summary):
+EMBEDDING_MODEL = "gemini-embedding-001"
+# gemini: remote gemini-embedding-001 (the "documents" collection), onnx: local CPU model
+# (its own collection, filled by python -m store_in_vector_db.reindex --backend onnx)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'gemini').lower()
+# texts per embed_content request
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '100'))
 
-    client = genai.Client(
-        api_key=GEMINI_API_KEY
-    )
+_client_lock = threading.Lock()
+_genai_client = None
+
+
+def get_genai_client():
+    # one client for the process instead of one per call
+    global _genai_client
+    with _client_lock:
+        if(_genai_client == None):
+            _genai_client = genai.Client(api_key=GEMINI_API_KEY)
+        return _genai_client
+
+
+class GeminiEmbedder:
+    """The remote embedder the "documents" collection was built with"""
+
+    name = EMBEDDING_MODEL
+
+    def embed(self, texts):
+        # one embed_content request per EMBED_BATCH_SIZE texts instead of one per text
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            result = get_genai_client().models.embed_content(
+                    model=EMBEDDING_MODEL,
+                    contents=texts[start:start + EMBED_BATCH_SIZE])
+            vectors += [embedding.values for embedding in result.embeddings]
+        return vectors
+
+
+# an embedding backend is anything with .name (keys the cache and the collection) and .embed(texts) -> vectors
+EMBEDDING_BACKENDS = {
+    "gemini": GeminiEmbedder,
+    "onnx": OnnxEmbedder,
+}
 
-    result = client.models.embed_content(
-            model="gemini-embedding-001",
-            contents=summary)
+_backends = {}
+_collections = {}
 
-    return result.embeddings[0].values
+
+def get_embedding_backend(name=None):
+    name = (name or EMBEDDING_BACKEND).lower()
+    if(name not in EMBEDDING_BACKENDS):
+        raise ValueError(f"Unknown embedding backend {name}, expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+    with _client_lock:
+        if(name not in _backends):
+            _backends[name] = EMBEDDING_BACKENDS[name]()
+        return _backends[name]
+
+
+def get_collection(backend=None):
+    """Collection holding the documents embedded by backend; vectors of different models can't share one"""
+    backend = backend or get_embedding_backend()
+    if(backend.name == EMBEDDING_MODEL):
+        return collection
+
+    with _client_lock:
+        if(backend.name not in _collections):
+            name = re.sub(r"[^A-Za-z0-9._-]", "_", f"documents_{backend.name}")[:63]
+            _collections[backend.name] = chroma_client.get_or_create_collection(name=name)
+        return _collections[backend.name]
+
+
+def generate_embeddings(summary, backend=None):
+    """Embedding of summary, from the persistent embedding cache when it was embedded before"""
+    backend = backend or get_embedding_backend()
+    return cached_embeddings(backend.name, [summary], backend.embed)[0]
 
 
 
@@ -49,14 +116,18 @@ def add_documents(documents, metadata, embeddings, float_id):
     print(f"Data added successfully {float_id}", end="\n\n\n\n")
 
 
-def query_documents(query, filters):
+def query_documents(query, filters, query_embeddings=None):
+    # callers that already embedded the query (e.g. speculatively) pass it in
+    if(query_embeddings == None):
+        query_embeddings = generate_embeddings(query)
+
     if(filters == {}):
-        results = collection.query(
-        query_embeddings=generate_embeddings(query),
+        results = get_collection().query(
+        query_embeddings=query_embeddings,
         )
     else:
-        results = collection.query(
-            query_embeddings=generate_embeddings(query),
+        results = get_collection().query(
+            query_embeddings=query_embeddings,
             where=filters,
             n_results=100
         )
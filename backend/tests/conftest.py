@@ -0,0 +1,16 @@
+# python -m pytest -q tests, from backend/
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# the modules import each other from backend/, as when the API runs there
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# set before any backend module reads .env (load_dotenv never overrides): no database,
+# and no stamp, template or cache files written into the working tree
+_scratch = Path(tempfile.mkdtemp(prefix="floatchat-tests-"))
+os.environ["DB_URL"] = "sqlite://"
+os.environ["DATA_VERSION_FILE"] = str(_scratch / "data_version.txt")
+os.environ["SQL_TEMPLATES_PATH"] = str(_scratch / "sql_templates.json")
+os.environ.pop("SQL_RESULT_CACHE_DISK_PATH", None)
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from generate_sql import guard
+from generate_sql.guard import check_single_select, UnsafeSQLError
+
+
+@pytest.mark.parametrize("sql", [
+    "",
+    "-- only a comment",
+    "DELETE FROM profiles",
+    "UPDATE profiles SET \"Temp_adj(C)\" = 0",
+    "DROP TABLE profiles",
+    "WITH gone AS (DELETE FROM profiles RETURNING *) SELECT * FROM gone",
+    "SELECT 1; DROP TABLE profiles",
+    "SELECT 1; SELECT 2",
+    "SELECT * INTO copy FROM profiles",
+    "SELECT * FROM profiles FOR UPDATE",
+    "SELECT * FROM profiles FOR NO KEY UPDATE",
+    "SELECT * FROM profiles FOR SHARE",
+    "SELECT pg_sleep(10)",
+    "SELECT set_config('statement_timeout', '0', false)",
+    "SELECT pg_read_file('/etc/passwd')",
+    "SELECT * FROM dblink('host=x', 'DELETE FROM t') AS t(a int)",
+])
+def test_rejects_anything_but_one_plain_select(sql):
+    with pytest.raises(UnsafeSQLError):
+        check_single_select(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT "float_id", "Temp_adj(C)" FROM profiles WHERE "Date" >= \'2022-01-01\'',
+    # keywords of other statements used as names, inside strings or in comments
+    'SELECT "update", "delete", "set" FROM profiles',
+    "SELECT * FROM profiles WHERE note = 'DROP TABLE profiles; pg_sleep(1)'",
+    "SELECT float_id -- DELETE FROM profiles\nFROM profiles",
+    "SELECT float_id, COUNT(*) FROM profiles GROUP BY float_id ORDER BY 2 DESC LIMIT 10",
+    "SELECT 'for update' AS label, share FROM t",
+])
+def test_accepts_plain_selects(sql):
+    check_single_select(sql)
+
+
+def test_strips_trailing_semicolons_and_comments():
+    assert check_single_select("SELECT 1;  -- done\n;") == "SELECT 1"
+    assert check_single_select("/* hint */ SELECT 1 ;") == "SELECT 1"
+
+
+def test_guard_rejects_before_explaining(monkeypatch):
+    explained = []
+    monkeypatch.setattr(guard, "explain_sql", lambda sql, timeout_ms: explained.append(sql))
+
+    with pytest.raises(UnsafeSQLError):
+        asyncio.run(guard.guard_sql("DELETE FROM profiles", "table"))
+    assert explained == []
@@ -0,0 +1,57 @@
+import pandas as pd
+from retrieve_data_from_db.result_cache import normalize_sql, is_volatile_sql, result_key, SQLResultCache
+
+
+def test_in_list_order_does_not_matter():
+    assert normalize_sql("SELECT * FROM profiles WHERE float_id IN (3, 1, 2)") == \
+        normalize_sql("select * from profiles where float_id in (1, 2, 3)")
+    assert normalize_sql("SELECT 1 WHERE x IN ('b', 'a')") == normalize_sql("SELECT 1 WHERE x IN ('a', 'b')")
+
+
+def test_in_list_duplicates_and_subqueries():
+    assert normalize_sql("SELECT 1 WHERE x IN (2, 1, 2)") == normalize_sql("SELECT 1 WHERE x IN (1, 2)")
+    # a subquery is not a literal list and stays as written
+    assert normalize_sql("SELECT 1 WHERE x IN (SELECT b FROM t)") == "select 1 where x in ( select b from t )"
+
+
+def test_whitespace_comments_case_and_semicolon():
+    assert normalize_sql("SELECT  *\n FROM profiles -- all\n;") == normalize_sql("select * from PROFILES")
+    assert normalize_sql("SELECT /* cols */ a FROM t;;") == "select a from t"
+
+
+def test_quoted_identifiers_and_strings_keep_their_case():
+    assert normalize_sql('SELECT "Temp_adj(C)" FROM profiles') == 'select "Temp_adj(C)" from profiles'
+    assert normalize_sql("SELECT 1 WHERE name = 'Arabian Sea'") != normalize_sql("SELECT 1 WHERE name = 'arabian sea'")
+    assert normalize_sql('SELECT "Date" FROM t') != normalize_sql('SELECT "date" FROM t')
+    # keywords inside a string are data, not SQL
+    assert normalize_sql("SELECT 'FROM  X -- y' AS s") == "select 'FROM  X -- y' as s"
+
+
+def test_result_key_includes_the_row_limit():
+    assert result_key("SELECT 1", 10) == result_key("select 1;", 10)
+    assert result_key("SELECT 1", 10) != result_key("SELECT 1", 20)
+
+
+def test_volatile_sql():
+    assert is_volatile_sql("SELECT * FROM profiles WHERE obs_date > CURRENT_DATE - 30")
+    assert is_volatile_sql("SELECT now()")
+    assert is_volatile_sql("SELECT * FROM profiles ORDER BY RANDOM() LIMIT 5")
+
+
+def test_not_volatile_sql():
+    assert not is_volatile_sql('SELECT "float_id", "Date" FROM profiles WHERE "Date" >= \'2022-01-01\'')
+    # names and strings that only look like volatile functions
+    assert not is_volatile_sql('SELECT "now", random_id FROM t WHERE note = \'now()\'')
+    assert not is_volatile_sql("SELECT age FROM t")
+
+
+def test_cache_bypasses_volatile_sql():
+    cache = SQLResultCache(1024 ** 2)
+    df = pd.DataFrame({"a": [1, 2]})
+
+    cache.put("SELECT a FROM t WHERE d < now()", df)
+    assert cache.get("SELECT a FROM t WHERE d < now()") is None
+    assert cache.stats()["volatile_bypasses"] == 1
+
+    cache.put("SELECT a FROM t", df)
+    assert cache.get("select a from t;").equals(df)
@@ -0,0 +1,104 @@
+import pytest
+from rollups.rollups import ROLLUPS
+from rollups.router import _Rewriter, _tokens, NotRoutable
+
+FLOAT_MONTH_PRES, REGION_MONTH = ROLLUPS
+
+
+def rewrite(sql, rollup=FLOAT_MONTH_PRES, needs_date_filter=False):
+    return _Rewriter(_tokens(sql), rollup, needs_date_filter).rewrite()
+
+
+@pytest.mark.parametrize("where", [
+    "\"Date\"::DATE BETWEEN '2022-01-01' AND '2022-12-31'",
+    "obs_date >= '2022-01-01' AND obs_date < '2023-01-01'",
+    "CAST(\"Date\" AS DATE) > '2022-02-28' AND obs_date <= '2024-02-29'",
+    "EXTRACT(YEAR FROM obs_date) = 2022",
+])
+def test_month_bounds_route(where):
+    routed = rewrite(f"SELECT AVG(\"Temp_adj(C)\") FROM profiles WHERE \"float_id\" = '2902277' AND {where}")
+    assert routed.startswith("SELECT (SUM(temp_sum) / NULLIF(SUM(temp_count), 0)) FROM profiles_rollup_float_month_pres")
+    assert '"month"' in routed and '"Date"' not in routed and "obs_date" not in routed
+
+
+@pytest.mark.parametrize("where", [
+    "obs_date >= '2022-01-15'",
+    "\"Date\"::DATE BETWEEN '2022-01-01' AND '2022-02-27'",
+    "obs_date <= '2023-02-29'",
+    "obs_date = '2022-01-01'",
+    "EXTRACT(DAY FROM obs_date) = 1",
+    "\"Date\" LIKE '2022%'",
+])
+def test_bounds_inside_a_month_dont_route(where):
+    with pytest.raises(NotRoutable):
+        rewrite(f"SELECT COUNT(*) FROM profiles WHERE {where}")
+
+
+def test_month_grain_grouping():
+    routed = rewrite("SELECT date_trunc('year', obs_date), MAX(\"Psal_adj(psu)\") FROM profiles GROUP BY 1")
+    assert routed == "SELECT date_trunc ( 'year' , \"month\" ) , MAX(psal_max) FROM profiles_rollup_float_month_pres GROUP BY 1"
+
+    with pytest.raises(NotRoutable):
+        rewrite("SELECT date_trunc('day', obs_date), COUNT(*) FROM profiles GROUP BY 1")
+
+
+def test_counts_are_zero_not_null():
+    assert "COALESCE(SUM(row_count), 0)" in rewrite("SELECT COUNT(*) FROM profiles WHERE float_id = '1'")
+    assert "COALESCE(SUM(temp_count), 0)" in rewrite('SELECT COUNT("Temp_adj(C)") FROM profiles')
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT AVG("Temp_adj(C)") FROM profiles WHERE "Pres_adj(dbar)" >= 100 AND "Pres_adj(dbar)" < 200',
+    'SELECT floor("Pres_adj(dbar)" / 50), AVG("Temp_adj(C)") FROM profiles GROUP BY 1',
+])
+def test_pressure_bin_edges_route(sql):
+    routed = rewrite(sql)
+    assert '"pres_bin"' in routed and '"Pres_adj(dbar)"' not in routed
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT AVG("Temp_adj(C)") FROM profiles WHERE "Pres_adj(dbar)" >= 105',
+    'SELECT AVG("Temp_adj(C)") FROM profiles WHERE "Pres_adj(dbar)" <= 100',
+    'SELECT floor("Pres_adj(dbar)" / 15), AVG("Temp_adj(C)") FROM profiles GROUP BY 1',
+])
+def test_pressure_off_bin_edges_dont_route(sql):
+    with pytest.raises(NotRoutable):
+        rewrite(sql)
+
+
+def test_region_cells():
+    routed = rewrite('SELECT COUNT(*) FROM profiles WHERE "Latitude" >= 10 AND "Latitude" < 20 AND "Longitude" >= 60', REGION_MONTH)
+    assert routed == 'SELECT COALESCE(SUM(row_count), 0) FROM profiles_rollup_region_month WHERE "lat_bin" >= 10 AND "lat_bin" < 20 AND "lon_bin" >= 60'
+
+    with pytest.raises(NotRoutable):
+        rewrite('SELECT COUNT(*) FROM profiles WHERE "Latitude" >= 12', REGION_MONTH)
+    # the region rollup has no float_id
+    with pytest.raises(NotRoutable):
+        rewrite("SELECT COUNT(*) FROM profiles WHERE float_id = '1'", REGION_MONTH)
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT "Temp_adj(C)" FROM profiles',
+    'SELECT AVG("Temp_raw(C)") FROM profiles',
+    "SELECT COUNT(DISTINCT float_id) FROM profiles",
+    "SELECT COUNT(*) FROM profiles p JOIN floats f ON f.id = p.float_id",
+    "SELECT COUNT(*) FROM profiles WHERE id > 10",
+])
+def test_needs_raw_rows(sql):
+    with pytest.raises(NotRoutable):
+        rewrite(sql)
+
+
+def test_rollup_missing_undated_rows_needs_a_date_filter():
+    dated = "SELECT COUNT(*) FROM profiles WHERE float_id = '1' AND obs_date >= '2022-01-01'"
+    assert rewrite(dated, needs_date_filter=True).endswith("\"month\" >= '2022-01-01'")
+    assert rewrite("SELECT COUNT(*) FROM profiles WHERE EXTRACT(YEAR FROM obs_date) = 2022", needs_date_filter=True)
+
+    for sql in [
+        "SELECT COUNT(*) FROM profiles WHERE float_id = '1'",
+        "SELECT COUNT(*) FROM profiles WHERE float_id = '1' OR obs_date >= '2022-01-01'",
+        "SELECT date_trunc('year', obs_date), COUNT(*) FROM profiles GROUP BY 1",
+    ]:
+        with pytest.raises(NotRoutable):
+            rewrite(sql, needs_date_filter=True)
+        rewrite(sql)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+from retrieve_data_from_db.sampling import StratifiedReservoir, sample_chunks, rows_for_token_budget, tablesample_sql, SAMPLE_MIN_ROWS, SAMPLE_MAX_ROWS
+
+
+def profiles(n):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "float_id": rng.choice(["2902277", "2902278", "2902279"], n),
+        "Date": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D"),
+        "Pres_adj(dbar)": rng.uniform(0, 2000, n).round(1),
+        "Temp_adj(C)": rng.uniform(2, 30, n).round(3),
+    })
+
+
+def reservoir_sample(chunks, size=50):
+    reservoir = StratifiedReservoir(size)
+    for chunk in chunks:
+        reservoir.add(chunk)
+    return reservoir.result()
+
+
+def split(df, sizes):
+    edges = np.cumsum([0] + sizes)
+    return [df.iloc[a:b] for a, b in zip(edges[:-1], edges[1:])]
+
+
+def test_same_sample_whatever_the_chunking():
+    df = profiles(3000)
+    whole = reservoir_sample([df])
+    for sizes in ([1000, 1000, 1000], [1, 2999], [7] * 428 + [4], [2500, 0, 500]):
+        pd.testing.assert_frame_equal(reservoir_sample(split(df, sizes)), whole)
+
+
+def test_same_rows_whatever_the_order():
+    df = profiles(2000)
+    shuffled = df.sample(frac=1, random_state=1)
+    key = list(df.columns)
+    first = reservoir_sample([df]).sort_values(key).reset_index(drop=True)
+    second = reservoir_sample(split(shuffled, [600, 1400])).sort_values(key).reset_index(drop=True)
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_seed_changes_the_sample():
+    df = profiles(2000)
+    other = StratifiedReservoir(50, seed=7)
+    other.add(df)
+    assert not reservoir_sample([df]).equals(other.result())
+
+
+def test_sample_keeps_result_order_and_size():
+    df = profiles(3000).sort_values("Date").reset_index(drop=True)
+    sample = reservoir_sample(split(df, [1500, 1500]))
+    assert len(sample) == 50
+    assert sample["Date"].is_monotonic_increasing
+    assert sample.attrs["rows_seen"] == 3000
+
+
+def test_every_stratum_is_represented_while_there_is_room():
+    df = profiles(3000)[["float_id", "Temp_adj(C)"]]
+    df.loc[2999, "float_id"] = "1900001"
+    assert "1900001" in set(reservoir_sample([df])["float_id"])
+    assert len(reservoir_sample([df])) == 50
+
+
+def test_small_result_comes_back_whole():
+    df = profiles(30)
+    sample, rows_seen = sample_chunks(split(df, [10, 20]))
+    assert rows_seen == 30
+    pd.testing.assert_frame_equal(sample, df.reset_index(drop=True), check_like=False)
+
+
+def test_empty_stream():
+    sample, rows_seen = sample_chunks([])
+    assert rows_seen == 0 and len(sample) == 0
+    assert list(reservoir_sample([profiles(0)]).columns) == list(profiles(0).columns)
+
+
+@pytest.mark.parametrize("budget", [0, 1, 100, 6000, 10 ** 9])
+def test_sample_size_stays_within_bounds(budget):
+    assert SAMPLE_MIN_ROWS <= rows_for_token_budget(profiles(500), budget) <= SAMPLE_MAX_ROWS
+
+
+def test_sample_size_follows_row_width():
+    narrow = profiles(500)[["float_id"]]
+    assert rows_for_token_budget(narrow, 2000) > rows_for_token_budget(profiles(500), 2000)
+    assert rows_for_token_budget(profiles(0)) == SAMPLE_MIN_ROWS
+
+
+def test_tablesample_only_for_raw_row_reads_of_profiles():
+    sql = tablesample_sql('SELECT "Temp_adj(C)" FROM profiles p WHERE "Date" > \'2022-01-01\'', 10_000_000, 2000)
+    assert 'FROM profiles p TABLESAMPLE SYSTEM (0.08) REPEATABLE (42) WHERE' in sql
+    assert tablesample_sql('SELECT AVG("Temp_adj(C)") FROM profiles', 10_000_000, 2000) == None
+    assert tablesample_sql('SELECT * FROM profiles LIMIT 10', 10_000_000, 2000) == None
+    assert tablesample_sql('SELECT * FROM profiles', 1000, 2000) == None
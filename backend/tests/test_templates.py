@@ -0,0 +1,56 @@
+import pytest
+from data_version.version import bump_data_version
+from generate_sql.templates import extract_slots, parameterize, fill_params, SQLTemplateStore
+
+QUESTION = "Retrieve the average salinity of float 2902277 in the year 2022"
+OTHER = "Retrieve the average salinity of float 2902999 in the year 1999"
+
+
+@pytest.mark.parametrize("sql, bounds", [
+    ("SELECT AVG(\"Psal_adj(psu)\") FROM profiles WHERE \"float_id\" = '2902277' AND \"Date\"::DATE BETWEEN '2022-01-01' AND '2022-12-31'",
+     ["1999-01-01", "1999-12-31"]),
+    ("SELECT AVG(\"Psal_adj(psu)\") FROM profiles WHERE \"float_id\" = '2902277' AND \"obs_date\" >= '2022-01-01' AND \"obs_date\" < '2023-01-01'",
+     ["1999-01-01", "2000-01-01"]),
+    ("SELECT AVG(\"Psal_adj(psu)\") FROM profiles WHERE \"float_id\" = '2902277' AND EXTRACT(YEAR FROM \"obs_date\") = 2022",
+     [1999]),
+])
+def test_year_range_of_a_float(sql, bounds):
+    _, slots = extract_slots(QUESTION)
+    template_sql, params = parameterize(sql, slots)
+    assert "2022" not in template_sql and "2023" not in template_sql and "2902277" not in template_sql
+
+    _, other_slots = extract_slots(OTHER)
+    filled = fill_params(params, other_slots)
+    assert sorted(filled.values(), key=str) == sorted(["2902999"] + bounds, key=str)
+
+
+def test_unbound_question_literal_is_not_learned():
+    _, slots = extract_slots("average temperature over the last 10 years")
+    assert parameterize("SELECT AVG(\"Temp_adj(C)\") FROM profiles WHERE obs_date > CURRENT_DATE - INTERVAL '10 years'", slots) == None
+
+
+def test_question_like_literal_not_from_the_question_is_not_learned():
+    _, slots = extract_slots("average temperature of float 2902277")
+    assert parameterize("SELECT AVG(\"Temp_adj(C)\") FROM profiles WHERE float_id = '2902277' AND obs_date >= '2020-01-01'", slots) == None
+
+
+def test_signed_numbers_are_one_literal():
+    _, slots = extract_slots("floats between latitude -10 and 5")
+    template_sql, params = parameterize('SELECT DISTINCT float_id FROM profiles WHERE "Latitude" BETWEEN -10 AND 5', slots)
+    assert template_sql.endswith("BETWEEN :s0 AND :s1")
+
+    _, other = extract_slots("floats between latitude -30 and 12")
+    assert fill_params(params, other) == {"s0": -30, "s1": 12}
+
+
+def test_store_matches_the_same_shape_and_forgets_on_a_new_data_version(tmp_path):
+    store = SQLTemplateStore(tmp_path / "templates.json", 10)
+    sql = "SELECT AVG(\"Psal_adj(psu)\") FROM profiles WHERE \"float_id\" = '2902277' AND \"obs_date\" >= '2022-01-01' AND \"obs_date\" < '2023-01-01'"
+    assert store.learn(QUESTION, "theory", "sql", sql, "all")
+
+    template_sql, params, _ = store.match(OTHER, "theory", "sql")
+    assert params == {"s0": "2902999", "s1": "1999-01-01", "s2": "2000-01-01"}
+    assert SQLTemplateStore(tmp_path / "templates.json", 10).match(OTHER, "theory", "sql") != None
+
+    bump_data_version()
+    assert store.match(OTHER, "theory", "sql") == None
@@ -56,10 +56,20 @@ interface ChartConfig {
   hoverMode: "closest" | "x" | "y" | false;
 }
 
-const CSVVisualizationDashboard: React.FC = () => {
+interface CSVVisualizationDashboardProps {
+  csvFile?: string;
+  initialPlotType?: string;
+}
+
+const API_BASE_URL = "http://localhost:8000/";
+
+const CSVVisualizationDashboard: React.FC<CSVVisualizationDashboardProps> = ({
+  csvFile = "static/plots/userId_chatId_uniqueId.csv",
+  initialPlotType = "line",
+}) => {
   const chartRef = useRef<HTMLDivElement>(null);
   const plotlyRef = useRef<any>(null);
-  const [plotType, setPlotType] = useState("line");
+  const [plotType, setPlotType] = useState(initialPlotType);
   const [csvData, setCsvData] = useState<any[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
@@ -97,9 +107,8 @@ const CSVVisualizationDashboard: React.FC = () => {
       setLoading(true);
       setError(null);
 
-      const response = await fetch(
-        "http://localhost:8000/static/plots/userId_chatId_uniqueId.csv"
-      );
+      // each plot result has its own artifact URL
+      const response = await fetch(new URL(csvFile, API_BASE_URL).toString());
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
@@ -165,7 +174,7 @@ const CSVVisualizationDashboard: React.FC = () => {
     };
 
     loadData();
-  }, []);
+  }, [csvFile]);
 
   const chartData = useMemo(() => {
     return csvData.map((row, index) => ({